@@ -2,8 +2,10 @@
 
 from pprint import pformat
 from stat import S_ISREG, S_ISLNK
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 import cmdln
+import concurrent.futures
+import hashlib
 import logging
 import os
 import re
@@ -62,6 +64,12 @@ ARCH_WHITELIST = {
 # Directory where download binary packages.
 DOWNLOADS = os.path.join(CACHEDIR, 'downloads')
 UNPACKDIR = os.path.join(CACHEDIR, 'unpacked')
+# Content addressed store of downloaded binary packages, kept across runs.
+BINARYCACHE = os.path.join(CACHEDIR, 'binaries')
+BINARYCACHE_SIZE = 10 * 1024 * 1024 * 1024
+
+CPIO_HEADER_SIZE = 110
+CPIO_BUFSIZE = 1024 * 1024
 
 so_re = re.compile(r'^(?:/usr)?/lib(?:64)?/lib([^/]+)\.so(?:\.[^/]+)?')
 debugpkg_re = re.compile(r'-debug(?:source|info)(?:-(?:32|64)bit)?$')
@@ -156,6 +164,95 @@ class LogToDB(logging.Filter):
         return True
 
 
+class DownloadCache(object):
+    """ size bounded cache of downloaded binaries
+
+    Files are stored by the sha256 of their content and looked up by
+    (project, repository, arch, filename, mtime). The least recently used
+    files are evicted once the cache grows beyond maxsize bytes.
+    """
+
+    def __init__(self, path, maxsize, logger):
+        self.objects = os.path.join(path, 'objects')
+        self.keys = os.path.join(path, 'keys')
+        self.maxsize = maxsize
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+
+    def _keyfile(self, key):
+        digest = hashlib.sha256('/'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.keys, digest[:2], digest)
+
+    def get(self, key):
+        """ return path of the cached file for key or None """
+        keyfile = self._keyfile(key)
+        try:
+            with open(keyfile, 'r') as fh:
+                path = os.path.join(self.objects, fh.read().strip())
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            if os.path.exists(keyfile):
+                os.unlink(keyfile)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, filename, keep = ()):
+        """ move filename into the cache and return its new path
+
+        The cached files in keep are still needed and not evicted.
+        """
+        h = hashlib.sha256()
+        with open(filename, 'rb') as fh:
+            while True:
+                buf = fh.read(1024 * 1024)
+                if not buf:
+                    break
+                h.update(buf)
+        digest = h.hexdigest()
+
+        for d in (self.objects, os.path.dirname(self._keyfile(key))):
+            if not os.path.exists(d):
+                os.makedirs(d)
+
+        path = os.path.join(self.objects, digest)
+        os.replace(filename, path)
+        keyfile = self._keyfile(key)
+        with open(keyfile + '.new', 'w') as fh:
+            fh.write(digest)
+        os.replace(keyfile + '.new', keyfile)
+
+        self.evict(keep = {path, *keep})
+        return path
+
+    def evict(self, keep = ()):
+        entries = []
+        total = 0
+        for fn in os.listdir(self.objects):
+            path = os.path.join(self.objects, fn)
+            st = os.stat(path)
+            total += st.st_size
+            entries.append((st.st_mtime, st.st_size, path))
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            if path in keep:
+                continue
+            self.logger.debug("evicting %s from download cache", path)
+            os.unlink(path)
+            total -= size
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        if total:
+            self.logger.info("download cache: %d hits, %d misses (%d%% hit rate)",
+                    self.hits, self.misses, 100 * self.hits // total)
+
+
 class ABIChecker(ReviewBot.ReviewBot):
     """ check ABI of library packages
     """
@@ -185,6 +282,11 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         self.current_request = None
 
+        self.download_cache = DownloadCache(BINARYCACHE, BINARYCACHE_SIZE, self.logger)
+
+        # number of concurrent abi-dumper and abi-compliance-checker jobs
+        self.jobs = os.cpu_count() or 1
+
     def check_source_submission(self, src_project, src_package, src_rev, dst_project, dst_package):
 
         # happens for maintenance incidents
@@ -366,53 +468,54 @@ class ABIChecker(ReviewBot.ReviewBot):
 
             self.logger.debug("to diff: %s", pformat(pairs))
 
-            # for each pair dump and compare the abi
-            for old, new in pairs:
-                # abi dump of old lib
-                old_base = os.path.join(UNPACKDIR, dst_project, dst_package, mr.dstrepo, mr.arch)
-                old_dump = os.path.join(CACHEDIR, 'old.dump')
-                # abi dump of new lib
-                new_base = os.path.join(UNPACKDIR, src_project, src_package, mr.srcrepo, mr.arch)
-                new_dump = os.path.join(CACHEDIR, 'new.dump')
-
-                def cleanup():
-                    if os.path.exists(old_dump):
-                        os.unlink(old_dump)
-                    if os.path.exists(new_dump):
-                        os.unlink(new_dump)
-
-                cleanup()
-
-                # we just need that to pass a name to abi checker
-                m = so_re.match(old)
-                htmlreport = f'report-{mr.srcrepo}-{os.path.basename(old)}-{mr.dstrepo}-{os.path.basename(new)}-{mr.arch}-{int(time.time()):08x}.html'
-
-                # run abichecker
-                if m \
-                    and self.run_abi_dumper(old_dump, old_base, old, dst_libdebug[old]) \
-                    and self.run_abi_dumper(new_dump, new_base, new, src_libdebug[new]):
-                        reportfn = os.path.join(CACHEDIR, htmlreport)
-                        r = self.run_abi_checker(m.group(1), old_dump, new_dump, reportfn)
-                        if r is not None:
-                            self.logger.debug('report saved to %s, compatible: %d', reportfn, r)
-                            libresults.append(LibResult(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, htmlreport, r))
-                            if overall is None:
-                                overall = r
-                            elif overall == True and r == False:
-                                overall = r
-                else:
-                    self.logger.error(f'failed to compare {old} <> {new}')
-                    self.text_summary += f"**Error**: ABI check failed on {old} vs {new}\n\n"
-                    if ret == True: # need to check again
-                        ret = None
-
-                cleanup()
+            # for each pair dump and compare the abi, all libraries of this
+            # repo are processed concurrently but collected in order
+            old_base = os.path.join(UNPACKDIR, dst_project, dst_package, mr.dstrepo, mr.arch)
+            new_base = os.path.join(UNPACKDIR, src_project, src_package, mr.srcrepo, mr.arch)
+            workdir = mkdtemp(prefix='abi-', dir=CACHEDIR)
+            try:
+                jobs = []
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    for old, new in sorted(pairs):
+                        # we just need that to pass a name to abi checker
+                        m = so_re.match(old)
+                        htmlreport = f'report-{mr.srcrepo}-{os.path.basename(old)}-{mr.dstrepo}-{os.path.basename(new)}-{mr.arch}-{int(time.time()):08x}.html'
+                        future = None
+                        if m:
+                            future = executor.submit(self.compare_lib, m.group(1),
+                                                     (old_base, old, dst_libdebug[old]),
+                                                     (new_base, new, src_libdebug[new]),
+                                                     os.path.join(workdir, str(len(jobs))),
+                                                     os.path.join(CACHEDIR, htmlreport))
+                        jobs.append((old, new, htmlreport, future))
+
+                    for old, new, htmlreport, future in jobs:
+                        dumped, r, errors = future.result() if future else (False, None, [])
+                        for error in errors:
+                            self.logger.error(error)
+                        if dumped:
+                            if r is not None:
+                                self.logger.debug('report saved to %s, compatible: %d', htmlreport, r)
+                                libresults.append(LibResult(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, htmlreport, r))
+                                if overall is None:
+                                    overall = r
+                                elif overall == True and r == False:
+                                    overall = r
+                        else:
+                            self.logger.error(f'failed to compare {old} <> {new}')
+                            self.text_summary += f"**Error**: ABI check failed on {old} vs {new}\n\n"
+                            if ret == True: # need to check again
+                                ret = None
+            finally:
+                shutil.rmtree(workdir)
 
         if missing_debuginfo:
             self.text_summary += 'debug information is missing for the following packages, can\'t check:\n<pre>'
             self.text_summary += ''.join(missing_debuginfo)
             self.text_summary += '</pre>\nplease enable debug info in your project config.\n'
 
+        self.download_cache.log_stats()
+
         self.reports.append(report._replace(result = overall, reports = libresults))
 
         # upload reports
@@ -648,7 +751,29 @@ class ABIChecker(ReviewBot.ReviewBot):
             #self.commentapi.delete_from_where_user(self.review_user, request_id = req.reqid)
             self.commentapi.add_comment(request_id = req.reqid, comment = msg)
 
-    def run_abi_checker(self, libname, old, new, output):
+    def compare_lib(self, libname, old, new, workdir, reportfn):
+        """ dump and compare one library pair, called from worker threads
+
+        old and new are (base, filename, debuglib) tuples. Errors are
+        returned rather than logged since the logger writes to the db.
+        Returns a tuple (dumped, compatible, errors).
+        """
+        os.makedirs(workdir)
+        old_dump = os.path.join(workdir, 'old.dump')
+        new_dump = os.path.join(workdir, 'new.dump')
+        errors = []
+
+        for dump, (base, filename, debuglib) in ((old_dump, old), (new_dump, new)):
+            if not self.run_abi_dumper(dump, base, filename, debuglib, cwd = workdir):
+                errors.append(f"failed to dump {filename}!")
+                return False, None, errors
+
+        r = self.run_abi_checker(libname, old_dump, new_dump, reportfn, cwd = workdir)
+        if r is None:
+            errors.append('abi-compliance-checker failed')
+        return True, r, errors
+
+    def run_abi_checker(self, libname, old, new, output, cwd = CACHEDIR):
         cmd = ['abi-compliance-checker',
                 '-lib', libname,
                 '-old', old,
@@ -656,23 +781,21 @@ class ABIChecker(ReviewBot.ReviewBot):
                 '-report-path', output
                 ]
         self.logger.debug(cmd)
-        r = subprocess.Popen(cmd, close_fds=True, cwd=CACHEDIR).wait()
+        r = subprocess.Popen(cmd, close_fds=True, cwd=cwd).wait()
         if r not in (0, 1):
-            self.logger.error('abi-compliance-checker failed')
             # XXX: record error
             return None
         return r == 0
 
-    def run_abi_dumper(self, output, base, filename, debuglib):
+    def run_abi_dumper(self, output, base, filename, debuglib, cwd = CACHEDIR):
         cmd = ['abi-dumper',
                 '-o', output,
                 '-lver', os.path.basename(filename),
                 '/'.join([base, filename])]
         cmd.append('/'.join([base, debuglib]))
         self.logger.debug(cmd)
-        r = subprocess.Popen(cmd, close_fds=True, cwd=CACHEDIR).wait()
+        r = subprocess.Popen(cmd, close_fds=True, cwd=cwd).wait()
         if r != 0:
-            self.logger.error(f"failed to dump {filename}!")
             # XXX: record error
             return False
         return True
@@ -701,46 +824,74 @@ class ABIChecker(ReviewBot.ReviewBot):
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
             # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
+            wanted = set(liblist) | set(debugfiles)
+            dst = os.path.join(UNPACKDIR, project, package, repo, arch)
             for fn in fetchlist:
                 self.logger.debug(f"extract {fn}")
-                with open(tmpfile, 'wb') as tmpfd:
-                    if fn not in downloaded:
-                        raise FetchError(f"{fn} was not downloaded!")
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError(f"failed to extract {fn}!")
-                    tmpfd.close()
-                    os.unlink(downloaded[fn])
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename.decode('utf-8')
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if fn not in liblist and fn not in debugfiles:
-                            continue
-                        dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
-                        if not os.path.exists(os.path.dirname(dst)):
-                            os.makedirs(os.path.dirname(dst))
-                        self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
-                            with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == b'':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
+                if fn not in downloaded:
+                    raise FetchError(f"{fn} was not downloaded!")
+                self.logger.debug(downloaded[fn])
+                self.extract_rpm(downloaded[fn], wanted, dst)
 
             return liblist, debuglist
 
+    def extract_rpm(self, filename, wanted, dst):
+        """ extract the files listed in wanted from the rpm payload to dst
+
+        The payload is decompressed by rpm2cpio and parsed as it streams
+        through the pipe so only the wanted members ever hit the disk.
+        """
+        proc = subprocess.Popen(['rpm2cpio', filename], stdout=subprocess.PIPE, close_fds=True)
+        try:
+            for name, size in self._cpio_members(proc.stdout):
+                if name.startswith('./'): # rpm payload is relative
+                    name = name[1:]
+                self.logger.debug("cpio fn %s", name)
+                if name not in wanted:
+                    self._cpio_copy(proc.stdout, size, None)
+                    continue
+                target = dst + name
+                if not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                self.logger.debug("dst %s", target)
+                with open(target, 'wb') as fh:
+                    self._cpio_copy(proc.stdout, size, fh)
+        finally:
+            # drain so rpm2cpio does not die from SIGPIPE before we wait
+            while proc.stdout.read(CPIO_BUFSIZE):
+                pass
+            r = proc.wait()
+        if r != 0:
+            raise FetchError(f"failed to extract {filename}!")
+
+    def _cpio_members(self, fh):
+        """ yield (name, size) for each member of a newc cpio stream
+
+        The caller has to consume exactly size bytes before the next member.
+        """
+        while True:
+            header = fh.read(CPIO_HEADER_SIZE)
+            if len(header) != CPIO_HEADER_SIZE or header[:6] not in (b'070701', b'070702'):
+                raise FetchError("invalid cpio header")
+            size = int(header[54:62], 16)
+            namesize = int(header[94:102], 16)
+            name = fh.read(namesize)[:-1].decode('utf-8')
+            # header and name are padded to a multiple of four
+            fh.read((4 - (CPIO_HEADER_SIZE + namesize) % 4) % 4)
+            if name == 'TRAILER!!!':
+                return
+            yield name, size
+            fh.read((4 - size % 4) % 4)
+
+    def _cpio_copy(self, fh, size, out):
+        while size > 0:
+            buf = fh.read(min(size, CPIO_BUFSIZE))
+            if not buf:
+                raise FetchError("truncated cpio archive")
+            if out is not None:
+                out.write(buf)
+            size -= len(buf)
+
     def download_files(self, project, package, repo, arch, filenames, mtimes):
         downloaded = dict()
         for fn in filenames:
@@ -750,16 +901,26 @@ class ABIChecker(ReviewBot.ReviewBot):
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
             t = os.path.join(repodir, fn)
-            self._get_binary_file(project, repo, arch, package, fn, t, mtimes[fn])
-            downloaded[fn] = t
+            # the whole batch is extracted afterwards, so none of it may be evicted
+            downloaded[fn] = self._get_binary_file(project, repo, arch, package, fn, t, mtimes[fn],
+                                                   keep = set(downloaded.values()))
         return downloaded
 
-    def _get_binary_file(self, project, repository, arch, package, filename, target, mtime):
-        """Get a binary file from OBS."""
-        # Used to cache, but dropped as part of python3 migration.
+    def _get_binary_file(self, project, repository, arch, package, filename, target, mtime, keep = ()):
+        """Get a binary file from OBS or the download cache.
+
+        Returns the path of the file in the cache. The cached files in keep
+        are not evicted to make room for it."""
+        key = (project, repository, arch, filename, mtime)
+        path = self.download_cache.get(key)
+        if path is not None:
+            self.logger.debug(f"using cached {filename}")
+            return path
+
         osc.core.get_binary_file(self.apiurl, project, repository, arch,
                                  filename, package=package,
                                  target_filename=target)
+        return self.download_cache.put(key, target, keep)
 
     def readRpmHeaderFD(self, fd):
         h = None
@@ -1083,6 +1244,10 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         parser.add_option("--force", action="store_true", help="recheck requests that are already considered done")
         parser.add_option("--no-review", action="store_true", help="don't actually accept or decline, just comment")
         parser.add_option("--web-url", metavar="URL", help="URL of web service")
+        parser.add_option("--download-cache-size", metavar="GB", type="int",
+                help="size limit of the binary download cache in GiB (default: 10)")
+        parser.add_option("--jobs", metavar="N", type="int",
+                help="number of libraries to dump and compare concurrently (default: number of cpus)")
         return parser
 
     def postoptparse(self):
@@ -1102,6 +1267,10 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
             bot.no_review = True
         if self.options.force:
             bot.force = True
+        if self.options.download_cache_size is not None:
+            bot.download_cache.maxsize = self.options.download_cache_size * 1024 * 1024 * 1024
+        if self.options.jobs is not None:
+            bot.jobs = max(1, self.options.jobs)
 
         return bot
 
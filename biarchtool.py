@@ -3,15 +3,34 @@
 from lxml import etree as ET
 import sys
 import cmdln
+import difflib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 
+from osc.core import http_GET, makeurl
+from osclib.memoize import memoize
+
 import ToolBase
 
 logger = logging.getLogger()
 
 FACTORY = "openSUSE:Factory"
 
+# Number of package metas written concurrently
+PUT_WORKERS = 4
+
+
+@memoize(ttl=60 * 60 * 24 * 30)
+def source_filelist(apiurl, project, package, revision):
+    """Return the file names of a package source revision.
+
+    The revision is a srcmd5 which identifies the content, so the result is
+    kept until it expires from the cache.
+    """
+    root = ET.parse(http_GET(makeurl(apiurl, ['source', project, package], {'rev': revision}))).getroot()
+    return [node.get('name') for node in root.findall('entry')]
+
 
 class BiArchTool(ToolBase.ToolBase):
 
@@ -20,10 +39,17 @@ class BiArchTool(ToolBase.ToolBase):
         self.project = project
         self.biarch_packages = None
         self._has_baselibs = dict()
+        self.sourceinfo = None
         self.packages = []
         self.arch = 'i586'
         self.rdeps = None
         self.package_metas = dict()
+        # Serialized meta per package as last loaded and as last known on OBS
+        self.package_metas_loaded = dict()
+        self.package_metas_saved = dict()
+        # Packages with changed meta -> whether to wipe the binaries
+        self.changeset = dict()
+        self.put_workers = PUT_WORKERS
         self.whitelist = {
             'i586': set([
                 'bzr',
@@ -48,7 +74,26 @@ class BiArchTool(ToolBase.ToolBase):
                 '000release-packages'])
         }
 
+    def _init_sourceinfo(self):
+        """Load the source revisions of all packages with one request."""
+        if self.sourceinfo is not None:
+            return
+        self.sourceinfo = dict()
+        url = self.makeurl(['source', self.project], {'view': 'info', 'nofilename': 1})
+        root = ET.fromstring(self.cached_GET(url))
+        for si in root.findall('sourceinfo'):
+            srcmd5 = si.get('srcmd5')
+            if srcmd5 is None:
+                continue
+            # lsrcmd5 is the revision of the link itself, srcmd5 the expanded one
+            self.sourceinfo[si.get('package')] = (si.get('lsrcmd5', srcmd5), srcmd5)
+
     def get_filelist(self, project, package, expand=False):
+        self._init_sourceinfo()
+        if package in self.sourceinfo:
+            lsrcmd5, srcmd5 = self.sourceinfo[package]
+            return source_filelist(self.apiurl, self.project, package, srcmd5 if expand else lsrcmd5)
+
         query = {}
         if expand:
             query['expand'] = 1
@@ -120,6 +165,68 @@ class BiArchTool(ToolBase.ToolBase):
         for p in root.findall('package'):
             name = p.attrib['name']
             self.package_metas[name] = p
+            # an unchanged search result may predate our own writes
+            data = ET.tostring(p)
+            if self.package_metas_loaded.get(name) != data:
+                self.package_metas_loaded[name] = data
+                self.package_metas_saved[name] = data
+
+    def meta_changed(self, package, wipebinaries=False):
+        """Add the changed meta of package to the change set."""
+        self.changeset[package] = wipebinaries
+
+    def _apply_change(self, package, data, wipebinaries):
+        pkgmetaurl = self.makeurl(['source', self.project, package, '_meta'])
+        try:
+            self.http_PUT(pkgmetaurl, data=data)
+            if wipebinaries:
+                logger.debug("wiping %s", package)
+                self.http_POST(self.makeurl(['build', self.project], {
+                    'cmd': 'wipe',
+                    'arch': self.arch,
+                    'package': package}))
+        except HTTPError as e:
+            logger.error('failed to update %s: %s', package, e)
+            return False
+        return True
+
+    def apply_changes(self):
+        """Write the metas in the change set which differ from the saved ones.
+
+        In dry run mode the differences are only logged.
+        """
+        changeset = self.changeset
+        self.changeset = dict()
+
+        todo = dict()
+        for package in sorted(changeset):
+            data = ET.tostring(self.package_metas[package])
+            if data == self.package_metas_saved.get(package):
+                logger.debug('%s meta unchanged', package)
+                continue
+            todo[package] = data
+        skipped = len(changeset) - len(todo)
+
+        if self.dryrun:
+            for package in todo:
+                old = ET.tostring(ET.fromstring(self.package_metas_saved[package]), pretty_print=True)
+                new = ET.tostring(self.package_metas[package], pretty_print=True)
+                diff = difflib.unified_diff(old.decode('utf-8').splitlines(), new.decode('utf-8').splitlines(),
+                                            f'{package}/_meta', f'{package}/_meta', lineterm='')
+                logger.info('\n'.join(diff))
+            logger.info('would change %d package metas, %d unchanged', len(todo), skipped)
+            return
+
+        if todo:
+            logger.info("applying changes to %d package metas, %d unchanged", len(todo), skipped)
+        with ThreadPoolExecutor(max_workers=self.put_workers) as executor:
+            results = executor.map(lambda package: self._apply_change(package, todo[package], changeset[package]), todo)
+            for package, success in zip(todo, list(results)):
+                if not success:
+                    continue
+                self.package_metas_saved[package] = todo[package]
+                if self.caching:
+                    self._invalidate__cached_GET(self.makeurl(['source', self.project, package, '_meta']))
 
     def _init_rdeps(self):
         if self.rdeps is not None:
@@ -173,13 +280,9 @@ class BiArchTool(ToolBase.ToolBase):
                     changed = True
 
             if changed:
-                try:
-                    pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                    self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                    if self.caching:
-                        self._invalidate__cached_GET(pkgmetaurl)
-                except HTTPError as e:
-                    logger.error('failed to update %s: %s', pkg, e)
+                self.meta_changed(pkg)
+
+        self.apply_changes()
 
     def add_explicit_disable(self, wipebinaries=False):
 
@@ -205,22 +308,12 @@ class BiArchTool(ToolBase.ToolBase):
                 changed = True
 
             if changed:
-                try:
-                    pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                    self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                    if self.caching:
-                        self._invalidate__cached_GET(pkgmetaurl)
-                    if wipebinaries:
-                        self.http_POST(self.makeurl(['build', self.project], {
-                            'cmd': 'wipe',
-                            'arch': self.arch,
-                            'package': pkg}))
-                except HTTPError as e:
-                    logger.error('failed to update %s: %s', pkg, e)
+                self.meta_changed(pkg, wipebinaries)
+
+        self.apply_changes()
 
     def enable_baselibs_packages(self, force=False, wipebinaries=False):
         self._init_biarch_packages()
-        todo = dict()
         for pkg in self.packages:
             logger.debug("processing %s", pkg)
             if pkg not in self.package_metas:
@@ -279,26 +372,10 @@ class BiArchTool(ToolBase.ToolBase):
                     logger.error('build tag not found in %s/%s!?', pkg, self.arch)
 
             if changed:
-                todo[pkg] = pkgmeta
+                wipe = wipebinaries and pkgmeta.find(f"./build/disable[@arch='{self.arch}']") is not None
+                self.meta_changed(pkg, wipe)
 
-        if todo:
-            logger.info("applying changes")
-        for pkg in sorted(todo.keys()):
-            pkgmeta = todo[pkg]
-            try:
-                pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                if self.caching:
-                    self._invalidate__cached_GET(pkgmetaurl)
-
-                if wipebinaries and pkgmeta.find(f"./build/disable[@arch='{self.arch}']") is not None:
-                    logger.debug("wiping %s", pkg)
-                    self.http_POST(self.makeurl(['build', self.project], {
-                        'cmd': 'wipe',
-                        'arch': self.arch,
-                        'package': pkg}))
-            except HTTPError as e:
-                logger.error('failed to update %s: %s', pkg, e)
+        self.apply_changes()
 
 
 class CommandLineInterface(ToolBase.CommandLineInterface):
@@ -2,12 +2,17 @@
 
 import difflib
 import glob
+import hashlib
 import os
 import re
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Set
 from cmdln import CmdlnOptionParser
 
@@ -15,6 +20,7 @@ from lxml import etree as ET
 
 import osc.conf
 import osc.core
+from osclib.cache_manager import CacheManager
 from osclib.conf import Config
 from osclib.core import devel_project_get
 from osclib.core import devel_project_fallback
@@ -30,6 +36,83 @@ from urllib.error import HTTPError
 import ReviewBot
 from osclib.conf import str2bool
 
+# Archives are only downloaded once the complete sources are needed, up to
+# then an empty file takes their place. Everything else, like spec files,
+# changes and patches, is read by the checks running before, however large.
+LAZY_FILE_RE = re.compile(r'\.(tar|tgz|tbz2?|txz|tzst|zip|gem|obscpio|crate|jar|rpm|gz|bz2|xz|zst|lz|7z)$')
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# The source validators and download_files run concurrently, each at most for
+# VALIDATOR_TIMEOUT seconds. Whether download_files is still needed is checked
+# every COMMAND_POLL_INTERVAL seconds.
+SOURCE_VALIDATORS_DIR = '/usr/lib/obs/service/source_validators'
+DOWNLOAD_FILES = '/usr/lib/obs/service/download_files'
+VALIDATOR_WORKERS = 4
+VALIDATOR_TIMEOUT = 30 * 60
+COMMAND_POLL_INTERVAL = 0.5
+
+
+class SourceFiles(object):
+    """Place package sources into directories from a local store of files
+    addressed by their md5, so that the same file is only downloaded once."""
+
+    def __init__(self, apiurl, store=None):
+        self.apiurl = apiurl
+        self.store = store or CacheManager.directory('check_source', 'files')
+        self.pending = []
+        self.downloaded = 0
+
+    def checkout(self, project, package, directory, revision=None):
+        """Place the expanded sources of package into directory."""
+        query = {'expand': 1}
+        if revision:
+            query['rev'] = revision
+        url = osc.core.makeurl(self.apiurl, ['source', project, package], query)
+        root = ET.parse(osc.core.http_GET(url)).getroot()
+        srcmd5 = root.get('srcmd5')
+
+        os.makedirs(directory)
+        for entry in root.findall('entry'):
+            name = entry.get('name')
+            item = (project, package, srcmd5, name, entry.get('md5'), os.path.join(directory, name))
+            if LAZY_FILE_RE.search(name):
+                open(item[-1], 'w').close()
+                self.pending.append(item)
+            else:
+                self.place(*item)
+
+    def complete(self):
+        """Place the files left out by checkout()."""
+        pending = self.pending
+        self.pending = []
+        for item in pending:
+            self.place(*item)
+
+    def place(self, project, package, revision, name, md5, path):
+        stored = os.path.join(self.store, md5[:2], md5)
+        if not os.path.exists(stored):
+            self.download(project, package, revision, name, md5, stored)
+        shutil.copyfile(stored, path)
+
+    def download(self, project, package, revision, name, md5, stored):
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        url = osc.core.makeurl(self.apiurl, ['source', project, package, name], {'rev': revision})
+        tmpfile = f'{stored}.{os.getpid()}'
+        digest = hashlib.md5()
+        response = osc.core.http_GET(url)
+        with open(tmpfile, 'wb') as f:
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != md5:
+            os.unlink(tmpfile)
+            raise RuntimeError(f'md5 mismatch of {project}/{package}/{name}')
+        os.rename(tmpfile, stored)
+        self.downloaded += 1
+
 
 class CheckSource(ReviewBot.ReviewBot):
 
@@ -236,21 +319,18 @@ class CheckSource(ReviewBot.ReviewBot):
         os.makedirs(copath)
         os.chdir(copath)
 
+        # Only the files the checks need are placed right away, the others
+        # once the source validators run.
+        sources = SourceFiles(self.apiurl)
         try:
-            CheckSource.checkout_package(self.apiurl, target_project, target_package, pathname=copath,
-                                         server_service_files=True, expand_link=True)
-            shutil.rmtree(os.path.join(target_package, '.osc'))
-            os.rename(target_package, '_old')
+            sources.checkout(target_project, target_package, '_old')
         except HTTPError as e:
             if e.code == 404:
                 self.logger.info(f'target package does not exist {target_project}/{target_package}')
             else:
                 raise e
 
-        CheckSource.checkout_package(self.apiurl, source_project, source_package, revision=source_revision,
-                                     pathname=copath, server_service_files=True, expand_link=True)
-        os.rename(source_package, target_package)
-        shutil.rmtree(os.path.join(target_package, '.osc'))
+        sources.checkout(source_project, source_package, target_package, revision=source_revision)
 
         new_info = self.package_source_parse(source_project, source_package, source_revision, target_package)
         filename = new_info.get('filename', '')
@@ -273,18 +353,33 @@ class CheckSource(ReviewBot.ReviewBot):
         if specs and not self.check_spec_policy('_old', target_package, specs):
             return False
 
-        if not self.run_source_validator('_old', target_package):
-            return False
+        sources.complete()
+        self.logger.debug(f'downloaded {sources.downloaded} source files')
+        cancel = threading.Event()
+        with ThreadPoolExecutor(max_workers=VALIDATOR_WORKERS) as executor:
+            # Fetching the upstream sources takes longest, so it starts first
+            # even though its result only counts once the other checks passed.
+            # download_files is killed when one of them declines or fails.
+            urls = executor.submit(self.check_urls, '_old', target_package, specs, cancel)
+            try:
+                if not self.run_source_validator('_old', target_package, executor):
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return False
 
-        if specs and not self.detect_mentioned_patches('_old', target_package, specs):
-            return False
+                if specs and not self.detect_mentioned_patches('_old', target_package, specs):
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return False
 
-        if not self.check_urls('_old', target_package, specs):
-            osc.core.change_review_state(apiurl=self.apiurl,
-                                         reqid=self.request.reqid, newstate='new',
-                                         by_group=self.review_group,
-                                         by_user=self.review_user, message=self.review_messages['new'])
-            return None
+                urls_valid = urls.result()
+            finally:
+                cancel.set()
+
+            if not urls_valid:
+                osc.core.change_review_state(apiurl=self.apiurl,
+                                             reqid=self.request.reqid, newstate='new',
+                                             by_group=self.review_group,
+                                             by_user=self.review_user, message=self.review_messages['new'])
+                return None
 
         shutil.rmtree(copath)
         self.review_messages['accepted'] = 'Check script succeeded'
@@ -493,16 +588,6 @@ class CheckSource(ReviewBot.ReviewBot):
         else:
             return action.person_name == user and action.person_role == 'maintainer'
 
-    @staticmethod
-    def checkout_package(*args, **kwargs):
-        _stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-        try:
-            result = osc.core.checkout_package(*args, **kwargs)
-        finally:
-            sys.stdout = _stdout
-        return result
-
     def _package_source_parse(self, project, package, revision=None, repository=None):
         query = {'view': 'info', 'parse': 1}
         if revision:
@@ -615,21 +700,56 @@ class CheckSource(ReviewBot.ReviewBot):
         self.review_messages['accepted'] = 'unhandled: removing repository'
         return True
 
-    def run_source_validator(self, old, directory):
-        scripts = glob.glob("/usr/lib/obs/service/source_validators/*")
+    def run_command(self, name, args, cwd=None, cancel=None):
+        """Run args and return the return code, None on timeout or once the
+        cancel event is set, and the output."""
+        start = time.monotonic()
+        # A session of its own, so that the children are killed as well
+        with subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              start_new_session=True) as process:
+            while True:
+                try:
+                    output, _ = process.communicate(timeout=COMMAND_POLL_INTERVAL)
+                    returncode = process.returncode
+                    break
+                except subprocess.TimeoutExpired:
+                    if time.monotonic() - start < VALIDATOR_TIMEOUT and not (cancel and cancel.is_set()):
+                        continue
+                    os.killpg(process.pid, signal.SIGKILL)
+                    output, _ = process.communicate()
+                    returncode = None
+                    break
+        self.logger.info(f'{name} took {time.monotonic() - start:.1f}s')
+        return returncode, output.decode('utf-8', errors='replace')
+
+    def run_source_validator(self, old, directory, executor=None):
+        scripts = sorted(script for script in glob.glob(os.path.join(SOURCE_VALIDATORS_DIR, '*'))
+                         if not os.path.isdir(script))
         if not scripts:
-            raise RuntimeError.new('Missing source validator')
-        for script in scripts:
-            if os.path.isdir(script):
-                continue
-            res = subprocess.run([script, '--batchmode', directory, old], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            if res.returncode:
+            raise RuntimeError('Missing source validator')
+
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=VALIDATOR_WORKERS) as executor:
+                return self.run_source_validator(old, directory, executor)
+
+        futures = [executor.submit(self.run_command, os.path.basename(script), [script, '--batchmode', directory, old])
+                   for script in scripts]
+        # Look at the results in the order of the scripts, so that the same
+        # sources are always declined with the same message.
+        for script, future in zip(scripts, futures):
+            returncode, output = future.result()
+            if returncode is None:
+                for pending in futures:
+                    pending.cancel()
+                raise RuntimeError(f'Source validator {os.path.basename(script)} timed out')
+
+            if returncode:
                 text = "Source validator failed. Try \"osc service runall source_validator\"\n"
-                text += res.stdout.decode('utf-8')
+                text += output
                 self.review_messages['declined'] = text
                 return False
 
-            for line in res.stdout.decode('utf-8').split("\n"):
+            for line in output.split("\n"):
                 # pimp up some warnings
                 if re.search(r'Attention.*not mentioned', line):
                     line = re.sub(r'\(W\) ', '', line)
@@ -656,19 +776,32 @@ class CheckSource(ReviewBot.ReviewBot):
             wf.close()
             os.rename(nspecfn, specfn)
 
-    def check_urls(self, old, directory, specs):
-        self._snipe_out_existing_urls(old, directory, specs)
-        oldcwd = os.getcwd()
+    def check_urls(self, old, directory, specs, cancel=None):
         with tempfile.TemporaryDirectory() as tmpdir:
-            os.chdir(directory)
-            res = subprocess.run(["/usr/lib/obs/service/download_files", "--enforceupstream",
-                                  "yes", "--enforcelocal", "yes", "--outdir", tmpdir], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            if res.returncode:
+            # The source validators read the sources at the same time, so the
+            # existing URLs are sniped out of copies of the spec files.
+            workdir = os.path.join(tmpdir, os.path.basename(directory))
+            outdir = os.path.join(tmpdir, '_out')
+            os.mkdir(workdir)
+            os.mkdir(outdir)
+            for name in os.listdir(directory):
+                path = os.path.abspath(os.path.join(directory, name))
+                if name in specs:
+                    shutil.copy(path, workdir)
+                else:
+                    os.symlink(path, os.path.join(workdir, name))
+            self._snipe_out_existing_urls(old, workdir, specs)
+
+            returncode, output = self.run_command('download_files', [DOWNLOAD_FILES, "--enforceupstream", "yes",
+                                                                     "--enforcelocal", "yes", "--outdir", outdir],
+                                                  cwd=workdir, cancel=cancel)
+            if returncode is None:
+                self.review_messages['new'] = f"Checking the source URLs timed out after {VALIDATOR_TIMEOUT}s.\n" + output
+                return False
+            if returncode:
                 self.review_messages['new'] = "Source URLs are not valid. Try `osc service runall download_files`.\n" + \
-                    res.stdout.decode('utf-8')
-                os.chdir(oldcwd)
+                    output
                 return False
-        os.chdir(oldcwd)
         return True
 
     def difflines(self, oldf, newf):
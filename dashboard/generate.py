@@ -1,19 +1,45 @@
 #!/usr/bin/python3
 
 import argparse
+import json
 import logging
+import os
 import osc
+import threading
+import time
 import yaml
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from osc.core import http_GET, makeurl, show_project_meta
+from osclib.cache_manager import CacheManager
 from osclib.core import attribute_value_load
 from lxml import etree as ET
 from openqa_client.client import OpenQA_Client
 from urllib.error import HTTPError
+from urllib.parse import urlparse
 from datetime import datetime, timezone
 
 from flask import Flask, render_template
 
 
+# repositories shown in the dashboard, prefetched for every project
+REPOSITORIES = ('standard', 'images', 'containerfile')
+LEAP_REPOSITORIES = ('standard', 'ports', 'step', 'images')
+
+# build summary of a repository without results, not cached
+BUILD_SUMMARY_UNKNOWN = {'building': -1}
+
+# seconds a fetched section stays valid in the cache
+TTL = {
+    'all_archs': 12 * 60 * 60,
+    'ttm_version': 30 * 60,
+    'ttm_status': 5 * 60,
+    'build_summary': 5 * 60,
+    'openqa': 5 * 60,
+}
+
+
 class Fetcher(object):
     def __init__(self, apiurl, opts):
         self.projects = []
@@ -23,13 +49,95 @@ class Fetcher(object):
             openqa_url = 'https://openqa.suse.de'
         else:
             openqa_url = 'https://openqa.opensuse.org'
+        self.openqa_url = openqa_url
         self.openqa = OpenQA_Client(openqa_url)
 
+        self.workers = getattr(opts, 'workers', 8)
+        self.host_workers = getattr(opts, 'host_workers', 4)
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.host_workers))
+        self.host_slots_lock = threading.Lock()
+        self.timings = defaultdict(float)
+        self.timings_lock = threading.Lock()
+        self.cache_dir = None
+        if not getattr(opts, 'no_cache', False):
+            self.cache_dir = getattr(opts, 'cache_dir', None) or CacheManager.directory('dashboard')
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, url):
+        """Limit the concurrent requests to the host of url."""
+        with self.host_slots_lock:
+            slot = self.host_slots[urlparse(url).netloc]
+        with slot:
+            yield
+
+    def cache_path(self, project):
+        return os.path.join(self.cache_dir, f'{project}.json')
+
+    def cache_load(self, project):
+        self.cache[project] = {}
+        if not self.cache_dir:
+            return
+        try:
+            with open(self.cache_path(project)) as f:
+                self.cache[project] = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def cache_save(self):
+        if not self.cache_dir:
+            return
+        for project, entries in self.cache.items():
+            path = self.cache_path(project)
+            with open(path + '.new', 'w') as f:
+                json.dump(entries, f)
+            os.replace(path + '.new', path)
+
+    def fetch(self, project, section, key, function, *args):
+        """Return the cached value of a section or call function to fetch it.
+
+        The time spent is accounted to the project and section.
+        """
+        start = time.monotonic()
+        with self.cache_lock:
+            entry = self.cache.setdefault(project, {}).get(key)
+        if entry and time.time() - entry[0] < TTL[section]:
+            value = entry[1]
+        else:
+            value = function(*args)
+            if value != BUILD_SUMMARY_UNKNOWN:
+                with self.cache_lock:
+                    self.cache[project][key] = [time.time(), value]
+        with self.timings_lock:
+            self.timings[(project, section)] += time.monotonic() - start
+        return value
+
+    def fetch_all(self):
+        """Fetch the data of all added projects concurrently."""
+        for project in self.projects:
+            self.cache_load(project.name)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for project in self.projects:
+                project.fetch(executor)
+            for project in self.projects:
+                project.collect()
+        self.cache_save()
+
+    def timing_report(self):
+        total = defaultdict(float)
+        for (project, section), seconds in sorted(self.timings.items()):
+            logging.info(f'{project:50} {section:15} {seconds:7.2f}s')
+            total[project] += seconds
+        for project, seconds in total.items():
+            logging.info(f'{project:50} {"total":15} {seconds:7.2f}s')
+
     def openqa_results(self, openqa_group, snapshot):
         jobs = {}
         if not openqa_group or not snapshot:
             return jobs
-        result = self.openqa.openqa_request('GET', 'jobs', {'groupid': openqa_group, 'build': snapshot, 'latest': 1})
+        with self.host_slot(self.openqa_url):
+            result = self.openqa.openqa_request('GET', 'jobs', {'groupid': openqa_group, 'build': snapshot, 'latest': 1})
         for job in result['jobs']:
             if job['clone_id'] or job['result'] == 'obsoleted':
                 continue
@@ -41,6 +149,14 @@ class Fetcher(object):
             jobs.setdefault(key, []).append(job['name'])
         return jobs
 
+    @property
+    def is_leap(self):
+        # same as the template, the first project decides the layout
+        return bool(self.projects) and 'Factory' not in self.projects[0].name
+
+    def repositories(self):
+        return LEAP_REPOSITORIES if self.is_leap else REPOSITORIES
+
     def add(self, name, **kwargs):
         # cyclic dependency!
         self.projects.append(Project(self, name, kwargs))
@@ -48,10 +164,10 @@ class Fetcher(object):
     def build_summary(self, project, repository):
         url = makeurl(self.apiurl, ['build', project, '_result'], {'repository': repository, 'view': 'summary'})
         try:
-            f = http_GET(url)
+            with self.host_slot(self.apiurl):
+                root = ET.parse(http_GET(url)).getroot()
         except HTTPError:
-            return {'building': -1}
-        root = ET.parse(f).getroot()
+            return dict(BUILD_SUMMARY_UNKNOWN)
         failed = 0
         unresolvable = 0
         building = 0
@@ -80,14 +196,15 @@ class Fetcher(object):
             building += unresolvable
             unresolvable = 0
         if building + failed + succeeded == 0:
-            return {'building': -1}
+            return dict(BUILD_SUMMARY_UNKNOWN)
         return {'building': 10000 - int(building * 10000 / (building + failed + succeeded + broken)),
                 'failed': failed,
                 'broken': broken,
                 'unresolvable': unresolvable}
 
     def generate_all_archs(self, project):
-        meta = ET.fromstringlist(show_project_meta(self.apiurl, project))
+        with self.host_slot(self.apiurl):
+            meta = ET.fromstringlist(show_project_meta(self.apiurl, project))
         archs = set()
         for arch in meta.findall('.//arch'):
             archs.add(arch.text)
@@ -97,13 +214,15 @@ class Fetcher(object):
         return '&'.join(result)
 
     def fetch_ttm_status(self, project):
-        text = attribute_value_load(self.apiurl, project, 'ToTestManagerStatus')
+        with self.host_slot(self.apiurl):
+            text = attribute_value_load(self.apiurl, project, 'ToTestManagerStatus')
         if text:
             return yaml.safe_load(text)
         return dict()
 
     def fetch_product_version(self, project):
-        return attribute_value_load(self.apiurl, project, 'ProductVersion')
+        with self.host_slot(self.apiurl):
+            return attribute_value_load(self.apiurl, project, 'ProductVersion')
 
 
 class Project(object):
@@ -115,18 +234,50 @@ class Project(object):
         self.openqa_group = kwargs.get('openqa_group')
         self.openqa_id = kwargs.get('openqa_groupid')
         self.download_url = kwargs.get('download_url')
-        self.all_archs = fetcher.generate_all_archs(name)
-        self.ttm_status = fetcher.fetch_ttm_status(name)
-        self.ttm_version = fetcher.fetch_product_version(name)
+        self.all_archs = None
+        self.ttm_status = None
+        self.ttm_version = None
+        self.build_summaries = {}
+        self.openqa_jobs = None
+        self.futures = {}
 
-    def build_summary(self, repo):
-        return fetcher.build_summary(self.name, repo)
+    def fetch(self, executor):
+        """Submit the requests for all data of the project to executor."""
+        fetcher = self.fetcher
+        self.futures = {
+            'all_archs': executor.submit(fetcher.fetch, self.name, 'all_archs', 'all_archs',
+                                         fetcher.generate_all_archs, self.name),
+            'ttm_version': executor.submit(fetcher.fetch, self.name, 'ttm_version', 'ttm_version',
+                                           fetcher.fetch_product_version, self.name),
+            'status': executor.submit(self.fetch_status),
+        }
+        for repo in fetcher.repositories():
+            self.futures[repo] = executor.submit(fetcher.fetch, self.name, 'build_summary', f'build_summary/{repo}',
+                                                 fetcher.build_summary, self.name, repo)
+
+    def fetch_status(self):
+        # openQA results depend on the snapshot in testing
+        fetcher = self.fetcher
+        ttm_status = fetcher.fetch(self.name, 'ttm_status', 'ttm_status', fetcher.fetch_ttm_status, self.name)
+        testing = ttm_status.get('testing')
+        openqa_jobs = fetcher.fetch(self.name, 'openqa', f'openqa/{self.openqa_id}/{testing}',
+                                    fetcher.openqa_results, self.openqa_id, testing)
+        return ttm_status, openqa_jobs
 
-    def all_archs(self):
-        self.all_archs
+    def collect(self):
+        """Wait for the results of fetch()."""
+        self.all_archs = self.futures['all_archs'].result()
+        self.ttm_version = self.futures['ttm_version'].result()
+        self.ttm_status, self.openqa_jobs = self.futures['status'].result()
+        self.build_summaries = {repo: self.futures[repo].result() for repo in self.fetcher.repositories()}
+
+    def build_summary(self, repo):
+        if repo not in self.build_summaries:
+            self.build_summaries[repo] = self.fetcher.build_summary(self.name, repo)
+        return self.build_summaries[repo]
 
     def openqa_summary(self):
-        return self.fetcher.openqa_results(self.openqa_id, self.ttm_status.get('testing'))
+        return self.openqa_jobs
 
 
 if __name__ == '__main__':
@@ -137,6 +288,13 @@ if __name__ == '__main__':
                         help='openSUSE version to make the check (Factory, 15.2)')
     parser.add_argument('-d', '--debug', action='store_true', default=False,
                         help='enable debug information')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent requests')
+    parser.add_argument('--host-workers', type=int, default=4,
+                        help='number of concurrent requests per host')
+    parser.add_argument('--cache-dir', type=str, help='directory of the result cache')
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='fetch everything regardless of cached results')
 
     args = parser.parse_args()
 
@@ -192,6 +350,9 @@ if __name__ == '__main__':
         fetcher.add('openSUSE:Leap:15.5:ARM:Images', nick='Leap:15.5:ARM:Images',
                     openqa_group='openSUSE Leap 15.5 ARMv7 Images', openqa_version='15.5', openqa_groupid=104)
 
+    fetcher.fetch_all()
+    fetcher.timing_report()
+
     with app.app_context():
         rendered = render_template('dashboard.html',
                                    projectname=args.project,
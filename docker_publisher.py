@@ -24,6 +24,8 @@
 # and publish those.
 
 import argparse
+import concurrent.futures
+import hashlib
 import json
 import os
 import re
@@ -34,6 +36,7 @@ import tempfile
 from lxml import etree as xml
 
 import docker_registry
+from osclib.cache_manager import CacheManager
 
 REPOMD_NAMESPACES = {'md': "http://linux.duke.edu/metadata/common",
                      'repo': "http://linux.duke.edu/metadata/repo",
@@ -86,6 +89,82 @@ class DockerFetchException(Exception):
     pass
 
 
+# Size of the chunks written to disk while downloading images
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def downloadFile(url, target, sha256=None):
+    """Stream url to target without keeping it in memory. If sha256 is given,
+    the content is verified while downloading and target is only created if it
+    matches."""
+    alg = hashlib.sha256()
+    with requests.get(url, stream=True) as resp:
+        if resp.status_code != 200:
+            raise DockerFetchException(f"Could not download {url}: {resp.status_code}")
+
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(target), delete=False) as download:
+            try:
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    alg.update(chunk)
+                    download.write(chunk)
+                download.close()
+
+                if sha256 is not None and alg.hexdigest() != sha256:
+                    raise DockerFetchException(f"Checksum mismatch for {url}")
+
+                os.replace(download.name, target)
+            except BaseException:
+                os.unlink(download.name)
+                raise
+
+
+def fetchSha256(url):
+    """Return the checksum from a .sha256 file at url, None if there is none."""
+    resp = requests.get(url)
+    if resp.status_code != 200:
+        return None
+
+    # Either just the checksum or sha256sum output, possibly gpg clearsigned
+    for line in resp.text.splitlines():
+        match = re.match(r'^([a-f0-9]{64})\b', line.strip())
+        if match:
+            return match.group(1)
+
+    return None
+
+
+def fileSha256(path):
+    """Return the checksum of the file at path, read in chunks."""
+    alg = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            alg.update(chunk)
+    return alg.hexdigest()
+
+
+def cachedDockerImage(cache_dir, release, url, sha256, callback):
+    """Download the tar from url into cache_dir, unless it was fetched already,
+    and pass the extracted contents to callback.
+    The cache is keyed by sha256 if given, otherwise by release."""
+    if cache_dir is None:
+        cache_dir = CacheManager.directory('docker_publisher')
+
+    if sha256 is not None:
+        tar_path = os.path.join(cache_dir, f"sha256-{sha256}")
+    else:
+        tar_path = os.path.join(cache_dir, release.replace("/", "_"))
+    # A cached file which does not match the checksum is downloaded again.
+    if os.path.exists(tar_path) and (sha256 is None or fileSha256(tar_path) == sha256):
+        os.utime(tar_path)
+    else:
+        downloadFile(url, tar_path, sha256)
+
+    with tempfile.TemporaryDirectory() as tar_dir:
+        # Extract the tar into the dir
+        subprocess.call(f"tar -xaf '{tar_path}' -C '{tar_dir}'", shell=True)
+        return callback(tar_dir)
+
+
 class DockerImagePublisherRegistry(DockerImagePublisher):
     """The DockerImagePublisherRegistry class works by using a manifest list to
     describe a tag. The list contains a manifest for each architecture.
@@ -99,12 +178,16 @@ class DockerImagePublisherRegistry(DockerImagePublisher):
                            'ppc64le': ("ppc64le", None),
                            's390x': ("s390x", None)}
 
-    def __init__(self, dhc, tag, aliases=[]):
+    # Number of blobs uploaded concurrently
+    UPLOAD_WORKERS = 4
+
+    def __init__(self, dhc, tag, aliases=[], upload_workers=UPLOAD_WORKERS):
         """Construct a DIPR by passing a DockerRegistryClient instance as dhc
         and a name for a tag as tag.
         Optionally, add tag aliases as aliases. Those will only be written to,
         never read."""
         self.dhc = dhc
+        self.upload_workers = upload_workers
         self.tag = tag
         self.aliases = aliases
         # The manifestlist for the tag is only downloaded if this cache is empty,
@@ -200,15 +283,25 @@ class DockerImagePublisherRegistry(DockerImagePublisher):
             manifest = json.load(manifest_file)
 
         manifest_v2 = self.convertV1ToV2Manifest(image_path, manifest[0])
-        # Upload blobs
-        if not self.dhc.uploadBlob(image_path + "/" + manifest_v2['config']['x-osdp-filename'],
-                                   manifest_v2['config']['digest']):
-            raise DockerPublishException("Could not upload the image config")
-
-        for layer in manifest_v2['layers']:
-            if not self.dhc.uploadBlob(image_path + "/" + layer['x-osdp-filename'],
-                                       layer['digest']):
-                raise DockerPublishException("Could not upload an image layer")
+        # Upload blobs concurrently, blobs already pushed in this run are skipped
+        # by the client.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            config = executor.submit(self.dhc.uploadBlob,
+                                     image_path + "/" + manifest_v2['config']['x-osdp-filename'],
+                                     manifest_v2['config']['digest'])
+            layers = {}
+            for layer in manifest_v2['layers']:
+                if layer['digest'] not in layers:
+                    layers[layer['digest']] = executor.submit(self.dhc.uploadBlob,
+                                                              image_path + "/" + layer['x-osdp-filename'],
+                                                              layer['digest'])
+
+            if not config.result():
+                raise DockerPublishException("Could not upload the image config")
+
+            for layer in layers.values():
+                if not layer.result():
+                    raise DockerPublishException("Could not upload an image layer")
 
         # Upload the manifest
         manifest_content = json.dumps(manifest_v2).encode("utf-8")
@@ -275,21 +368,19 @@ class DockerImageFetcherURL(DockerImageFetcher):
     The version number can't be determined automatically (it would need to extract
     the image and look at /etc/os-release each time - too expensive.) so it
     has to be passed manually."""
-    def __init__(self, version, url):
+    def __init__(self, version, url, cache_dir=None):
         self.version = version
         self.url = url
+        self.cache_dir = cache_dir
 
     def currentVersion(self):
         return self.version
 
     def getDockerImage(self, callback):
-        """Download the tar and extract it"""
-        with tempfile.NamedTemporaryFile() as tar_file:
-            tar_file.write(requests.get(self.url).content)
-            with tempfile.TemporaryDirectory() as tar_dir:
-                # Extract the .tar.xz into the dir
-                subprocess.call(f"tar -xaf '{tar_file.name}' -C '{tar_dir}'", shell=True)
-                return callback(tar_dir)
+        """Download the tar, verified by the .sha256 file if available, and extract it"""
+        release = f"{self.version}-{os.path.basename(self.url)}"
+        sha256 = fetchSha256(self.url + ".sha256")
+        return cachedDockerImage(self.cache_dir, release, self.url, sha256, callback)
 
 
 class DockerImageFetcherOBS(DockerImageFetcher):
@@ -297,8 +388,9 @@ class DockerImageFetcherOBS(DockerImageFetcher):
     Url has to be https://build.opensuse.org/public/build/<project>/<repo>/<arch>/<pkgname>
     If maintenance_release is True, it picks the buildcontainer released last with that name.
     e.g. for "foo" it would pick "foo.2019" instead of "foo" or "foo.2018"."""
-    def __init__(self, url, maintenance_release=False):
+    def __init__(self, url, maintenance_release=False, cache_dir=None):
         self.url = url
+        self.cache_dir = cache_dir
         self.newest_release_url = None
         if not maintenance_release:
             self.newest_release_url = url
@@ -330,12 +422,15 @@ class DockerImageFetcherOBS(DockerImageFetcher):
 
         return self.newest_release_url
 
+    def _getBinaries(self):
+        binarylist_req = requests.get(self._getNewestReleaseUrl())
+        binarylist = xml.fromstring(binarylist_req.content)
+        return binarylist.xpath("binary/@filename")
+
     def _getFilename(self):
         """Return the name of the binary at the URL with the filename ending in
         .docker.tar."""
-        binarylist_req = requests.get(self._getNewestReleaseUrl())
-        binarylist = xml.fromstring(binarylist_req.content)
-        for binary in binarylist.xpath("binary/@filename"):
+        for binary in self._getBinaries():
             if binary.endswith(".docker.tar"):
                 return binary
 
@@ -348,14 +443,15 @@ class DockerImageFetcherOBS(DockerImageFetcher):
         return re.match(r'[^.]*\.[^.]+-(.*)\.docker\.tar$', filename).group(1)
 
     def getDockerImage(self, callback):
-        """Download the tar and extract it"""
+        """Download the tar, verified by the .sha256 file if built, and extract it"""
         filename = self._getFilename()
-        with tempfile.NamedTemporaryFile() as tar_file:
-            tar_file.write(requests.get(self.newest_release_url + "/" + filename).content)
-            with tempfile.TemporaryDirectory() as tar_dir:
-                # Extract the .tar into the dir
-                subprocess.call(f"tar -xaf '{tar_file.name}' -C '{tar_dir}'", shell=True)
-                return callback(tar_dir)
+        url = self.newest_release_url + "/" + filename
+        sha256 = None
+        if filename + ".sha256" in self._getBinaries():
+            sha256 = fetchSha256(url + ".sha256")
+
+        # The filename contains version and build number
+        return cachedDockerImage(self.cache_dir, filename, url, sha256, callback)
 
 
 def run():
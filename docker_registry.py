@@ -30,18 +30,31 @@
 import hashlib
 import json
 import os
+import threading
 import urllib.parse
 import requests
 
 
 class DockerRegistryClient():
-    def __init__(self, url, username, password, repository):
+    # Size of the PATCH requests of a chunked blob upload
+    CHUNK_SIZE = 16 * 1024 * 1024
+    # How often an upload is resumed after a failed chunk
+    UPLOAD_RETRIES = 5
+    # Blobs confirmed present during this run: (registry url, digest) -> repositories.
+    # Shared by all clients to skip lookups and to mount across repositories.
+    known_blobs = {}
+    known_blobs_lock = threading.Lock()
+
+    def __init__(self, url, username, password, repository, chunk_size=CHUNK_SIZE):
         self.url = url
+        self.chunk_size = chunk_size
         self.username = username
         self.password = password
         self.repository = repository
         self.scopes = [f"repository:{repository}:pull,push,delete"]
         self.token = None
+        # Blobs are uploaded from several threads, only one updates the token.
+        self.token_lock = threading.Lock()
 
     class DockerRegistryError(Exception):
         """Some nicer display of docker registry errors"""
@@ -55,7 +68,16 @@ class DockerRegistryClient():
 
             return ret
 
-    def _updateToken(self, www_authenticate):
+    def _updateToken(self, www_authenticate, token=None):
+        """Get a new token for all scopes, unless another thread replaced the
+        rejected token already."""
+        with self.token_lock:
+            if self.token != token:
+                return
+
+            self._requestToken(www_authenticate)
+
+    def _requestToken(self, www_authenticate):
         bearer_parts = www_authenticate[len("Bearer "):].split(",")
         bearer_dict = {}
         for part in bearer_parts:
@@ -81,13 +103,15 @@ class DockerRegistryClient():
 
         while True:
             resp = None
-            if self.token is not None:
-                kwargs['headers']['Authorization'] = "Bearer " + self.token
+            token = self.token
+            if token is not None:
+                kwargs['headers']['Authorization'] = "Bearer " + token
 
             methods = {'POST': requests.post,
                        'GET': requests.get,
                        'HEAD': requests.head,
                        'PUT': requests.put,
+                       'PATCH': requests.patch,
                        'DELETE': requests.delete}
 
             if method not in methods:
@@ -98,7 +122,7 @@ class DockerRegistryClient():
             if resp.status_code == 401 or resp.status_code == 403:
                 if try_update_token:
                     try_update_token = False
-                    self._updateToken(resp.headers['Www-Authenticate'])
+                    self._updateToken(resp.headers['Www-Authenticate'], token)
                     continue
 
             if resp.status_code > 400 and resp.status_code < 404:
@@ -192,23 +216,120 @@ class DockerRegistryClient():
         if not digest.startswith("sha256:"):
             raise Exception("Invalid digest")
 
+        repositories = self._knownBlobRepositories(digest)
+        if self.repository in repositories:
+            return True
+
         # Check whether the blob already exists - don't upload it needlessly.
         stat_request = self.doHttpCall("HEAD", f"/v2/{self.repository}/blobs/{digest}")
         if stat_request.status_code == 200 or stat_request.status_code == 307:
+            self._addKnownBlob(digest)
             return True
 
-        # For now we can do a single upload call with everything inlined
-        # (which also means completely in ram, but currently it's never > 50 MiB)
-        content = None
-        with open(filename, "rb") as blob:
-            content = blob.read()
+        # Pushed to another repository of the registry, try to mount it from there.
+        for repository in sorted(repositories):
+            if self.mountBlob(digest, repository):
+                self._addKnownBlob(digest)
+                return True
 
-        # First request an upload "slot", we get an URL we can PUT to back
+        # First request an upload "slot", we get an URL we can PATCH chunks to
         upload_request = self.doHttpCall("POST", f"/v2/{self.repository}/blobs/uploads/")
-        if upload_request.status_code == 202:
-            location = upload_request.headers['Location']
-            upload = self.doHttpCall("PUT", location + "&digest=" + digest,
-                                     data=content)
-            return upload.status_code == 201
+        if upload_request.status_code != 202:
+            return False
+
+        location = self._uploadLocation(upload_request)
+        alg = hashlib.sha256()
+        offset = 0
+        retries = self.UPLOAD_RETRIES
+        with open(filename, "rb") as blob:
+            size = os.fstat(blob.fileno()).st_size
+            while offset < size:
+                blob.seek(offset)
+                chunk = blob.read(self.chunk_size)
+                try:
+                    resp = self.doHttpCall("PATCH", location, data=chunk,
+                                           headers={'Content-Type': 'application/octet-stream',
+                                                    'Content-Range': f"{offset}-{offset + len(chunk) - 1}"})
+                except requests.exceptions.RequestException:
+                    resp = None
+
+                if resp is not None and resp.status_code == 202:
+                    location = self._uploadLocation(resp)
+                    alg.update(chunk)
+                    offset += len(chunk)
+                    continue
+
+                if retries == 0:
+                    return False
+                retries -= 1
+
+                # Ask the registry how much it got and resume from there.
+                status = self.doHttpCall("GET", location)
+                if status.status_code != 204:
+                    return False
+                location = self._uploadLocation(status)
+                resumed = self._uploadOffset(status)
+                if resumed < offset:
+                    alg = hashlib.sha256()
+                    offset = 0
+                offset = self._hashRange(blob, alg, offset, resumed)
+
+        if "sha256:" + alg.hexdigest() != digest:
+            raise Exception(f"Digest mismatch for {filename}")
+
+        separator = "&" if "?" in location else "?"
+        upload = self.doHttpCall("PUT", location + separator + "digest=" + urllib.parse.quote(digest))
+        if upload.status_code != 201:
+            return False
+
+        self._addKnownBlob(digest)
+        return True
+
+    def mountBlob(self, digest, repository):
+        """Mount the blob with the given digest from another repository of the same registry.
+        Returns True if the blob was mounted, False if the registry doesn't support it."""
+        scope = f"repository:{repository}:pull"
+        with self.token_lock:
+            if scope not in self.scopes:
+                self.scopes.append(scope)
+
+        query = urllib.parse.urlencode({'mount': digest, 'from': repository})
+        resp = self.doHttpCall("POST", f"/v2/{self.repository}/blobs/uploads/?{query}")
+        if resp.status_code == 201:
+            return True
+
+        if resp.status_code == 202:
+            # Not mounted, but an upload got started instead. Don't leave it dangling.
+            self.doHttpCall("DELETE", self._uploadLocation(resp))
 
         return False
+
+    def _knownBlobRepositories(self, digest):
+        with self.known_blobs_lock:
+            return set(self.known_blobs.get((self.url, digest), ()))
+
+    def _addKnownBlob(self, digest):
+        with self.known_blobs_lock:
+            self.known_blobs.setdefault((self.url, digest), set()).add(self.repository)
+
+    def _uploadLocation(self, resp):
+        """Return the absolute upload URL from the Location header."""
+        return urllib.parse.urljoin(self.url + "/", resp.headers['Location'])
+
+    def _uploadOffset(self, resp):
+        """Return the number of bytes the registry received according to the Range header."""
+        upload_range = resp.headers.get('Range')
+        if not upload_range:
+            return 0
+        # Registries report "0-0" for empty uploads.
+        end = int(upload_range.split("-")[1])
+        return end + 1 if end > 0 else 0
+
+    def _hashRange(self, blob, alg, start, end):
+        """Feed bytes start to end of blob to alg and return end."""
+        blob.seek(start)
+        while start < end:
+            data = blob.read(min(self.chunk_size, end - start))
+            alg.update(data)
+            start += len(data)
+        return end
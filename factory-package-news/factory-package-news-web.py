@@ -1,12 +1,14 @@
 #!/usr/bin/python3
 
 from flask import Flask
+from flask import Response
 from flask import request
-from flask import make_response
 
 import re
 import os
 
+from package_news import cached_diff
+
 digits_re = re.compile('^[0-9.]+$')
 
 BASE_DIR = '/var/lib'
@@ -70,15 +72,9 @@ def diff(dirpath, version):
     fn = os.path.join(_dir, 'current')
     if not os.path.exists(fn):
         return "current version doesn't exist", 404
-    if not os.path.exists(os.path.join(_dir, version)):
+    if not digits_re.match(version) or not os.path.exists(os.path.join(_dir, version)):
         return "invalid version", 400
-    import subprocess
-    cmd = [os.path.dirname(os.path.abspath(__file__)) + '/factory-package-news.py',
-           'diff', '--dir', _dir, "current", version]
-    app.logger.debug(cmd)
-    response = make_response(subprocess.check_output(cmd))
-    response.content_type = "text/plain"
-    return response
+    return Response(cached_diff(_dir, 'current', version), content_type="text/plain")
 
 
 if __name__ == '__main__':
@@ -6,16 +6,9 @@ import os
 import sys
 import logging
 import rpm
-import pickle
 import cmdln
-import re
 
-SRPM_RE = re.compile(
-    r'(?P<name>.+)-(?P<version>[^-]+)-(?P<release>[^-]+)\.(?P<suffix>(?:no)?src\.rpm)$')
-
-data_version = 3
-
-changelog_max_lines = 100  # maximum number of changelog lines per package
+from package_news import SRPM_RE, diff_files, load_snapshot, save_snapshot
 
 
 # rpm's python bindings changed in version 4.15 [0] so that they actually return
@@ -165,8 +158,8 @@ class ChangeLogger(cmdln.Cmdln):
         if not opts.snapshot:
             raise Exception("missing snapshot option")
 
-        f = open(os.path.join(opts.dir, opts.snapshot), 'wb')
-        pickle.dump([data_version, self.readChangeLogs(dirs)], f)
+        pkgdata, changelogs = self.readChangeLogs(dirs)
+        save_snapshot(opts.dir, opts.snapshot, pkgdata, changelogs)
 
     def do_dump(self, subcmd, opts, *dirs):
         """${cmd_name}: pprint the package changelog information
@@ -182,20 +175,11 @@ class ChangeLogger(cmdln.Cmdln):
         ${cmd_usage}
         ${cmd_option_list}
         """
-        f = open(filename, 'rb')
-        (v, (pkgs, changelogs)) = pickle.load(
-            f, encoding='utf-8', errors='backslashreplace')
+        pkgs, changelogs = load_snapshot(filename)
+        changelog = changelogs[pkgs[package]['sourcerpm']]
+        text = changelog['changelogtext']
         pprint(pkgs[package])
-        pprint(changelogs[pkgs[package]['sourcerpm']])
-
-    def _get_packages_grouped(self, pkgs, names):
-        group = dict()
-        for pkg in names:
-            if not pkgs[pkg]['sourcerpm'] in group:
-                group[pkgs[pkg]['sourcerpm']] = [pkg]
-            else:
-                group[pkgs[pkg]['sourcerpm']].append(pkg)
-        return group
+        pprint(dict(changelog, changelogtext=text))
 
     @cmdln.option("--dir", action="store", type='string', dest='dir', help="data directory")
     def do_diff(self, subcmd, opts, version1, version2):
@@ -209,79 +193,8 @@ class ChangeLogger(cmdln.Cmdln):
         if not os.path.isdir(opts.dir):
             raise Exception(f"{opts.dir} must be a directory")
 
-        f = open(os.path.join(opts.dir, version1), 'rb')
-        (v, (v1pkgs, v1changelogs)) = pickle.load(f,
-                                                  encoding='utf-8', errors='backslashreplace')
-        if v != data_version:
-            raise Exception(f"not matching version {v} in {version1}")
-        f = open(os.path.join(opts.dir, version2), 'rb')
-        (v, (v2pkgs, v2changelogs)) = pickle.load(f,
-                                                  encoding='utf-8', errors='backslashreplace')
-        if v != data_version:
-            raise Exception(f"not matching version {v} in {version2}")
-
-        p1 = set(v1pkgs.keys())
-        p2 = set(v2pkgs.keys())
-
-        print('Packages changed:')
-        group = self._get_packages_grouped(v2pkgs, p1 & p2)
-#        pprint(p1&p2)
-#        pprint(group)
-#        print "  "+"\n  ".join(["\n   * ".join(sorted(group[s])) for s in sorted(group.keys()) ])
-        details = ''
-        for srpm in sorted(group.keys()):
-            srpm1 = v1pkgs[group[srpm][0]]['sourcerpm']
-            # print group[srpm], srpm, srpm1
-            if srpm1 == srpm:
-                continue  # source package unchanged
-            try:
-                t1 = v1changelogs[srpm1]['changelogtime'][0]
-            except IndexError:
-                print(f"{srpm1} doesn't have a changelog", file=sys.stderr)
-                continue
-            m = SRPM_RE.match(srpm)
-            if m:
-                name = m.group('name')
-            else:
-                name = srpm
-            if len(v2changelogs[srpm]['changelogtime']) == 0:
-                print(f'  {name} ERROR: no changelog')
-                continue
-            if t1 == v2changelogs[srpm]['changelogtime'][0]:
-                continue  # no new changelog entry, probably just rebuilt
-            pkgs = sorted(group[srpm])
-            details += f"\n==== {name} ====\n"
-            if v1pkgs[pkgs[0]]['version'] != v2pkgs[pkgs[0]]['version']:
-                print("  %s (%s -> %s)" % (name, v1pkgs[pkgs[0]]['version'],
-                                           v2pkgs[pkgs[0]]['version']))
-                details += "Version update (%s -> %s)\n" % (v1pkgs[pkgs[0]]['version'],
-                                                            v2pkgs[pkgs[0]]['version'])
-            else:
-                print(f"  {name}")
-            if len(pkgs) > 1:
-                details += f"Subpackages: {' '.join([p for p in pkgs if p != name])}\n"
-
-            changedetails = ""
-            for (i2, t2) in enumerate(v2changelogs[srpm]['changelogtime']):
-                if t2 <= t1:
-                    break
-                changedetails += "\n" + v2changelogs[srpm]['changelogtext'][i2]
-
-            # if a changelog is too long, cut it off after changelog_max_lines lines
-            changedetails_lines = changedetails.splitlines()
-            # apply 5 lines tolerance to avoid silly-looking "skipping 2 lines"
-            if len(changedetails_lines) > changelog_max_lines + 5:
-                changedetails = '\n'.join(changedetails_lines[0:changelog_max_lines])
-                left = len(changedetails_lines) - changelog_max_lines - 1
-                changedetails += f'\n    ... changelog too long, skipping {left} lines ...\n'
-                # add last line of changelog diff so that it's possible to
-                # find out the end of the changelog section
-                changedetails += changedetails_lines[-1]
-            details += changedetails
-            details += '\n'
-
-        print("\n=== Details ===")
-        print(details)
+        for chunk in diff_files(opts.dir, version1, version2):
+            sys.stdout.write(chunk)
 
     def get_optparser(self):
         parser = cmdln.CmdlnOptionParser(self)
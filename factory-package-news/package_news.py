@@ -0,0 +1,269 @@
+# Shared code of factory-package-news.py and factory-package-news-web.py
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import tempfile
+import zlib
+
+SRPM_RE = re.compile(
+    r'(?P<name>.+)-(?P<version>[^-]+)-(?P<release>[^-]+)\.(?P<suffix>(?:no)?src\.rpm)$')
+
+# 3: one pickle per snapshot containing all changelog texts
+# 4: per package index per snapshot, texts in shared blobs (see save_snapshot)
+data_version = 4
+
+changelog_max_lines = 100  # maximum number of changelog lines per package
+
+DIFF_CACHE_PREFIX = '.diff-'
+# Complete cache entries, unlike the temporary files of diffs being written
+DIFF_CACHE_RE = re.compile(r'^' + re.escape(DIFF_CACHE_PREFIX) + r'\d+-\d+$')
+# Directory of the changelog blobs shared by all snapshots of a directory
+BLOB_DIR = '.changelogs'
+
+logger = logging.getLogger('factory-package-news')
+
+
+class Changelog(dict):
+    """Changelog information of a source package which loads the changelog
+    text from its blob on first access."""
+
+    def __init__(self, blobdir, data):
+        super().__init__(data)
+        self.blobdir = blobdir
+
+    def __missing__(self, key):
+        if key != 'changelogtext':
+            raise KeyError(key)
+        self[key] = load_blob(self.blobdir, self['changelog'])
+        return self[key]
+
+
+def blob_path(blobdir, digest):
+    return os.path.join(blobdir, digest[:2], digest)
+
+
+def load_blob(blobdir, digest):
+    with open(blob_path(blobdir, digest), 'rb') as f:
+        return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+
+
+def write_file(path, data):
+    """Replace path atomically by a file containing data."""
+    fd, tmpfile = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates files only readable by the owner
+        os.chmod(tmpfile, 0o644)
+        os.rename(tmpfile, path)
+    except BaseException:
+        os.unlink(tmpfile)
+        raise
+
+
+def save_blob(blobdir, content):
+    """Store content compressed under its digest, unless already present."""
+    data = json.dumps(content).encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(blobdir, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, zlib.compress(data))
+    return digest
+
+
+def save_snapshot(directory, snapshot, pkgs, changelogs):
+    """Save a snapshot as index of packages plus changelog blobs.
+
+    The snapshot file only contains the binary package data and, per source
+    package, the binary packages, changelog times and the digest of the
+    changelog text. The texts are stored content addressed in BLOB_DIR so
+    consecutive snapshots share them.
+    """
+    blobdir = os.path.join(directory, BLOB_DIR)
+    index = dict()
+    for srpm, data in changelogs.items():
+        index[srpm] = {
+            'packages': data['packages'],
+            'changelogtime': list(data['changelogtime']),
+            'changelog': save_blob(blobdir, list(data['changelogtext'])),
+        }
+
+    write_file(os.path.join(directory, snapshot), pickle.dumps([data_version, (pkgs, index)]))
+
+
+def load_snapshot(filename):
+    """Load a snapshot, changelog texts are only read when accessed.
+
+    Snapshots of data version 3 are converted to the current format.
+    """
+    with open(filename, 'rb') as f:
+        (v, (pkgs, changelogs)) = pickle.load(f, encoding='utf-8', errors='backslashreplace')
+
+    directory, snapshot = os.path.split(os.path.realpath(filename))
+    if v == 3:
+        try:
+            save_snapshot(directory, snapshot, pkgs, changelogs)
+        except OSError as e:
+            logger.warning(f"could not migrate {filename}: {e}")
+        return pkgs, changelogs
+    if v != data_version:
+        raise Exception(f"not matching version {v} in {filename}")
+
+    blobdir = os.path.join(directory, BLOB_DIR)
+    return pkgs, {srpm: Changelog(blobdir, data) for srpm, data in changelogs.items()}
+
+
+def _get_packages_grouped(pkgs, names):
+    group = dict()
+    for pkg in names:
+        if not pkgs[pkg]['sourcerpm'] in group:
+            group[pkgs[pkg]['sourcerpm']] = [pkg]
+        else:
+            group[pkgs[pkg]['sourcerpm']].append(pkg)
+    return group
+
+
+def diff(v1pkgs, v1changelogs, v2pkgs, v2changelogs):
+    """Generate the text of the changes between two snapshots in chunks."""
+    p1 = set(v1pkgs.keys())
+    p2 = set(v2pkgs.keys())
+
+    yield 'Packages changed:\n'
+    group = _get_packages_grouped(v2pkgs, p1 & p2)
+    details = ''
+    for srpm in sorted(group.keys()):
+        srpm1 = v1pkgs[group[srpm][0]]['sourcerpm']
+        if srpm1 == srpm:
+            continue  # source package unchanged
+        try:
+            t1 = v1changelogs[srpm1]['changelogtime'][0]
+        except IndexError:
+            logger.warning(f"{srpm1} doesn't have a changelog")
+            continue
+        m = SRPM_RE.match(srpm)
+        if m:
+            name = m.group('name')
+        else:
+            name = srpm
+        if len(v2changelogs[srpm]['changelogtime']) == 0:
+            yield f'  {name} ERROR: no changelog\n'
+            continue
+        if t1 == v2changelogs[srpm]['changelogtime'][0]:
+            continue  # no new changelog entry, probably just rebuilt
+        pkgs = sorted(group[srpm])
+        details += f"\n==== {name} ====\n"
+        if v1pkgs[pkgs[0]]['version'] != v2pkgs[pkgs[0]]['version']:
+            yield "  %s (%s -> %s)\n" % (name, v1pkgs[pkgs[0]]['version'],
+                                         v2pkgs[pkgs[0]]['version'])
+            details += "Version update (%s -> %s)\n" % (v1pkgs[pkgs[0]]['version'],
+                                                        v2pkgs[pkgs[0]]['version'])
+        else:
+            yield f"  {name}\n"
+        if len(pkgs) > 1:
+            details += f"Subpackages: {' '.join([p for p in pkgs if p != name])}\n"
+
+        changedetails = ""
+        for (i2, t2) in enumerate(v2changelogs[srpm]['changelogtime']):
+            if t2 <= t1:
+                break
+            changedetails += "\n" + v2changelogs[srpm]['changelogtext'][i2]
+
+        # if a changelog is too long, cut it off after changelog_max_lines lines
+        changedetails_lines = changedetails.splitlines()
+        # apply 5 lines tolerance to avoid silly-looking "skipping 2 lines"
+        if len(changedetails_lines) > changelog_max_lines + 5:
+            changedetails = '\n'.join(changedetails_lines[0:changelog_max_lines])
+            left = len(changedetails_lines) - changelog_max_lines - 1
+            changedetails += f'\n    ... changelog too long, skipping {left} lines ...\n'
+            # add last line of changelog diff so that it's possible to
+            # find out the end of the changelog section
+            changedetails += changedetails_lines[-1]
+        details += changedetails
+        details += '\n'
+
+    yield "\n=== Details ===\n"
+    yield details + "\n"
+
+
+def diff_files(directory, version1, version2):
+    v1pkgs, v1changelogs = load_snapshot(os.path.join(directory, version1))
+    v2pkgs, v2changelogs = load_snapshot(os.path.join(directory, version2))
+    yield from diff(v1pkgs, v1changelogs, v2pkgs, v2changelogs)
+
+
+def cached_diff(directory, version1, version2):
+    """Like diff_files() but memoized on disk.
+
+    The cache is keyed by the inodes of both snapshots, so relinking a symlink
+    like current to another snapshot invalidates it. Entries not involving the
+    current version1 snapshot are removed when a new diff is cached. Diffs
+    being written are kept in unique temporary files until complete.
+    """
+    ino1 = os.stat(os.path.join(directory, version1)).st_ino
+    ino2 = os.stat(os.path.join(directory, version2)).st_ino
+    prefix = f'{DIFF_CACHE_PREFIX}{ino1}-'
+    cachefile = os.path.join(directory, f'{prefix}{ino2}')
+
+    try:
+        with open(cachefile, 'r') as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+    except FileNotFoundError:
+        pass
+
+    for fn in os.listdir(directory):
+        if DIFF_CACHE_RE.match(fn) and not fn.startswith(prefix):
+            try:
+                os.unlink(os.path.join(directory, fn))
+            except OSError:
+                pass  # removed by a concurrent request or not ours
+
+    # the response is streamed, so failing to cache must not fail the diff
+    try:
+        fd, tmpfile = tempfile.mkstemp(prefix=f'{prefix}{ino2}.', suffix='.tmp', dir=directory)
+    except OSError as e:
+        logger.warning(f"could not cache diff in {directory}: {e}")
+        yield from diff_files(directory, version1, version2)
+        return
+    f = os.fdopen(fd, 'w')
+    try:
+        for chunk in diff_files(directory, version1, version2):
+            if f:
+                try:
+                    f.write(chunk)
+                except OSError as e:
+                    _discard_cache(f, tmpfile, e)
+                    f = None
+            yield chunk
+        if f:
+            try:
+                f.close()
+                os.rename(tmpfile, cachefile)
+            except OSError as e:
+                _discard_cache(f, tmpfile, e)
+    except BaseException:
+        if f:
+            _discard_cache(f, tmpfile)
+        raise
+
+
+def _discard_cache(f, tmpfile, error=None):
+    """Close and remove a partially written cache file."""
+    if error:
+        logger.warning(f"could not cache diff in {tmpfile}: {error}")
+    try:
+        f.close()
+    except OSError:
+        pass  # the data not flushed is dropped anyway
+    try:
+        os.unlink(tmpfile)
+    except OSError:
+        pass
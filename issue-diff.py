@@ -2,15 +2,19 @@
 
 import argparse
 import bugzilla
+from concurrent.futures import ThreadPoolExecutor
 import dateutil.parser
 from datetime import datetime
 from dateutil.tz import tzlocal
+import json
 import os
 from random import shuffle
 import subprocess
 import sys
 import tempfile
-from xmlrpclib import Fault
+import time
+from urllib.error import HTTPError
+from xmlrpc.client import Fault
 import yaml
 from lxml import etree as ET
 
@@ -18,9 +22,9 @@ import osc.conf
 import osc.core
 
 from osclib.cache import Cache
+from osclib.cache_manager import CacheManager
 from osclib.core import entity_email
 from osclib.core import package_list
-from osclib.git import CACHE_DIR
 from osclib.git import sync
 
 # Issue summary can contain unicode characters and therefore a string containing
@@ -39,6 +43,14 @@ ISSUE_SUMMARY_BUGZILLA = u'{label} owned by {owner}: {summary}'
 ISSUE_SUMMARY_PLAIN = u'[{label}]({url})'
 ISSUE_SUMMARY_PLAIN_BUGZILLA = u'{label}'
 
+# The issues referenced by each package are indexed per project along with the
+# srcmd5 they were read from, so only packages whose sources changed since the
+# last run are fetched again, FETCH_WORKERS at a time.
+INDEX_VERSION = 1
+FETCH_WORKERS = 8
+# Packages fetched at a time when the number of packages handled is limited
+FETCH_BATCH = 50
+
 
 def bug_create(bugzilla_api, meta, assigned_to, cc, summary, description):
     createinfo = bugzilla_api.build_createbug(
@@ -165,24 +177,12 @@ def issue_normalize(trackers, tracker, name):
     return None
 
 
-def issues_get(apiurl, project, package, trackers, db):
-    issues = {}
-
+def issues_fetch(apiurl, project, package):
     url = osc.core.makeurl(apiurl, ['source', project, package], {'view': 'issues'})
     root = ET.parse(osc.core.http_GET(url)).getroot()
 
-    now = datetime.now(tzlocal())  # Much harder than should be.
+    issues = []
     for issue in root.findall('issue'):
-        # Normalize issues to active API instance issue-tracker definitions.
-        # Assumes the two servers have the name trackers, but different labels.
-        label = issue_normalize(trackers, issue.find('tracker').text, issue.find('name').text)
-        if label is None:
-            continue
-
-        # Ignore already processed issues.
-        if issue_found(package, label, db):
-            continue
-
         summary = issue.find('summary')
         if summary is not None:
             summary = summary.text
@@ -201,17 +201,128 @@ def issues_get(apiurl, project, package, trackers, db):
             # Old date to make logic work.
             date = '2007-12-12 00:00 GMT+1'
 
-        date = dateutil.parser.parse(date)
-        delta = now - date
-
-        issues[label] = {
+        issues.append({
+            'tracker': issue.find('tracker').text,
+            'name': issue.find('name').text,
             'url': issue.find('url').text,
             'summary': summary,
             'owner': owner,
+            'date': date,
+        })
+
+    return issues
+
+
+def issues_get(issues, package, trackers, db):
+    now = datetime.now(tzlocal())  # Much harder than should be.
+    result = {}
+    for issue in issues:
+        # Normalize issues to active API instance issue-tracker definitions.
+        # Assumes the two servers have the name trackers, but different labels.
+        label = issue_normalize(trackers, issue['tracker'], issue['name'])
+        if label is None:
+            continue
+
+        # Ignore already processed issues.
+        if issue_found(package, label, db):
+            continue
+
+        delta = now - dateutil.parser.parse(issue['date'])
+
+        result[label] = {
+            'url': issue['url'],
+            'summary': issue['summary'],
+            'owner': issue['owner'],
             'age': delta.days,
         }
 
-    return issues
+    return result
+
+
+def package_srcmd5s(apiurl, project):
+    url = osc.core.makeurl(apiurl, ['source', project], {'view': 'info', 'nofilename': 1})
+    root = ET.parse(osc.core.http_GET(url)).getroot()
+    return {sourceinfo.get('package'): sourceinfo.get('srcmd5') for sourceinfo in root.findall('sourceinfo')}
+
+
+def issue_index_path(project):
+    return os.path.join(CacheManager.directory('issue-diff'), f'{project}.json')
+
+
+def issue_index_load(project):
+    try:
+        with open(issue_index_path(project)) as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index['packages']
+
+
+def issue_index_save(project, packages):
+    path = issue_index_path(project)
+    with open(path + '.new', 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'packages': packages}, f)
+    os.rename(path + '.new', path)
+
+
+def issues_fetch_or_skip(apiurl, project, package):
+    try:
+        return issues_fetch(apiurl, project, package)
+    except HTTPError as e:
+        print(f'WARNING: skipping {project}/{package}, fetching issues failed: {e}')
+        return None
+
+
+def issue_index_update(apiurl, project, packages, index, srcmd5s=None):
+    """Fetch the issues of the packages whose srcmd5 is not in the index.
+
+    srcmd5s defaults to the current ones of the project. Packages whose
+    issues could not be fetched are removed from the index.
+    Returns the number of packages fetched.
+    """
+    if srcmd5s is None:
+        srcmd5s = package_srcmd5s(apiurl, project)
+    changed = [package for package in packages
+               if srcmd5s.get(package) is None or index.get(package, {}).get('srcmd5') != srcmd5s[package]]
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        fetched = executor.map(lambda package: issues_fetch_or_skip(apiurl, project, package), changed)
+        for package, issues in zip(changed, fetched):
+            if issues is None:
+                index.pop(package, None)
+            else:
+                index[package] = {'srcmd5': srcmd5s.get(package), 'issues': issues}
+
+    return len(changed)
+
+
+def issue_index_prune(index, packages):
+    for package in set(index) - set(packages):
+        del index[package]
+
+
+def issue_index_batches(projects, packages, db, issue_index, batch_size):
+    """Yield the packages, updating the issue index of both projects for
+    batch_size packages at a time so that no more are fetched than used."""
+    srcmd5s = {}
+    for project_apiurl, project in projects:
+        issue_index[project] = issue_index_load(project)
+        issue_index_prune(issue_index[project], packages)
+        srcmd5s[project] = package_srcmd5s(project_apiurl, project)
+
+    for start in range(0, len(packages), batch_size):
+        batch = packages[start:start + batch_size]
+        checked = [package for package in batch if db.get(package) != 'whitelist']
+        for project_apiurl, project in projects:
+            start_time = time.time()
+            fetched = issue_index_update(project_apiurl, project, checked, issue_index[project], srcmd5s[project])
+            issue_index_save(project, issue_index[project])
+            duration = time.time() - start_time
+            print(f'{project}: fetched issues of {fetched} of {len(checked)} packages '
+                  f'in {duration:.1f}s ({fetched / max(duration, 0.001):.1f} packages/s)')
+        yield from batch
 
 
 def print_stats(db):
@@ -275,18 +386,27 @@ def main(args):
     trackers = issue_trackers(apiurl)
     packages_project = package_list(apiurl, args.project)
     packages_factory = package_list(apiurl_default, args.factory)
-    packages = set(packages_project).intersection(set(packages_factory))
+    packages = list(set(packages_project).intersection(set(packages_factory)))
+    shuffle(packages)
+
+    # With --limit the issues are fetched in batches as the packages are
+    # checked, rather than all up front.
+    issue_index = {}
+    projects = ((apiurl, args.project), (apiurl_default, args.factory))
+    batch_size = FETCH_BATCH if args.limit else max(len(packages), 1)
     new = 0
-    shuffle(list(packages))
-    for index, package in enumerate(packages, start=1):
+    for index, package in enumerate(issue_index_batches(projects, packages, db, issue_index, batch_size), start=1):
         if index % 50 == 0:
             print(f'Checked {index} of {len(packages)}')
         if package in db and db[package] == 'whitelist':
             print(f'Skipping package {package}')
             continue
+        if package not in issue_index[args.project] or package not in issue_index[args.factory]:
+            print(f'Skipping package {package}, its issues could not be fetched')
+            continue
 
-        issues_project = issues_get(apiurl, args.project, package, trackers, db)
-        issues_factory = issues_get(apiurl_default, args.factory, package, trackers, db)
+        issues_project = issues_get(issue_index[args.project][package]['issues'], package, trackers, db)
+        issues_factory = issues_get(issue_index[args.factory][package]['issues'], package, trackers, db)
 
         missing_from_factory = set(issues_project.keys()) - set(issues_factory.keys())
 
@@ -429,6 +549,6 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.cache_dir is None:
-        args.cache_dir = CACHE_DIR
+        args.cache_dir = CacheManager.directory('issue-diff', 'git')
 
     sys.exit(main(args))
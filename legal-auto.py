@@ -14,6 +14,7 @@ import json
 import time
 import yaml
 
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 from lxml import etree as ET
 
@@ -24,6 +25,11 @@ import ReviewBot
 
 http_GET = osc.core.http_GET
 
+# Number of revisions POSTed to legaldb at the same time by update_project and
+# the revisions of each package remembered in its state file.
+IMPORT_WORKERS = 4
+REVISIONS_KEPT = 3
+
 
 class LegalAuto(ReviewBot.ReviewBot):
 
@@ -210,21 +216,82 @@ class LegalAuto(ReviewBot.ReviewBot):
         self.delete_from_db(req.reqid)
 
     def update_project(self, project):
+        """Import the sources of the product project into legaldb.
+
+        Only revisions without a legaldb entry in the local state are
+        POSTed and the product is only PATCHed when its packages changed
+        since the last successful PATCH.
+        """
         yaml_path = os.path.join(CacheManager.directory('legal-auto'), f'{project}.yaml')
+        state = self._load_product_state(yaml_path)
+        self.pkg_cache = state['packages']
+
+        sources = self._query_sources_for_product_import(project)
+        ids = {}
+        missing = []
+        changed = False
+        for package, (revision, srcmd5) in sources.items():
+            revisions = self.pkg_cache.get(package, {})
+            if srcmd5 not in revisions and revision in revisions:
+                # entry of the old cache, which was keyed by revision number
+                self.pkg_cache[package] = revisions = {srcmd5: revisions[revision]}
+                changed = True
+            if srcmd5 in revisions:
+                ids[package] = revisions[srcmd5]
+            else:
+                missing.append(package)
+
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as executor:
+            added = executor.map(lambda package: self._add_source(project, project, package, sources[package][0]),
+                                 missing)
+            for package, legaldb_id in zip(missing, added):
+                if legaldb_id is None:
+                    continue
+                ids[package] = legaldb_id
+                revisions = self.pkg_cache.setdefault(package, {})
+                revisions[sources[package][1]] = legaldb_id
+                for srcmd5 in list(revisions)[:-REVISIONS_KEPT]:
+                    del revisions[srcmd5]
+
+        changed = changed or bool(missing)
+        for package in set(self.pkg_cache) - set(sources):
+            del self.pkg_cache[package]
+            changed = True
+
+        self.packages = sorted(ids.values())
+        try:
+            if self.packages != state['product']:
+                self.logger.info(f'{project}: {len(self.packages)} packages, {len(missing)} new revisions')
+                url = osc.core.makeurl(self.legaldb, ['products', project])
+                REQ.patch(url, headers=self.legaldb_headers, data={'id': self.packages}).raise_for_status()
+                state['product'] = self.packages
+                changed = True
+        finally:
+            # keep the new revisions even if the product could not be updated
+            if changed:
+                self._save_product_state(yaml_path, state)
+
+    @staticmethod
+    def _load_product_state(yaml_path):
         try:
             with open(yaml_path, 'r') as file:
-                self.pkg_cache = yaml.load(file, Loader=yaml.SafeLoader)
+                state = yaml.load(file, Loader=yaml.SafeLoader) or {}
         except (IOError, EOFError):
-            self.pkg_cache = {}
-
-        self.packages = []
-        self._query_sources_for_product_import(project)
-        with open(yaml_path, 'w') as file:
-            yaml.dump(self.pkg_cache, file)
-        url = osc.core.makeurl(self.legaldb, ['products', project])
-        REQ.patch(url, headers=self.legaldb_headers, data={'id': self.packages})
+            state = {}
+        if state.get('version') != 2:
+            # The old cache only holds the packages.
+            state = {'version': 2, 'packages': state, 'product': None}
+        return state
+
+    @staticmethod
+    def _save_product_state(yaml_path, state):
+        with open(yaml_path + '.new', 'w') as file:
+            yaml.dump(state, file, sort_keys=False)
+        os.rename(yaml_path + '.new', yaml_path)
 
     def _query_sources_for_product_import(self, project):
+        """Return the revision and srcmd5 of each package to import."""
+        sources = {}
         url = osc.core.makeurl(
             self.apiurl, ['source', project], {'view': 'info'})
         f = self.retried_GET(url)
@@ -260,16 +327,14 @@ class LegalAuto(ReviewBot.ReviewBot):
                     break
             if skip:
                 continue
-            self.packages.append(self._add_source(project, project, package, si.get('rev')))
+            sources[package] = (si.get('rev'), si.get('srcmd5'))
+        return sources
 
     def _add_source(self, tproject, sproject, package, revision):
         params = {'api': self.apiurl, 'project': sproject, 'package': package,
                   'external_link': tproject}
         if revision:
             params['rev'] = revision
-        old_id = self.pkg_cache.get(package, {None: None}).get(revision, None)
-        if old_id:
-            return old_id
 
         params['priority'] = 1
         url = osc.core.makeurl(self.legaldb, ['packages'], params)
@@ -282,7 +347,6 @@ class LegalAuto(ReviewBot.ReviewBot):
             return None
         legaldb_id = obj['saved']['id']
         self.logger.debug(f"PKG {sproject}/{package}[{revision}]->{tproject} is {legaldb_id}")
-        self.pkg_cache[package] = {revision: legaldb_id}
         if obj['saved']['state'] == 'obsolete':
             url = osc.core.makeurl(self.legaldb, ['packages', 'import', str(legaldb_id)], {
                                    'result': f'Reopened for {tproject}', 'state': 'new',
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from pprint import pformat
 from urllib.error import HTTPError
 from urllib.parse import quote_plus
+from osclib.cache_manager import CacheManager
 from osclib.comments import CommentAPI
 
 import requests
@@ -22,6 +26,91 @@ QA_INPROGRESS = 1
 QA_FAILED = 2
 QA_PASSED = 3
 
+# Incidents looked up per search for their release request.
+INCIDENT_SEARCH_BATCH = 200
+
+# Repositories whose repomd.xml is revalidated at the same time.
+REPOMD_WORKERS = 8
+REPOMD_PRIMARY = './/{http://linux.duke.edu/metadata/repo}data[@type="primary"]/{http://linux.duke.edu/metadata/repo}checksum'
+
+
+class RepoChecksums(object):
+    """Primary checksums of repositories.
+
+    The checksum, ETag and Last-Modified of each repomd.xml seen are stored,
+    so that the next run revalidates them with conditional requests and an
+    unchanged repository costs a 304. Each repository is requested at most
+    once per instance.
+    """
+
+    def __init__(self, filename=None, logger=None):
+        self.filename = filename or os.path.join(CacheManager.directory('openqabot'), 'repomd.json')
+        self.logger = logger or logging.getLogger(__name__)
+        self.checksums = {}
+        self.changed = []
+        try:
+            with open(self.filename) as f:
+                self.store = json.load(f)
+        except (IOError, ValueError):
+            self.store = {}
+
+    def save(self):
+        with open(self.filename + '.new', 'w') as f:
+            json.dump(self.store, f)
+        os.rename(self.filename + '.new', self.filename)
+
+    def fetch(self, url):
+        seen = self.store.get(url, {})
+        headers = {}
+        if seen.get('etag'):
+            headers['If-None-Match'] = seen['etag']
+        if seen.get('last_modified'):
+            headers['If-Modified-Since'] = seen['last_modified']
+        try:
+            response = osc.core.http_GET(url + '/repodata/repomd.xml', headers=headers)
+        except HTTPError as e:
+            if e.code == 304 and seen:
+                return seen
+            raise
+        root = ET.parse(response).getroot()
+        return {
+            'checksum': root.find(REPOMD_PRIMARY).text,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+    def update(self, repos):
+        """Revalidate the repositories not checked yet concurrently."""
+        repos = [url for url in dict.fromkeys(repos) if url not in self.checksums]
+        if not repos:
+            return
+        modified = False
+        changed = []
+        with ThreadPoolExecutor(max_workers=REPOMD_WORKERS) as executor:
+            for url, future in [(url, executor.submit(self.fetch, url)) for url in repos]:
+                try:
+                    seen = future.result()
+                except HTTPError as e:
+                    self.checksums[url] = e
+                    continue
+                if seen is not self.store.get(url):
+                    modified = True
+                    if seen['checksum'] != self.store.get(url, {}).get('checksum'):
+                        changed.append(url)
+                    self.store[url] = seen
+                self.checksums[url] = seen['checksum']
+        if modified:
+            self.save()
+        self.changed += changed
+        self.logger.info(f"{len(repos)} repos checked, changed: {', '.join(changed) or 'none'}")
+
+    def checksum(self, url):
+        self.update([url])
+        checksum = self.checksums[url]
+        if isinstance(checksum, HTTPError):
+            raise checksum
+        return checksum
+
 
 class OpenQABot(ReviewBot.ReviewBot):
 
@@ -37,6 +126,9 @@ class OpenQABot(ReviewBot.ReviewBot):
         self.force = False
         self.openqa = None
         self.commentapi = CommentAPI(self.apiurl)
+        self.test_incidents = {}
+        self.release_requests = {}
+        self.repo_checksums = None
 
     def gather_test_builds(self):
         for prj, u in self.tgt_repo[self.openqa.baseurl].items():
@@ -73,6 +165,17 @@ class OpenQABot(ReviewBot.ReviewBot):
 
         super(OpenQABot, self).check_requests()
 
+        self.test_incidents = {}
+        self.release_requests = {}
+
+        # revalidate the repos of all targets to trigger at once
+        self.repo_checksums = RepoChecksums(logger=self.logger)
+        repos = []
+        for prj, u in self.tgt_repo[self.openqa.baseurl].items():
+            if prj not in self.pending_target_repos:
+                repos += u['repos']
+        self.repo_checksums.update(repos)
+
         # now make sure the jobs are for current repo
         for prj, u in self.tgt_repo[self.openqa.baseurl].items():
             if prj in self.pending_target_repos:
@@ -81,20 +184,14 @@ class OpenQABot(ReviewBot.ReviewBot):
             self.trigger_build_for_target(prj, u)
 
     # check a set of repos for their primary checksums
-    @staticmethod
-    def calculate_repo_hash(repos, incidents):
+    def calculate_repo_hash(self, repos, incidents):
+        if self.repo_checksums is None:
+            self.repo_checksums = RepoChecksums(logger=self.logger)
         m = hashlib.md5()
         # if you want to force it, increase this number
         m.update(b'b')
         for url in repos:
-            url += '/repodata/repomd.xml'
-            try:
-                root = ET.parse(osc.core.http_GET(url)).getroot()
-            except HTTPError:
-                raise
-            cs = root.find(
-                './/{http://linux.duke.edu/metadata/repo}data[@type="primary"]/{http://linux.duke.edu/metadata/repo}checksum')
-            m.update(cs.text.encode('utf-8'))
+            m.update(self.repo_checksums.checksum(url).encode('utf-8'))
         # now add the open incidents
         m.update(json.dumps(incidents, sort_keys=True).encode('utf-8'))
         digest = m.hexdigest()
@@ -103,14 +200,53 @@ class OpenQABot(ReviewBot.ReviewBot):
             digest += ':' + ','.join(open_incidents)
         return digest
 
-    def is_incident_in_testing(self, incident):
+    def incidents_in_project(self, prj):
+        if prj not in self.test_incidents:
+            # remove patchinfo. prefix
+            self.test_incidents[prj] = [package.replace('_', '.').split('.')[1]
+                                        for package in osc.core.meta_get_packagelist(self.apiurl, prj)]
+        return self.test_incidents[prj]
+
+    def lookup_release_requests(self, incidents):
+        """
+        search the maintenance_release requests in review of the incidents
+        not looked up yet in batches and remember them in release_requests
+        """
         # hard coded for now as we only run this code for SUSE Maintenance workflow
-        project = f'SUSE:Maintenance:{incident}'
+        projects = {f'SUSE:Maintenance:{incident}': incident
+                    for incident in sorted(set(incidents)) if incident not in self.release_requests}
+        batches = list(projects)
+        while batches:
+            batch = batches[:INCIDENT_SEARCH_BATCH]
+            batches = batches[INCIDENT_SEARCH_BATCH:]
+            match = ' or '.join(f"action/source/@project='{project}'" for project in batch)
+            xpath = f"(state/@name='review') and (action/@type='maintenance_release') and ({match})"
+            res = osc.core.search(self.apiurl, request=xpath)['request']
+            for project in batch:
+                self.release_requests[projects[project]] = None
+            for request in res.findall('request'):
+                req = osc.core.Request()
+                req.read(request)
+                for action in req.actions:
+                    if action.type != 'maintenance_release' or action.src_project not in batch:
+                        continue
+                    # return the one and only (or None)
+                    incident = projects[action.src_project]
+                    if not self.release_requests[incident]:
+                        self.release_requests[incident] = req
+
+    def target_incidents(self):
+        incidents = []
+        for prj, u in self.tgt_repo[self.openqa.baseurl].items():
+            if prj in self.pending_target_repos:
+                continue
+            for incidents_prj in u.get('incidents', {}).values():
+                incidents += self.incidents_in_project(incidents_prj)
+        return incidents
 
-        xpath = f"(state/@name='review') and (action/source/@project='{project}' and action/@type='maintenance_release')"
-        res = osc.core.search(self.apiurl, request=xpath)['request']
-        # return the one and only (or None)
-        return res.find('request')
+    def is_incident_in_testing(self, incident):
+        self.lookup_release_requests([incident])
+        return self.release_requests[incident]
 
     def calculate_incidents(self, incidents):
         """
@@ -118,23 +254,21 @@ class OpenQABot(ReviewBot.ReviewBot):
         returns dict with openQA var name : string with numbers
         """
         self.logger.debug(f"calculate_incidents: {pformat(incidents)}")
+        if not self.release_requests:
+            # the first target to be scheduled looks up the incidents of all
+            self.lookup_release_requests(self.target_incidents())
         l_incidents = []
         for kind, prj in incidents.items():
-            packages = osc.core.meta_get_packagelist(self.apiurl, prj)
             incidents = []
             # filter out incidents in staging
-            for incident in packages:
-                # remove patchinfo. prefix
-                incident = incident.replace('_', '.').split('.')[1]
+            for incident in self.incidents_in_project(prj):
                 req = self.is_incident_in_testing(incident)
                 # without release request it's in staging
                 if not req:
                     continue
 
                 # skip kgraft patches from aggregation
-                req_ = osc.core.Request()
-                req_.read(req)
-                src_prjs = {a.src_project for a in req_.actions}
+                src_prjs = {a.src_project for a in req.actions}
                 if SUSEUpdate.kgraft_target(self.apiurl, src_prjs.pop()):
                     self.logger.debug(
                         f"calculate_incidents: Incident is kgraft - {incident} ")
@@ -6,6 +6,7 @@ import requests
 import osc.core
 
 from oqamaint.update import Update
+from osclib.memoize import memoize
 
 
 MINIMALS = {
@@ -26,6 +27,7 @@ class SUSEUpdate(Update):
 
     # we take requests that have a kgraft-patch package as kgraft patch (suprise!)
     @staticmethod
+    @memoize(session=True)
     def kgraft_target(apiurl, prj):
         target = None
         skip = False
@@ -34,6 +34,7 @@ from osclib.rebuild_command import RebuildCommand
 from osclib.request_splitter import RequestSplitter
 from osclib.supersede_command import SupersedeCommand
 from osclib.prio_command import PrioCommand
+from osclib.transport import stats as transport_stats
 
 try:
     import __builtin__
@@ -121,6 +122,7 @@ def clean_args(args):
 @cmdln.option('--no-color', action='store_true', help='strip colors from output (or add staging.color = 0 to the .oscrc general section')
 @cmdln.option('--remove-exclusion', action='store_true', help='unignore selected requests automatically', default=False)
 @cmdln.option('--save', action='store_true', help='save the result to the pseudometa package')
+@cmdln.option('--http-stats', action='store_true', help='print statistics of the requests made to OBS')
 def do_staging(self, subcmd, opts, *args):
     """${cmd_name}: Commands to work with staging projects
 
@@ -234,6 +236,12 @@ def do_staging(self, subcmd, opts, *args):
         select --strategy quick
         select --strategy special
         select --strategy super
+        select --strategy rebuild
+
+        The rebuild strategy estimates how many packages each request will
+        trigger to rebuild from _builddepinfo of splitter-rebuild-repository
+        and splitter-rebuild-arch and spreads the requests across the
+        available stagings to balance the build load.
 
         The default is none and custom is used with any filter-by or group-by
         arguments are provided.
@@ -603,3 +611,6 @@ def do_staging(self, subcmd, opts, *args):
             SupersedeCommand(api).perform(args[1:])
         elif cmd == 'unlock':
             lock.release(force=True)
+
+    if opts.http_stats:
+        print(transport_stats.summary())
@@ -12,7 +12,9 @@ from io import BytesIO
 from osc import conf
 from urllib.request import urlopen
 from osclib.cache_manager import CacheManager
+from osclib import trace
 from osclib.conf import str2bool
+from osclib.transport import stats
 from osclib.util import rmtree_nfs_safe
 from time import time
 from lxml import etree as ET
@@ -26,6 +28,7 @@ def http_request(method, url, headers={}, data=None, file=None):
     if method == 'GET':
         ret = Cache.get(url)
         if ret:
+            trace.cache_hit(method, url, ret)
             return ret
     else:
         # Logically, seems to make more sense after real call, but practically
@@ -33,7 +36,8 @@ def http_request(method, url, headers={}, data=None, file=None):
         # request acceptance which causes a GET to determine target project.
         Cache.delete(url)
 
-    ret = osc.core._http_request(method, url, headers, data, file)
+    with stats.timed(), trace.cache_miss(method == 'GET'):
+        ret = osc.core._http_request(method, url, headers, data, file)
 
     if method == 'GET':
         ret = Cache.put(url, ret)
@@ -1,11 +1,33 @@
+import hashlib
+
 from lxml import etree as ET
 from osc.core import makeurl
 from osc.core import http_GET
-from osclib.core import fileinfo_ext_all
+from osclib.core import fileinfo_ext
 from osclib.core import builddepinfo
 from osclib.memoize import memoize
 
 
+def requiredby_parse(fileinfos):
+    """Return the names of the binaries requiring the provides of fileinfos."""
+    ret = set()
+    for fileinfo in fileinfos:
+        for requiredby in fileinfo.findall('provides_ext/requiredby[@name]'):
+            ret.add(requiredby.get('name'))
+    return ret
+
+
+@memoize(ttl=60 * 60 * 24 * 7)
+def requiredby_binaries(apiurl, project, repo, arch, state, package, filenames):
+    """Return the names of the binaries requiring the provides of filenames.
+
+    The state identifies all binaries in the repository and thus whatever
+    requires them, so the result is kept until anything is rebuilt.
+    """
+    return requiredby_parse(fileinfo_ext(apiurl, project, repo, arch, package, filename)
+                            for filename in filenames)
+
+
 class CleanupRings(object):
     def __init__(self, api):
         self.bin2src = {}
@@ -145,15 +167,65 @@ class CleanupRings(object):
                     b = self.bin2src[prein]
                     self.pkgdeps[b] = 'MYinstall'
 
+    @staticmethod
+    def depinfo_graph(root):
+        """Map the packages of a _builddepinfo with view=pkgnames to the source
+        packages they build depend on."""
+        graph = {}
+        for package in root.findall('package'):
+            deps = graph.setdefault(package.get('name'), [])
+            deps.extend(dep.text for dep in package.findall('pkgdep'))
+        return graph
+
+    @staticmethod
+    def flavor_index(sources):
+        """Map main packages to their multibuild flavors."""
+        flavors = {}
+        for source in sources:
+            if ':' in source:
+                flavors.setdefault(source.split(':')[0], []).append(source)
+        return flavors
+
+    @staticmethod
+    def link_index(links):
+        """Map packages to the packages linking to them and linked by them."""
+        linked = {}
+        for ldst, lsrc in links.items():
+            linked.setdefault(lsrc, set()).add(ldst)
+            linked.setdefault(ldst, set()).add(lsrc)
+        return linked
+
+    @staticmethod
+    def repository_binaries_parse(root):
+        """Return the state and the rpms per package of a binaryversions list."""
+        state = hashlib.sha1()
+        binaries = {}
+        for binary_list in root.findall('binaryversionlist'):
+            package = binary_list.get('package')
+            for binary in binary_list.findall('binary'):
+                filename = binary.get('name')
+                state.update(f"{package}/{filename}/{binary.get('hdrmd5')}\n".encode('utf-8'))
+                if not filename.endswith('.rpm'):
+                    continue
+                if filename.endswith('.src.rpm'):
+                    continue
+                if '-debuginfo-' in filename or '-debugsource-' in filename:
+                    continue
+                binaries.setdefault(package, []).append(filename)
+        return state.hexdigest(), binaries
+
+    @memoize(session=True)
+    def repository_binaries(self, project, repo, arch):
+        url = makeurl(self.api.apiurl, ['build', project, repo, arch], {'view': 'binaryversions'})
+        return self.repository_binaries_parse(ET.parse(http_GET(url)).getroot())
+
     @memoize(session=True)
     def package_get_requiredby(self, project, package, repo, arch):
         "For a given package, return which source packages it provides runtime deps for."
-        ret = set()
-        for fileinfo in fileinfo_ext_all(self.api.apiurl, project, repo, arch, package):
-            for requiredby in fileinfo.findall('provides_ext/requiredby[@name]'):
-                ret.add(self.bin2src[requiredby.get('name')])
-
-        return ret
+        state, binaries = self.repository_binaries(project, repo, arch)
+        filenames = tuple(binaries.get(package, ()))
+        requiredby = requiredby_binaries(self.api.apiurl, project, repo, arch, state, package, filenames)
+        return set(self.bin2src[name] for name in requiredby)
 
     def check_depinfo_ring(self, prj, nextprj):
         if not self.repo_state_acceptable(prj):
@@ -204,7 +276,9 @@ class CleanupRings(object):
             # print("Directly needed: ", to_visit)
 
             url = makeurl(self.api.apiurl, ['build', prj, 'standard', arch, '_builddepinfo'], {"view": "pkgnames"})
-            root = ET.parse(http_GET(url)).getroot()
+            graph = self.depinfo_graph(ET.parse(http_GET(url)).getroot())
+            flavors = self.flavor_index(self.sources)
+            linked = self.link_index(self.links)
 
             while len(to_visit) > 0:
                 new_deps = {}
@@ -212,30 +286,26 @@ class CleanupRings(object):
                     if not is_ring0:
                         # Outside of ring0, if one multibuild flavor is needed, add all of them
                         mainpkg = pkg.split(":")[0]
-                        for src in self.sources:
-                            if src.startswith(f"{mainpkg}:"):
-                                new_deps[src] = pkg
+                        for src in flavors.get(mainpkg, ()):
+                            new_deps[src] = pkg
 
                         # Same for link groups
-                        for ldst, lsrc in self.links.items():
-                            if lsrc == mainpkg:
-                                new_deps[ldst] = pkg
-                            elif ldst == mainpkg:
-                                new_deps[lsrc] = pkg
+                        for src in linked.get(mainpkg, ()):
+                            new_deps[src] = pkg
 
                     # Add all packages which this package depends on
-                    for dep in root.xpath(f"package[@name='{pkg}']/pkgdep"):
-                        new_deps[dep.text] = pkg
+                    for dep in graph.get(pkg, ()):
+                        new_deps[dep] = pkg
 
                 # Filter out already visited deps
-                to_visit = set(new_deps).difference(set(self.pkgdeps))
+                to_visit = set(new_deps).difference(self.pkgdeps)
                 for pkg, reason in new_deps.items():
                     self.pkgdeps[pkg] = reason
 
                 all_needed_sources |= set(self.pkgdeps)
 
                 # _builddepinfo only takes care of build deps. runtime deps are handled by
-                # fileinfo_ext_all, but that's really expensive. Thus the "obvious" algorithm
+                # fileinfo_ext, but that's really expensive. Thus the "obvious" algorithm
                 # of walking from needed packages to their deps would be too slow. Instead,
                 # walk from possibly unneeded packages (much fewer than needed) and check whether
                 # they satisfy runtime deps of needed packages.
@@ -54,7 +54,7 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     3073
 
     >>> from datetime import timedelta
-    >>> k = [k for k in cache if cPickle.loads(k) == ((0,), {})][0]
+    >>> k = [k for k in cache if cPickle.loads(bytes.fromhex(k)) == ((0,), {})][0]
     >>> t, v = cache[k]
     >>> t = t - timedelta(days=10)
     >>> cache[k] = (t, v)
@@ -118,7 +118,8 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             # representation.
             key = pickle.dumps(obj, protocol=-1)
             key = pickle.dumps(pickle.loads(key), protocol=-1)
-            return key
+            # shelve only accepts str keys
+            return key.hex()
 
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
@@ -3,8 +3,10 @@ import dateutil.parser
 from lxml import etree as ET
 from osc import conf
 from osc.core import show_project_meta
+from osclib.core import builddepinfo
 from osclib.core import devel_project_fallback
 from osclib.core import request_age
+from osclib.memoize import memoize
 from osclib.util import sha1_short
 import re
 
@@ -107,6 +109,8 @@ class RequestSplitter(object):
             else:
                 self.other.append(request)
 
+        self.strategy.arrange(self)
+
     def supplement(self, request):
         """ Provide additional information for grouping """
         if request.get('ignored'):
@@ -391,6 +395,10 @@ class Strategy(object):
     def desirable(self, splitter):
         return splitter.grouped.keys()
 
+    def arrange(self, splitter):
+        # Allow strategies to rearrange groups once all requests are split.
+        pass
+
 
 class StrategyNone(Strategy):
     def apply(self, splitter):
@@ -519,3 +527,102 @@ class StrategySpecial(StrategyNone):
         super(StrategySpecial, self).apply(splitter)
         splitter.filter_add_requests(self.PACKAGES)
         splitter.group_by('./action/target/@package')
+
+
+@memoize(session=True)
+def reverse_builddeps(apiurl, project, repository, arch):
+    """Map each package to the packages build depending on it directly.
+
+    Multibuild flavors are folded into their main package.
+    """
+    rdeps = {}
+    for package in builddepinfo(apiurl, project, repository, arch).findall('package'):
+        name = package.get('name').split(':')[0]
+        for pkgdep in package.findall('pkgdep'):
+            rdeps.setdefault(pkgdep.text.split(':')[0], set()).add(name)
+    return rdeps
+
+
+class StrategyRebuild(StrategyNone):
+    """Pack requests into stagings based on their estimated rebuild fan-out.
+
+    The cost of a request is the number of packages in the target project that
+    (transitively) build depend on the target package according to
+    _builddepinfo. Requests are placed heaviest first into the least loaded
+    group and one group is created per available staging. As such the heaviest
+    rebuilders end up in separate stagings and the build load is balanced.
+    """
+
+    def __init__(self, **kwargs):
+        super(StrategyRebuild, self).__init__(**kwargs)
+        # Request id to the number of packages rebuilt, filled by arrange().
+        self.rebuild_costs = {}
+
+    def arrange(self, splitter):
+        requests = []
+        for info in splitter.grouped.values():
+            requests.extend(info['requests'])
+        splitter.grouped = {}
+        if not len(requests):
+            return
+
+        costs = self.costs(splitter, requests)
+
+        stagings = getattr(splitter, 'stagings_available', [])
+        count = int(self.kwargs.get('stagings', len(stagings)))
+        bootstrapped = len([s for s in stagings if splitter.stagings[s]['bootstrapped']])
+
+        buckets_bootstrap = 0
+        for bootstrap_required in (True, False):
+            subset = [r for r in requests if self.bootstrap_required(r) == bootstrap_required]
+            if not len(subset):
+                continue
+
+            if bootstrap_required:
+                buckets = buckets_bootstrap = max(1, min(bootstrapped, count))
+                prefix = 'bootstrap'
+            else:
+                # Non-bootstrap groups may fallback to bootstrapped stagings.
+                buckets = max(1, count - buckets_bootstrap)
+                prefix = 'rebuild'
+
+            loads = [0] * buckets
+            for request in sorted(subset, key=lambda r: (-costs[r.get('id')], int(r.get('id')))):
+                index = loads.index(min(loads))
+                loads[index] += costs[request.get('id')]
+
+                group = f'{prefix}-{index:02d}'
+                if group not in splitter.grouped:
+                    splitter.grouped[group] = {
+                        'bootstrap_required': bootstrap_required,
+                        'requests': [],
+                    }
+                splitter.grouped[group]['requests'].append(request)
+
+    @staticmethod
+    def bootstrap_required(request):
+        ring = request.find('./action/target').get('ring')
+        return bool(ring and ring.startswith('0'))
+
+    def costs(self, splitter, requests):
+        config = splitter.config
+        repository = config.get('splitter-rebuild-repository', config.get('main-repo', 'standard'))
+        arch = config.get('splitter-rebuild-arch', config.get('staging-archs', 'x86_64').split()[-1])
+        rdeps = reverse_builddeps(splitter.api.apiurl, splitter.api.project, repository, arch)
+
+        for request in requests:
+            package = request.find('./action/target').get('package')
+            self.rebuild_costs[request.get('id')] = len(self.closure(rdeps, package))
+
+        return self.rebuild_costs
+
+    @staticmethod
+    def closure(rdeps, package):
+        visited = {package}
+        to_visit = [package]
+        while len(to_visit):
+            for rdep in rdeps.get(to_visit.pop(), ()):
+                if rdep not in visited:
+                    visited.add(rdep)
+                    to_visit.append(rdep)
+        return visited
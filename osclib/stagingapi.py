@@ -46,6 +46,7 @@ from osclib.comments import CommentAPI
 from osclib.ignore_command import IgnoreCommand
 from osclib.memoize import memoize
 from osclib.freeze_command import MAX_FROZEN_AGE
+from osclib.transport import retried_request
 
 
 class StagingAPI(object):
@@ -65,6 +66,8 @@ class StagingAPI(object):
         self._ring_packages = None
         self._ring_packages_for_links = None
         self._packages_staged = None
+        self._ignored_requests = None
+        self._supersede_index = None
         self._package_metas = dict()
         self._supersede = False
         self._package_disabled = {}
@@ -159,24 +162,7 @@ class StagingAPI(object):
         return makeurl(self.apiurl, paths, query)
 
     def _retried_request(self, url, func, data=None):
-        retry_sleep_seconds = 1
-        while True:
-            try:
-                if data is not None:
-                    return func(url, data=data)
-                return func(url)
-            except HTTPError as e:
-                if 500 <= e.code <= 599:
-                    print(f'Error {e.code}, retrying {url} in {retry_sleep_seconds}s')
-                elif e.code == 400 and e.reason == 'service in progress':
-                    print(f'Service in progress, retrying {url} in {retry_sleep_seconds}s')
-                else:
-                    raise e
-                time.sleep(retry_sleep_seconds)
-                # increase sleep time up to one minute to avoid hammering
-                # the server in case of real problems
-                if (retry_sleep_seconds % 60):
-                    retry_sleep_seconds += 1
+        return retried_request(url, func, data)
 
     def retried_GET(self, url):
         return self._retried_request(url, http_GET)
@@ -456,7 +442,7 @@ class StagingAPI(object):
 
             # Ensure a request for same package is already staged.
             if stage_info and stage_info['rq_id'] != request_id:
-                request_old = get_request(self.apiurl, str(stage_info['rq_id'])).to_xml()
+                request_old = self.staged_request(stage_info['rq_id'])
                 request_new = request
                 replace_old = request_old.find('state').get('name') in ['revoked', 'superseded', 'declined']
 
@@ -516,6 +502,8 @@ class StagingAPI(object):
                         self.rm_from_prj(stage_info['prj'], request_id=stage_info['rq_id'])
                         self.do_change_review_state(stage_info['rq_id'], 'declined',
                                                     by_group=self.cstaging_group, message=message)
+                        # Keep the supersede index in sync with the server.
+                        request_old.find('state').set('name', 'declined')
                         return stage_info, None
                     # Ingore the new request pending manual review.
                     IgnoreCommand(self).perform([str(request_id)], message)
@@ -524,6 +512,45 @@ class StagingAPI(object):
 
         return None, None
 
+    def staged_request(self, request_id):
+        """
+        Returns the request xml of a staged request, from the supersede
+        index when loaded by dispatch_open_requests()
+        """
+        request_id = str(request_id)
+        if self._supersede_index is not None and request_id in self._supersede_index:
+            return self._supersede_index[request_id]
+
+        return get_request(self.apiurl, request_id).to_xml()
+
+    def supersede_index_load(self, requests, target_requests=None):
+        """
+        Load all staged requests that may be superseded by one of requests
+        with a single search instead of one lookup per request. Like
+        superseded_request() only target_requests are considered if given.
+        """
+        request_ids = set()
+        for request in requests:
+            target = request.find('./action/target')
+            if target is None:
+                continue
+            if target_requests and not (target.get('package') in target_requests or
+                                        request.get('id') in target_requests):
+                continue
+            stage_info = self.packages_staged.get(target.get('package'))
+            if stage_info and stage_info['rq_id'] != request.get('id'):
+                request_ids.add(str(stage_info['rq_id']))
+
+        self._supersede_index = {}
+        request_ids = sorted(request_ids, key=int)
+        # Keep the query reasonably short for large backlogs.
+        for i in range(0, len(request_ids), 250):
+            match = ' or '.join(f"@id='{request_id}'" for request_id in request_ids[i:i + 250])
+            url = self.makeurl(['search', 'request'], {'match': match})
+            root = ET.parse(self.retried_GET(url)).getroot()
+            for request in root.findall('request'):
+                self._supersede_index[request.get('id')] = request
+
     def update_superseded_request(self, request, target_requests=None):
         """
         Replace superseded requests that are already in some
@@ -536,9 +563,7 @@ class StagingAPI(object):
         request_id = int(request.get('id'))
 
         # do not process the request has been excluded
-        requests_ignored = self.get_ignored_requests()
-        requests_ignored = [rq for rq in requests_ignored.keys()]
-        if request_id in requests_ignored:
+        if request_id in self.get_ignored_requests():
             return False, False
 
         stage_info, code = self.superseded_request(request, target_requests)
@@ -552,26 +577,41 @@ class StagingAPI(object):
 
         return stage_info, code
 
-    @memoize(session=True)
     def get_ignored_requests(self):
-        ignore = {}
-        url = self.makeurl(['staging', self.project, 'excluded_requests'])
-        root = ET.parse(self.retried_GET(url)).getroot()
-        for entry in root.findall('request'):
-            ignore[int(entry.get('id'))] = entry.get('description')
-        return ignore
+        """
+        Index of excluded requests (request id -> description)
+
+        Loaded once and kept up to date by add_ignored_request() and
+        del_ignored_request(). Use invalidate_ignored_requests() to reload.
+        """
+        if self._ignored_requests is None:
+            ignore = {}
+            url = self.makeurl(['staging', self.project, 'excluded_requests'])
+            root = ET.parse(self.retried_GET(url)).getroot()
+            for entry in root.findall('request'):
+                ignore[int(entry.get('id'))] = entry.get('description')
+            self._ignored_requests = ignore
+
+        return self._ignored_requests
+
+    def invalidate_ignored_requests(self):
+        self._ignored_requests = None
 
     def add_ignored_request(self, request_id, comment):
         url = self.makeurl(['staging', self.project, 'excluded_requests'])
         root = ET.Element('excluded_requests')
         ET.SubElement(root, 'request', {'id': str(request_id), 'description': comment})
         http_POST(url, data=ET.tostring(root))
+        if self._ignored_requests is not None:
+            self._ignored_requests[int(request_id)] = comment
 
     def del_ignored_request(self, request_id):
         url = self.makeurl(['staging', self.project, 'excluded_requests'])
         root = ET.Element('excluded_requests')
         ET.SubElement(root, 'request', {'id': str(request_id)})
         http_DELETE(url, data=ET.tostring(root))
+        if self._ignored_requests is not None:
+            self._ignored_requests.pop(int(request_id), None)
 
     @memoize(session=True, add_invalidate=True)
     def get_open_requests(self, query_extra=None):
@@ -616,11 +656,15 @@ class StagingAPI(object):
         # get all current pending requests
         self._supersede = True
         requests = self.get_open_requests()
-        # check if we can reduce it down by accepting some
-        for rq in requests:
-            stage_info, code = self.update_superseded_request(rq, target_requests)
-            if stage_info:
-                yield (stage_info, code, rq)
+        self.supersede_index_load(requests, target_requests)
+        try:
+            # check if we can reduce it down by accepting some
+            for rq in requests:
+                stage_info, code = self.update_superseded_request(rq, target_requests)
+                if stage_info:
+                    yield (stage_info, code, rq)
+        finally:
+            self._supersede_index = None
         self._supersede = False
 
     def get_prj_meta_revision(self, project):
@@ -925,6 +969,8 @@ class StagingAPI(object):
             opts['remove_exclusion'] = 1
         u = makeurl(self.apiurl, ['staging', self.project, 'staging_projects', project, 'staged_requests'], opts)
         http_POST(u, data=requestxml)
+        if remove_exclusion and self._ignored_requests is not None:
+            self._ignored_requests.pop(int(request_id), None)
 
         if act_type == 'delete':
             self.delete_to_prj(act[0], project)
@@ -1507,9 +1553,9 @@ class StagingAPI(object):
 
     def ignore_format(self, request_id):
         requests_ignored = self.get_ignored_requests()
-        if int(request_id) in requests_ignored.keys():
+        if int(request_id) in requests_ignored:
             ignore_indent = ' ' * (2 + len(str(request_id)) + 1)
-            return textwrap.fill(str(requests_ignored[request_id]),
+            return textwrap.fill(str(requests_ignored[int(request_id)]),
                                  initial_indent=ignore_indent,
                                  subsequent_indent=ignore_indent,
                                  break_long_words=False)
@@ -0,0 +1,194 @@
+"""Opt-in trace of the requests made to the OBS API.
+
+Set $OSRT_TRACE to a file (or an existing directory) to record every request
+made through osc with its method, URL template, status, size, cache use and
+latency. At exit a summary per URL template is printed to stderr and the
+requests are written in the Chrome trace event format, which can be loaded in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import osc.connection
+import osc.core
+
+# Top level paths whose second component names the endpoint rather than an
+# object, like /search/request or /statistics/latest_updated.
+ENDPOINT_ROOTS = ('search', 'statistics', 'comments')
+# Query parameters selecting a different kind of response.
+QUERY_KEEP_VALUES = ('view', 'cmd', 'deleted', 'expand', 'withhistory')
+
+tracer = None
+
+
+def url_template(url):
+    """Replace project, package and other names in url by *."""
+    parts = urlsplit(url)
+    components = unquote(parts.path).strip('/').split('/')
+    template = []
+    for i, component in enumerate(components):
+        if i == 0 or component.startswith('_') or (i == 1 and components[0] in ENDPOINT_ROOTS):
+            template.append(component)
+        else:
+            template.append('*')
+    query = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        query.append(f'{key}={value}' if key in QUERY_KEEP_VALUES else f'{key}=*')
+    path = '/' + '/'.join(template)
+    if query:
+        path += '?' + '&'.join(sorted(set(query)))
+    return path
+
+
+def response_size(response):
+    headers = getattr(response, 'headers', None)
+    length = headers.get('Content-Length') if headers else None
+    return int(length) if length else 0
+
+
+class Tracer(object):
+    def __init__(self, filename, command):
+        self.filename = filename
+        self.command = command
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.events = []
+        self.local = threading.local()
+
+    def record(self, method, url, status, size, cache, start, duration):
+        with self.lock:
+            self.events.append({
+                'method': method,
+                'url': url,
+                'template': url_template(url),
+                'status': status,
+                'bytes': size,
+                'cache': cache,
+                'start': start,
+                'duration': duration,
+                'thread': threading.get_ident(),
+            })
+
+    def request(self, func, method, url, *args, **kwargs):
+        start = time.time()
+        status = None
+        size = 0
+        try:
+            response = func(method, url, *args, **kwargs)
+            status = getattr(response, 'status', None) or getattr(response, 'code', None)
+            size = response_size(response)
+            return response
+        except HTTPError as e:
+            status = e.code
+            raise e
+        finally:
+            cache = getattr(self.local, 'cache', '')
+            self.record(method, url, status, size, cache, start, time.time() - start)
+
+    def summary(self):
+        """Aggregate the requests per method and URL template."""
+        rows = defaultdict(lambda: {'count': 0, 'errors': 0, 'hits': 0, 'bytes': 0, 'seconds': 0.0})
+        for event in self.events:
+            row = rows[(event['method'], event['template'])]
+            row['count'] += 1
+            row['errors'] += 1 if not event['status'] or event['status'] >= 400 else 0
+            row['hits'] += 1 if event['cache'] == 'hit' else 0
+            row['bytes'] += event['bytes']
+            row['seconds'] += event['duration']
+        return sorted(rows.items(), key=lambda item: item[1]['seconds'], reverse=True)
+
+    def summary_table(self):
+        lines = [f'OBS requests of {self.command}:',
+                 f"{'count':>7} {'errors':>6} {'hits':>6} {'bytes':>12} {'seconds':>9} {'mean':>7}  request"]
+        for (method, template), row in self.summary():
+            mean = row['seconds'] / row['count']
+            lines.append(f"{row['count']:7} {row['errors']:6} {row['hits']:6} {row['bytes']:12} "
+                         f"{row['seconds']:9.2f} {mean:7.3f}  {method} {template}")
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            events.append({
+                'name': f"{event['method']} {event['template']}",
+                'cat': event['cache'] or 'request',
+                'ph': 'X',
+                'ts': int((event['start'] - self.start) * 1000000),
+                'dur': int(event['duration'] * 1000000),
+                'pid': pid,
+                'tid': event['thread'],
+                'args': {key: event[key] for key in ('url', 'status', 'bytes', 'cache')},
+            })
+        return {'traceEvents': events, 'otherData': {'command': self.command}}
+
+    def export(self):
+        print(self.summary_table(), file=sys.stderr)
+        filename = self.filename
+        if os.path.isdir(filename):
+            name = os.path.basename(self.command.split(' ')[0])
+            filename = os.path.join(filename, f'{name}-{int(self.start)}-{os.getpid()}.json')
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def traced(func):
+    def http_request(method, url, *args, **kwargs):
+        if tracer is None:
+            return func(method, url, *args, **kwargs)
+        return tracer.request(func, method, url, *args, **kwargs)
+    http_request.traced = True
+    return http_request
+
+
+def enable(filename, command=None):
+    """Trace the requests made by osc and export them to filename at exit."""
+    global tracer
+    if tracer is not None:
+        return
+    if command is None:
+        command = ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:2])
+    tracer = Tracer(filename, command)
+
+    # osc.core re-exports the functions of osc.connection and osclib.cache
+    # replaces osc.core.http_request, so wrap wherever the original is used.
+    original = osc.connection.http_request
+    if not getattr(original, 'traced', False):
+        wrapper = traced(original)
+        osc.connection.http_request = wrapper
+        for name in ('http_request', '_http_request'):
+            if getattr(osc.core, name, None) is original:
+                setattr(osc.core, name, wrapper)
+    atexit.register(tracer.export)
+
+
+@contextmanager
+def cache_miss(miss=True):
+    """Mark the requests made within the context as cache misses."""
+    if tracer is None or not miss:
+        yield
+        return
+    tracer.local.cache = 'miss'
+    try:
+        yield
+    finally:
+        tracer.local.cache = ''
+
+
+def cache_hit(method, url, response):
+    if tracer is not None:
+        tracer.record(method, url, 200, response_size(response), 'hit', time.time(), 0)
+
+
+if os.environ.get('OSRT_TRACE'):
+    enable(os.environ['OSRT_TRACE'])
@@ -0,0 +1,142 @@
+import bisect
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError
+
+import osc.connection
+
+# Retry delays grow exponentially from RETRY_DELAY_MIN up to RETRY_DELAY_MAX
+# seconds with half of each delay randomized so that several tools failing at
+# the same time do not come back at the same time. Once RETRY_BUDGET seconds
+# were spent waiting for a request the error is raised.
+RETRY_DELAY_MIN = 1
+RETRY_DELAY_MAX = 60
+RETRY_BUDGET = 60 * 60
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class TransportStats(object):
+    """Counters of the requests made to the OBS API."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.retries = 0
+            self.retry_seconds = 0.0
+            self.latency_total = 0.0
+            self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @contextmanager
+    def timed(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(time.monotonic() - start)
+
+    def record(self, seconds):
+        with self.lock:
+            self.requests += 1
+            self.latency_total += seconds
+            self.latency[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def retried(self, delay):
+        with self.lock:
+            self.retries += 1
+            self.retry_seconds += delay
+
+    @staticmethod
+    def connections():
+        """Return the number of connections opened and requests made by the
+        keep-alive connection pools osc holds per apiurl."""
+        connections = 0
+        requests = 0
+        for pool in getattr(osc.connection, 'CONNECTION_POOLS', {}).values():
+            connections += pool.num_connections
+            requests += pool.num_requests
+        return connections, requests
+
+    def reuse_ratio(self):
+        connections, requests = self.connections()
+        if not requests:
+            return 0.0
+        return 1 - connections / requests
+
+    def summary(self):
+        connections, requests = self.connections()
+        lines = [
+            f'requests: {self.requests}, {self.latency_total:.2f}s',
+            f'retries: {self.retries}, {self.retry_seconds:.2f}s waited',
+            f'connections: {connections} for {requests} requests, reuse ratio {self.reuse_ratio():.2f}',
+            'latency:',
+        ]
+        bounds = [f'<= {bound}s' for bound in LATENCY_BUCKETS] + [f'> {LATENCY_BUCKETS[-1]}s']
+        for bound, count in zip(bounds, self.latency):
+            lines.append(f'  {bound:>8} {count}')
+        return '\n'.join(lines)
+
+
+stats = TransportStats()
+
+
+def retry_after(e):
+    """Return the seconds to wait requested by the Retry-After header of e."""
+    value = e.headers.get('Retry-After') if e.headers else None
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_delay(attempt):
+    delay = min(RETRY_DELAY_MAX, RETRY_DELAY_MIN * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retried_request(url, func, data=None, budget=RETRY_BUDGET):
+    """Call func for url and retry server errors with exponential backoff.
+
+    The delay asked for by the server with a Retry-After header is honored.
+    """
+    attempt = 0
+    waited = 0
+    while True:
+        try:
+            if data is not None:
+                return func(url, data=data)
+            return func(url)
+        except HTTPError as e:
+            if 500 <= e.code <= 599:
+                message = f'Error {e.code}'
+            elif e.code == 429:
+                message = 'Too many requests'
+            elif e.code == 400 and e.reason == 'service in progress':
+                message = 'Service in progress'
+            else:
+                raise e
+            delay = retry_after(e)
+            if delay is None:
+                delay = retry_delay(attempt)
+            if waited + delay > budget:
+                raise e
+            print(f'{message}, retrying {url} in {delay:.0f}s')
+            stats.retried(delay)
+            time.sleep(delay)
+            waited += delay
+            attempt += 1
@@ -18,7 +18,7 @@ class UnignoreCommand(object):
         Unignore a request by removing from ignore list.
         """
 
-        requests_ignored = self.api.get_ignored_requests()
+        requests_ignored = dict(self.api.get_ignored_requests())
 
         if len(requests) == 1 and requests[0] == 'all':
             requests_ignored = {}
@@ -0,0 +1,67 @@
+"""Local HTTP servers standing in for OBS and other services.
+
+Unlike OBSLocal these need no OBS instance, the handlers answer the few
+requests made by the code under test.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import osc.conf
+
+
+class LocalServer(ThreadingHTTPServer):
+    """Serve requests with handler on a free port of localhost."""
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.lock = threading.Lock()
+        self.url = f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def reply(self, data=b'', status=200, headers={}):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCase(unittest.TestCase):
+    """Provide a temporary directory in self.dir and run the server passed
+    to serve() for the test, with osc configured to use it as apiurl."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def serve(self, server, osc_config=True):
+        self.server = server.start()
+        self.addCleanup(server.stop)
+        self.url = server.url
+        if osc_config:
+            oscrc = os.path.join(self.dir, 'oscrc')
+            with open(oscrc, 'w') as f:
+                f.write(f'[general]\napiurl = {self.url}\ncookiejar = {self.dir}/cookiejar\n\n'
+                        f'[{self.url}]\nuser = Admin\npass = opensuse\nallow_http = 1\n')
+            osc.conf.get_config(override_conffile=oscrc, override_no_keyring=True)
+        return server
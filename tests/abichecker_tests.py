@@ -0,0 +1,187 @@
+import io
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pytest
+
+# the rpm module on PyPI fails with an ImportError without the system bindings
+try:
+    import rpm  # noqa: F401
+except ImportError:
+    pytest.skip('rpm bindings are not installed', allow_module_level=True)
+pytest.importorskip('sqlalchemy')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'abichecker'))
+
+import abichecker  # noqa: E402
+
+
+def newc(members, trailer=True):
+    """Return a cpio archive in newc format of (name, data) members."""
+    def pad(size):
+        return b'\0' * ((4 - size % 4) % 4)
+
+    archive = b''
+    for ino, (name, data) in enumerate(members + ([('TRAILER!!!', b'')] if trailer else [])):
+        name = name.encode('utf-8') + b'\0'
+        fields = (ino, 0o100644, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0)
+        header = b'070701' + b''.join(b'%08X' % field for field in fields)
+        archive += header + name + pad(len(header) + len(name)) + data + pad(len(data))
+    return archive
+
+
+KEY = ('openSUSE:Factory', 'standard', 'x86_64', 'libfoo1-1.0-1.1.x86_64.rpm', '1729000000')
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = abichecker.DownloadCache(os.path.join(self.tmpdir.name, 'cache'), 250,
+                                              logging.getLogger('abichecker'))
+
+    def download(self, content):
+        with tempfile.NamedTemporaryFile(dir=self.tmpdir.name, delete=False) as f:
+            f.write(content)
+        return f.name
+
+    def key(self, name):
+        return KEY[:3] + (f'{name}.rpm', KEY[4])
+
+    def age(self, path, seconds):
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(KEY))
+        download = self.download(b'rpm')
+        path = self.cache.put(KEY, download)
+        self.assertFalse(os.path.exists(download))
+        self.assertEqual(self.cache.get(KEY), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'rpm')
+
+        # a rebuild has another mtime, the same content is stored once
+        rebuilt = KEY[:4] + ('1729000001',)
+        self.assertIsNone(self.cache.get(rebuilt))
+        self.assertEqual(self.cache.put(rebuilt, self.download(b'rpm')), path)
+        self.assertEqual(os.listdir(self.cache.objects), [os.path.basename(path)])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+        # the key of an evicted file is dropped
+        os.unlink(path)
+        self.assertIsNone(self.cache.get(KEY))
+        self.assertFalse(os.path.exists(self.cache._keyfile(KEY)))
+
+    def test_evict_lru(self):
+        paths = {}
+        for age, name in ((30, 'a'), (20, 'b')):
+            paths[name] = self.cache.put(self.key(name), self.download(name.encode('utf-8') * 100))
+            self.age(paths[name], age)
+
+        # a was used recently, b is the least recently used one
+        self.assertEqual(self.cache.get(self.key('a')), paths['a'])
+        paths['c'] = self.cache.put(self.key('c'), self.download(b'c' * 100))
+        self.assertEqual(sorted(os.listdir(self.cache.objects)),
+                         sorted(os.path.basename(paths[name]) for name in 'ac'))
+        self.assertIsNone(self.cache.get(self.key('b')))
+
+        # then the oldest ones go first
+        self.age(paths['a'], 10)
+        self.age(paths['c'], 20)
+        self.cache.put(self.key('d'), self.download(b'd' * 100))
+        self.assertFalse(os.path.exists(paths['c']))
+        self.assertTrue(os.path.exists(paths['a']))
+        self.cache.put(self.key('e'), self.download(b'e' * 100))
+        self.assertFalse(os.path.exists(paths['a']))
+        self.assertEqual(len(os.listdir(self.cache.objects)), 2)
+
+    def test_evict_keep(self):
+        # the newest file is kept even if larger than the cache
+        small = self.cache.put(self.key('small'), self.download(b's' * 100))
+        self.age(small, 10)
+        large = self.cache.put(self.key('large'), self.download(b'l' * 300))
+        self.assertEqual(os.listdir(self.cache.objects), [os.path.basename(large)])
+
+        # a batch larger than the cache keeps all files of the batch
+        batch = set()
+        for name in 'abcd':
+            path = self.cache.put(self.key(name), self.download(name.encode('utf-8') * 100), batch)
+            self.age(path, 10)
+            batch.add(path)
+        self.assertEqual(sorted(os.listdir(self.cache.objects)), sorted(os.path.basename(path) for path in batch))
+
+        # and evicts them for the next one
+        path = self.cache.put(self.key('e'), self.download(b'e' * 100))
+        self.assertEqual(len(os.listdir(self.cache.objects)), 2)
+        self.assertTrue(os.path.exists(path))
+
+
+class TestExtractRpm(unittest.TestCase):
+
+    MEMBERS = [
+        ('./usr/lib64/libfoo.so.1', b'\x7fELF' + b'x' * 4093),
+        ('./usr/share/doc/packages/foo/README', b'docs'),
+        ('./usr/lib64/libfoo.so.1.0.0', b''),
+        ('./usr/lib/debug/usr/lib64/libfoo.so.1.debug', b'debug!'),
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.checker = abichecker.ABIChecker.__new__(abichecker.ABIChecker)
+        self.checker.logger = logging.getLogger('abichecker')
+        self.dst = os.path.join(self.tmpdir.name, 'unpacked')
+
+    def members(self, archive):
+        fh = io.BytesIO(archive)
+        members = []
+        for name, size in self.checker._cpio_members(fh):
+            out = io.BytesIO()
+            self.checker._cpio_copy(fh, size, out)
+            members.append((name, out.getvalue()))
+        return members, fh.read()
+
+    def extract(self, archive, wanted):
+        filename = os.path.join(self.tmpdir.name, 'foo.rpm')
+        with open(filename, 'wb') as f:
+            f.write(archive)
+        # the payload is passed through unchanged instead of by rpm2cpio
+        popen = subprocess.Popen
+        with mock.patch.object(abichecker.subprocess, 'Popen',
+                               side_effect=lambda args, **kwargs: popen(['cat', args[1]], **kwargs)):
+            self.checker.extract_rpm(filename, wanted, self.dst)
+
+    def extracted(self):
+        return sorted(os.path.relpath(os.path.join(path, fn), self.dst)
+                      for path, _, files in os.walk(self.dst) for fn in files)
+
+    def test_members(self):
+        # names and data of all sizes are padded, nothing follows the trailer
+        members, rest = self.members(newc(self.MEMBERS) + b'garbage')
+        self.assertEqual(members, self.MEMBERS)
+        self.assertEqual(rest, b'garbage')
+
+    def test_extract(self):
+        wanted = {'/usr/lib64/libfoo.so.1', '/usr/lib/debug/usr/lib64/libfoo.so.1.debug', '/usr/lib64/libbar.so.1'}
+        self.extract(newc(self.MEMBERS), wanted)
+        self.assertEqual(self.extracted(), ['usr/lib/debug/usr/lib64/libfoo.so.1.debug', 'usr/lib64/libfoo.so.1'])
+        with open(os.path.join(self.dst, 'usr/lib64/libfoo.so.1'), 'rb') as f:
+            self.assertEqual(f.read(), self.MEMBERS[0][1])
+
+    def test_truncated(self):
+        archive = newc(self.MEMBERS)
+        # in the data of a member, in a header and without a trailer
+        for truncated in (archive[:200], archive[:len(newc(self.MEMBERS[:1], trailer=False)) + 50],
+                          newc(self.MEMBERS, trailer=False)):
+            with self.assertRaises(abichecker.FetchError):
+                self.members(truncated)
+            with self.assertRaises(abichecker.FetchError):
+                self.extract(truncated, {'/usr/share/doc/packages/foo/README'})
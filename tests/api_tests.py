@@ -1,5 +1,12 @@
+import os
+import time
+import unittest
+from unittest import mock
+
 import osc.core
 from osclib.core import attribute_value_delete, attribute_value_save
+from osclib.stagingapi import StagingAPI
+from . import LocalServer
 from . import OBSLocal
 
 # CI-Node: Long1
@@ -81,6 +88,25 @@ class TestApiCalls(OBSLocal.TestCase):
         # Compare the results, we only care now that we got 1 of them not the content
         self.assertEqual(1, len(requests))
 
+    def test_ignored_requests(self):
+        """
+        Test the excluded request index is kept in sync without reloading
+        """
+        request_id = int(self.wf.create_submit_request('devel:wine', 'wine2').reqid)
+
+        self.assertEqual({}, self.wf.api.get_ignored_requests())
+        self.wf.api.add_ignored_request(request_id, 'not yet')
+        self.assertEqual({request_id: 'not yet'}, self.wf.api.get_ignored_requests())
+        self.assertEqual(' ' * (3 + len(str(request_id))) + 'not yet', self.wf.api.ignore_format(request_id))
+
+        # Index matches what is stored on the server.
+        self.wf.api.invalidate_ignored_requests()
+        self.assertEqual({request_id: 'not yet'}, self.wf.api.get_ignored_requests())
+
+        self.wf.api.del_ignored_request(request_id)
+        self.assertEqual({}, self.wf.api.get_ignored_requests())
+        self.assertIsNone(self.wf.api.ignore_format(request_id))
+
     def test_request_id_package_mapping(self):
         """
         Test whether we can get correct id for sr in staging project
@@ -216,3 +242,51 @@ class TestApiCalls(OBSLocal.TestCase):
         self.wf.api.move_between_project('openSUSE:Factory:Staging:B', self.winerq.reqid, 'openSUSE:Factory:Staging:A')
         self.assertTrue(self.wf.api.item_exists('openSUSE:Factory:Staging:A', 'wine'))
         self.assertFalse(self.wf.api.item_exists('openSUSE:Factory:Staging:B', 'wine'))
+
+
+class ExcludedRequestsServer(LocalServer.LocalServer):
+    """Serve the excluded requests of a staging workflow."""
+
+    def __init__(self, excluded):
+        super().__init__(ExcludedRequestsHandler)
+        self.paths = []
+        self.data = '<excluded_requests>{}</excluded_requests>'.format(''.join(
+            f'<request id="{request_id}" package="pkg{request_id}" description="excluded {request_id}"/>'
+            for request_id in excluded))
+
+
+class ExcludedRequestsHandler(LocalServer.Handler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.paths.append(self.path)
+        if not self.path.endswith('/excluded_requests'):
+            self.send_error(404)
+            return
+        self.reply(self.server.data)
+
+
+@unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK=1 to run benchmarks')
+class BenchmarkIgnoredRequests(LocalServer.TestCase):
+    """API requests and time of the excluded request lookups done by
+    osc staging list for a large backlog."""
+
+    REQUESTS = 5000
+    EXCLUDED = 1000
+
+    def setUp(self):
+        super().setUp()
+        self.serve(ExcludedRequestsServer(range(0, self.REQUESTS, self.REQUESTS // self.EXCLUDED)))
+        patcher = mock.patch('osclib.cache.Cache.init')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_list(self):
+        api = StagingAPI(self.url, 'openSUSE:Factory')
+        start = time.perf_counter()
+        messages = [api.ignore_format(request_id) for request_id in range(self.REQUESTS)]
+        duration = time.perf_counter() - start
+
+        self.assertEqual(sum(1 for message in messages if message), self.EXCLUDED)
+        self.assertEqual(self.server.paths, ['/staging/openSUSE:Factory/excluded_requests'])
+        print(f'\n{self.REQUESTS} requests with {self.EXCLUDED} excluded: '
+              f'{len(self.server.paths)} API request, {duration:.3f}s')
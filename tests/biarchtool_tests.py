@@ -0,0 +1,171 @@
+import unittest
+from urllib.parse import parse_qs, urlparse
+
+from lxml import etree as ET
+
+from biarchtool import BiArchTool
+
+from . import LocalServer
+
+PROJECT = 'openSUSE:Factory'
+
+SEARCH = f"""
+<collection>
+  <package name="bash" project="{PROJECT}">
+    <title/>
+    <description/>
+  </package>
+  <package name="zsh" project="{PROJECT}">
+    <title/>
+    <description/>
+  </package>
+  <package name="glibc" project="{PROJECT}">
+    <title/>
+    <description/>
+    <build>
+      <enable arch="i586"/>
+    </build>
+  </package>
+  <package name="tcsh" project="{PROJECT}">
+    <title/>
+    <description/>
+    <build>
+      <disable arch="i586"/>
+    </build>
+  </package>
+</collection>
+"""
+
+BUILDDEPINFO = """
+<builddepinfo>
+  <package name="glibc">
+    <pkgdep>bash</pkgdep>
+  </package>
+</builddepinfo>
+"""
+
+SOURCEINFO = """
+<sourceinfolist>
+  <sourceinfo package="bash" rev="7" srcmd5="{bash}"/>
+  <sourceinfo package="bash-completion" rev="1" srcmd5="{expanded}" lsrcmd5="{link}"/>
+  <sourceinfo package="broken"/>
+</sourceinfolist>
+"""
+
+
+class MetaServer(LocalServer.LocalServer):
+    """Stand-in for the OBS endpoints used by biarchtool.
+
+    The package search is not updated by writes, like an outdated search.
+    """
+
+    def __init__(self):
+        super().__init__(MetaHandler)
+        self.puts = []
+        self.posts = []
+        self.gets = []
+        self.srcmd5s = {'bash': 'a' * 32, 'expanded': 'b' * 32, 'link': 'c' * 32}
+
+
+class MetaHandler(LocalServer.Handler):
+    def reply(self, data=b'<status code="ok"/>'):
+        super().reply(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        with self.server.lock:
+            self.server.gets.append((path, query))
+        if path == '/search/package':
+            self.reply(SEARCH)
+        elif path.endswith('/_builddepinfo'):
+            self.reply(BUILDDEPINFO)
+        elif path == f'/source/{PROJECT}' and query.get('view') == ['info']:
+            self.reply(SOURCEINFO.format(**self.server.srcmd5s))
+        elif path.startswith(f'/source/{PROJECT}/'):
+            # the files are named like the revision to tell them apart
+            package = path.split('/')[3]
+            revision = query.get('rev', ['latest'])[0]
+            self.reply(f'<directory name="{package}"><entry name="{package}.spec"/>'
+                       f'<entry name="{revision}"/></directory>')
+        else:
+            self.send_error(404)
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.puts.append((urlparse(self.path).path, data))
+        self.reply()
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.posts.append(self.path)
+        self.reply()
+
+
+class TestBiArchTool(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(MetaServer())
+        self.tool = BiArchTool(PROJECT)
+        self.tool.biarch_packages = set()
+
+    def written(self):
+        return sorted(path.split('/')[3] for path, _ in self.server.puts)
+
+    def test_add_explicit_disable(self):
+        self.tool.select_packages(['bash', 'zsh', 'glibc', 'tcsh'])
+        self.tool.add_explicit_disable(wipebinaries=True)
+        self.assertEqual(self.written(), ['bash', 'zsh'])
+        self.assertEqual(len(self.server.posts), 2)
+        for path, data in self.server.puts:
+            self.assertIsNotNone(ET.fromstring(data).find('build/disable[@arch="i586"]'))
+
+        # the outdated search result must not cause the same writes again
+        self.tool.add_explicit_disable(wipebinaries=True)
+        self.assertEqual(self.written(), ['bash', 'zsh'])
+
+    def test_enable_baselibs_packages(self):
+        self.tool.select_packages(['bash', 'glibc', 'tcsh'])
+        self.tool.enable_baselibs_packages(force=True)
+        # bash is enabled, glibc loses the explicit enable and tcsh the disable
+        self.assertEqual(self.written(), ['glibc', 'tcsh'])
+
+    def test_dryrun(self):
+        self.tool.dryrun = True
+        self.tool.select_packages(['bash', 'zsh'])
+        with self.assertLogs(level='INFO') as logs:
+            self.tool.add_explicit_disable()
+        self.assertEqual(self.server.puts, [])
+        self.assertIn('+  <build>', '\n'.join(logs.output))
+        self.assertIn('would change 2 package metas', logs.output[-1])
+
+    def filelist_requests(self):
+        return [(path.split('/')[3], query.get('rev', [None])[0])
+                for path, query in self.server.gets if path.startswith(f'/source/{PROJECT}/')]
+
+    def test_get_filelist(self):
+        bash, expanded, link = (self.server.srcmd5s[key] for key in ('bash', 'expanded', 'link'))
+        self.assertEqual(self.tool.get_filelist(PROJECT, 'bash'), ['bash.spec', bash])
+        self.assertEqual(self.tool.get_filelist(PROJECT, 'bash-completion'), ['bash-completion.spec', link])
+        self.assertEqual(self.tool.get_filelist(PROJECT, 'bash-completion', expand=True),
+                         ['bash-completion.spec', expanded])
+        # packages without a srcmd5 are listed directly
+        self.assertEqual(self.tool.get_filelist(PROJECT, 'broken'), ['broken.spec', 'latest'])
+        self.assertEqual(len([query for _, query in self.server.gets if query.get('view') == ['info']]), 1)
+
+        # the next run loads the source info again, unchanged sources are not listed again
+        self.server.gets = []
+        self.server.srcmd5s['bash'] = 'd' * 32
+        tool = BiArchTool(PROJECT)
+        for package in ('bash', 'bash-completion', 'broken'):
+            tool.get_filelist(PROJECT, package)
+        self.assertEqual(self.server.gets[0], (f'/source/{PROJECT}', {'view': ['info'], 'nofilename': ['1']}))
+        self.assertEqual(self.filelist_requests(), [('bash', 'd' * 32), ('broken', None)])
+        self.assertEqual(tool.get_filelist(PROJECT, 'bash'), ['bash.spec', 'd' * 32])
+
+
+if __name__ == '__main__':
+    unittest.main()
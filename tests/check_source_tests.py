@@ -1,9 +1,16 @@
+import hashlib
 import logging
+from . import LocalServer
 from . import OBSLocal
 from check_source import CheckSource
+from check_source import SourceFiles
 import os
 from osc.core import get_request_list
 import pytest
+import threading
+import time
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 PROJECT = 'Testing:Project'
 SRC_PROJECT = 'devel:Fishing'
@@ -426,3 +433,157 @@ class TestCheckSource(OBSLocal.TestCase):
         fixtures_path = os.path.join(FIXTURES, 'packages', target_files)
         self.target_package = OBSLocal.Package('blowfish', self.wf.projects[PROJECT], devel_project=SRC_PROJECT)
         self.target_package.commit_files(fixtures_path)
+
+
+class SourceServer(LocalServer.LocalServer):
+    """Serve package sources from a dict of package -> file name -> content."""
+
+    def __init__(self, packages):
+        super().__init__(SourceHandler)
+        self.packages = packages
+        self.downloads = []
+
+
+class SourceHandler(LocalServer.Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.split('/')[2:]
+        files = self.server.packages.get(path[1])
+        if files is None:
+            self.send_error(404)
+            return
+        if len(path) == 2:
+            entries = ''.join(f'<entry name="{name}" md5="{hashlib.md5(content).hexdigest()}" size="{len(content)}"/>'
+                              for name, content in files.items())
+            data = f'<directory name="{path[1]}" srcmd5="{"0" * 32}">{entries}</directory>'.encode('utf-8')
+        else:
+            self.server.downloads.append(path[2])
+            self.assert_revision(parse_qs(url.query))
+            data = files[path[2]]
+        self.reply(data)
+
+    def assert_revision(self, query):
+        assert query['rev'] == ['0' * 32]
+
+
+class TestSourceFiles(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tarball = os.urandom(100)
+        self.serve(SourceServer({
+            'blowfish': {'blowfish.spec': b'Name: blowfish', 'blowfish.changes': b'- old', 'blowfish-1.tar.xz': tarball},
+            'blowfish.1': {'blowfish.spec': b'Name: blowfish', 'blowfish.changes': b'- new', 'blowfish-1.tar.xz': tarball},
+        }))
+
+    def test_checkout(self):
+        store = os.path.join(self.dir, 'store')
+        sources = SourceFiles(self.url, store)
+        old = os.path.join(self.dir, '_old')
+        new = os.path.join(self.dir, 'blowfish')
+        sources.checkout(PROJECT, 'blowfish', old)
+        sources.checkout(SRC_PROJECT, 'blowfish.1', new, revision='1')
+
+        # the spec file is the same, the tarball not fetched yet
+        self.assertEqual(sorted(self.server.downloads), ['blowfish.changes', 'blowfish.changes', 'blowfish.spec'])
+        self.assertEqual(os.path.getsize(os.path.join(new, 'blowfish-1.tar.xz')), 0)
+
+        sources.complete()
+        self.assertEqual(self.server.downloads.count('blowfish-1.tar.xz'), 1)
+        for directory in (old, new):
+            with open(os.path.join(directory, 'blowfish-1.tar.xz'), 'rb') as f:
+                self.assertEqual(f.read(), self.server.packages['blowfish']['blowfish-1.tar.xz'])
+        with open(os.path.join(new, 'blowfish.changes'), 'rb') as f:
+            self.assertEqual(f.read(), b'- new')
+
+        # another review of the same sources downloads nothing
+        downloads = len(self.server.downloads)
+        sources = SourceFiles(self.url, store)
+        sources.checkout(SRC_PROJECT, 'blowfish.1', os.path.join(self.dir, 'again'))
+        sources.complete()
+        self.assertEqual(len(self.server.downloads), downloads)
+
+    def test_large_changes(self):
+        # large changes and spec files are needed by the checks before complete()
+        changes = b'- entry\n' * (256 * 1024)
+        spec = b'# Copyright (c) 2024 SUSE LLC\n# License: GPL-2.0-only\nName: kernel-source\n' + \
+            b'%define dummy 1\n' * (128 * 1024) + b'\n%changelog\n'
+        tarball = os.urandom(100)
+        self.server.packages['kernel-source'] = {
+            'kernel-source.changes': changes, 'kernel-source.spec': spec, 'linux-6.10.tar.xz': tarball}
+        self.server.packages['kernel-source.1'] = {
+            'kernel-source.changes': b'- new entry\n' + changes, 'kernel-source.spec': spec,
+            'linux-6.10.tar.xz': tarball}
+        self.assertGreater(len(changes), 1024 * 1024)
+        self.assertGreater(len(spec), 1024 * 1024)
+
+        old = os.path.join(self.dir, '_old')
+        new = os.path.join(self.dir, 'kernel-source')
+        sources = SourceFiles(self.url, os.path.join(self.dir, 'store'))
+        sources.checkout(PROJECT, 'kernel-source', old)
+        sources.checkout(SRC_PROJECT, 'kernel-source.1', new, revision='1')
+        with open(os.path.join(old, 'kernel-source.changes'), 'rb') as f:
+            self.assertEqual(f.read(), changes)
+        self.assertEqual(os.path.getsize(os.path.join(new, 'kernel-source.spec')), len(spec))
+        self.assertEqual(os.path.getsize(os.path.join(new, 'linux-6.10.tar.xz')), 0)
+
+        bot = CheckSource(apiurl=self.url, logger=logging.getLogger(__name__))
+        bot.review_messages = {}
+        self.assertTrue(bot.check_spec_policy(old, new, ['kernel-source.spec']), bot.review_messages)
+
+
+class TestSourceValidators(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.validators = os.path.join(self.dir, 'source_validators')
+        os.mkdir(self.validators)
+        patcher = mock.patch('check_source.SOURCE_VALIDATORS_DIR', self.validators)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bot = CheckSource(apiurl='http://localhost', logger=logging.getLogger(__name__))
+        self.bot.review_messages = {}
+
+    def validator(self, name, seconds, status=0, output=''):
+        script = os.path.join(self.validators, name)
+        with open(script, 'w') as f:
+            f.write(f'#!/bin/sh\nsleep {seconds}\necho "{output}"\nexit {status}\n')
+        os.chmod(script, 0o755)
+
+    def test_concurrent(self):
+        for name in ('10-a', '20-b', '30-c'):
+            self.validator(name, 0.5)
+        start = time.monotonic()
+        with self.assertLogs(level='INFO') as logs:
+            self.assertTrue(self.bot.run_source_validator('_old', 'blowfish'))
+        self.assertLess(time.monotonic() - start, 1.4)
+        self.assertEqual(len([line for line in logs.output if ' took ' in line]), 3)
+
+    def test_deterministic_message(self):
+        # the first script in order decides, even when the second fails sooner
+        self.validator('10-slow', 0.5, status=1, output='slow failure')
+        self.validator('20-fast', 0, output='(W) Attention, blowfish.patch is not mentioned')
+        self.assertFalse(self.bot.run_source_validator('_old', 'blowfish'))
+        self.assertIn('slow failure', self.bot.review_messages['declined'])
+
+        os.remove(os.path.join(self.validators, '10-slow'))
+        self.assertFalse(self.bot.run_source_validator('_old', 'blowfish'))
+        self.assertEqual(self.bot.review_messages['declined'], 'Attention, blowfish.patch is not mentioned')
+
+    def test_timeout(self):
+        self.validator('10-hang', 5)
+        with mock.patch('check_source.VALIDATOR_TIMEOUT', 0.2):
+            with self.assertRaisesRegex(RuntimeError, '10-hang timed out'):
+                self.bot.run_source_validator('_old', 'blowfish')
+
+    def test_cancel(self):
+        # download_files and its children are killed once the request is declined
+        script = os.path.join(self.dir, 'download_files')
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\necho started\nsleep 30 &\nsleep 30\n')
+        os.chmod(script, 0o755)
+        cancel = threading.Event()
+        threading.Timer(0.3, cancel.set).start()
+        start = time.monotonic()
+        self.assertEqual(self.bot.run_command('download_files', [script], cancel=cancel), (None, 'started\n'))
+        self.assertLess(time.monotonic() - start, 5)
@@ -0,0 +1,182 @@
+import io
+import os
+import random
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from lxml import etree as ET
+
+from osclib.cleanup_rings import CleanupRings
+from osclib.cleanup_rings import requiredby_binaries
+from osclib.cleanup_rings import requiredby_parse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'cleanup_rings')
+
+BUILDDEPINFO = """
+<builddepinfo>
+  <package name="bash">
+    <source>bash</source>
+    <pkgdep>glibc</pkgdep>
+    <pkgdep>ncurses</pkgdep>
+  </package>
+  <package name="glibc">
+    <source>glibc</source>
+  </package>
+  <package name="glibc:i686">
+    <source>glibc</source>
+    <pkgdep>glibc</pkgdep>
+  </package>
+  <package name="ncurses">
+    <source>ncurses</source>
+    <pkgdep>glibc</pkgdep>
+  </package>
+</builddepinfo>
+"""
+
+
+class TestCleanupRings(unittest.TestCase):
+
+    def test_depinfo_graph(self):
+        graph = CleanupRings.depinfo_graph(ET.fromstring(BUILDDEPINFO))
+        self.assertEqual(graph, {
+            'bash': ['glibc', 'ncurses'],
+            'glibc': [],
+            'glibc:i686': ['glibc'],
+            'ncurses': ['glibc'],
+        })
+
+    def test_flavor_index(self):
+        flavors = CleanupRings.flavor_index({'glibc', 'glibc:i686', 'glibc:utils', 'meson:test', 'bash'})
+        self.assertEqual(sorted(flavors['glibc']), ['glibc:i686', 'glibc:utils'])
+        self.assertEqual(flavors['meson'], ['meson:test'])
+        self.assertNotIn('bash', flavors)
+
+    def test_link_index(self):
+        linked = CleanupRings.link_index({'glibc.i686': 'glibc', 'python3-base': 'python3'})
+        self.assertEqual(linked['glibc'], {'glibc.i686'})
+        self.assertEqual(linked['glibc.i686'], {'glibc'})
+        self.assertEqual(linked['python3'], {'python3-base'})
+
+    def test_repository_binaries(self):
+        root = ET.parse(os.path.join(FIXTURES, 'binaryversions.xml')).getroot()
+        state, binaries = CleanupRings.repository_binaries_parse(root)
+        self.assertEqual(binaries, {
+            'libxcrypt': ['libcrypt1-4.4.36-1.3.x86_64.rpm', 'libxcrypt-devel-4.4.36-1.3.x86_64.rpm'],
+            'pam': ['pam-1.6.1-1.2.x86_64.rpm'],
+        })
+
+        # a rebuild of any package changes the state
+        root.find('binaryversionlist[@package="pam"]/binary').set('hdrmd5', '0' * 32)
+        self.assertNotEqual(CleanupRings.repository_binaries_parse(root)[0], state)
+
+    def test_requiredby_parse(self):
+        fileinfos = [ET.parse(os.path.join(FIXTURES, f'{name}.fileinfo_ext.xml')).getroot()
+                     for name in ('libcrypt1', 'libxcrypt-devel')]
+        self.assertEqual(requiredby_parse(fileinfos), {'pam', 'pam-devel', 'shadow'})
+
+    def test_requiredby_binaries(self):
+        fileinfo = ET.parse(os.path.join(FIXTURES, 'libcrypt1.fileinfo_ext.xml')).getroot()
+        # a new state each run, the persistent cache must not answer the first call
+        state = os.urandom(16).hex()
+        args = ('http://localhost', 'openSUSE:Factory', 'standard', 'x86_64', state, 'libxcrypt')
+        with mock.patch('osclib.cleanup_rings.fileinfo_ext', return_value=fileinfo) as fileinfo_ext:
+            for _ in range(2):
+                self.assertEqual(requiredby_binaries(*args, ['libcrypt1-4.4.36-1.3.x86_64.rpm']), {'pam', 'shadow'})
+            self.assertEqual(fileinfo_ext.call_count, 1)
+
+            # rebuilt binaries change the state
+            requiredby_binaries(*args[:4], os.urandom(16).hex(), 'libxcrypt', ['libcrypt1-4.4.36-1.3.x86_64.rpm'])
+            self.assertEqual(fileinfo_ext.call_count, 2)
+
+
+def closure_xpath(root, needed, sources, links):
+    """The build dependency closure as walked before the graph was indexed,
+    with an xpath query per package and scans of all sources and links."""
+    pkgdeps = dict.fromkeys(needed, 'root')
+    to_visit = set(pkgdeps)
+    while to_visit:
+        new_deps = {}
+        for pkg in to_visit:
+            mainpkg = pkg.split(':')[0]
+            for src in sources:
+                if src.startswith(f'{mainpkg}:'):
+                    new_deps[src] = pkg
+            for ldst, lsrc in links.items():
+                if lsrc == mainpkg:
+                    new_deps[ldst] = pkg
+                elif ldst == mainpkg:
+                    new_deps[lsrc] = pkg
+            for dep in root.xpath(f"package[@name='{pkg}']/pkgdep"):
+                new_deps[dep.text] = pkg
+        to_visit = set(new_deps).difference(pkgdeps)
+        pkgdeps.update(new_deps)
+    return set(pkgdeps)
+
+
+@unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK=1 to run benchmarks')
+class BenchmarkCleanupRings(unittest.TestCase):
+    """Build dependency closure of check_depinfo_ring for a large synthetic
+    ring 1, compared to the previous walk of the _builddepinfo."""
+
+    PACKAGES = 5000
+    DEPS = 8
+    NEEDED = 20
+
+    def setUp(self):
+        rng = random.Random(0)
+        names = [f'pkg{i}' for i in range(self.PACKAGES)]
+        # packages only depend on later ones, so part of the ring is unneeded
+        root = ET.Element('builddepinfo')
+        for i, name in enumerate(names):
+            package = ET.SubElement(root, 'package', name=name)
+            for dep in rng.sample(names[i + 1:], min(self.DEPS, len(names) - i - 1)):
+                ET.SubElement(package, 'pkgdep').text = dep
+        for i in range(0, self.PACKAGES, 50):
+            ET.SubElement(root, 'package', name=f'pkg{i}:flavor')
+        self.builddepinfo = ET.tostring(root)
+        self.sources = {package.get('name') for package in root.findall('package')}
+        self.links = {f'pkg{i}': f'pkg{i + 1}' for i in range(0, self.PACKAGES, 100)}
+        self.needed = [names[i * (self.PACKAGES // 2) // self.NEEDED + self.PACKAGES // 3] for i in range(self.NEEDED)]
+
+    def cleanup(self):
+        api = SimpleNamespace(apiurl='http://localhost', project='openSUSE:Factory', crings='openSUSE:Factory:Rings',
+                              rings=['openSUSE:Factory:Rings:0-Bootstrap', 'openSUSE:Factory:Rings:1-MinimalX'],
+                              cstaging_archs=['x86_64'])
+        cleanup = CleanupRings(api)
+
+        def fill_pkginfo(prj, repo, arch):
+            cleanup.sources = set(self.sources)
+
+        def find_inner_ring_links(prj):
+            cleanup.links = dict(self.links)
+
+        def check_image_bdeps(prj, arch):
+            cleanup.pkgdeps.update(dict.fromkeys(self.needed, 'image'))
+
+        for name, method in (('repo_state_acceptable', lambda prj: True), ('fill_pkginfo', fill_pkginfo),
+                             ('find_inner_ring_links', find_inner_ring_links),
+                             ('check_image_bdeps', check_image_bdeps),
+                             ('package_get_requiredby', lambda *args: set())):
+            setattr(cleanup, name, method)
+        return cleanup
+
+    def test_closure(self):
+        cleanup = self.cleanup()
+        start = time.perf_counter()
+        with mock.patch('osclib.cleanup_rings.http_GET', side_effect=lambda url: io.BytesIO(self.builddepinfo)):
+            cleanup.check_depinfo_ring(cleanup.api.rings[1], None)
+        duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = closure_xpath(ET.fromstring(self.builddepinfo), self.needed, self.sources, self.links)
+        duration_xpath = time.perf_counter() - start
+
+        self.assertEqual(set(cleanup.pkgdeps), expected)
+        print(f'\nclosure of {len(expected)} of {len(self.sources)} packages: '
+              f'indexed {duration:.3f}s, xpath per package {duration_xpath:.3f}s')
+
+
+if __name__ == '__main__':
+    unittest.main()
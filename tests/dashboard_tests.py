@@ -0,0 +1,115 @@
+import argparse
+import os
+import sys
+import unittest
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from . import LocalServer
+
+OpenQA_Client = pytest.importorskip('openqa_client.client').OpenQA_Client
+pytest.importorskip('flask')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dashboard'))
+
+import generate  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'dashboard')
+
+
+class FixtureServer(LocalServer.LocalServer):
+    """Serve the recorded response named like the last path component."""
+
+    def __init__(self):
+        super().__init__(FixtureHandler)
+        self.paths = []
+        self.repositories = []
+        # repositories without results
+        self.missing = set()
+
+
+class FixtureHandler(LocalServer.Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        repository = parse_qs(url.query).get('repository', [None])[0]
+        with self.server.lock:
+            self.server.paths.append(path)
+            if repository:
+                self.server.repositories.append(repository)
+        name = path.rstrip('/').split('/')[-1].split(':')[-1]
+        fixture = os.path.join(FIXTURES, name)
+        if not os.path.exists(fixture) or repository in self.server.missing:
+            self.send_error(404)
+            return
+        with open(fixture, 'rb') as f:
+            self.reply(f.read())
+
+
+class TestDashboard(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(FixtureServer())
+
+    def fetch(self, projects=(('openSUSE:Factory', 'Factory', 1), ('openSUSE:Factory:ARM', 'ARM', 3))):
+        opts = argparse.Namespace(workers=4, host_workers=2, cache_dir=os.path.join(self.dir, 'cache'),
+                                  no_cache=False)
+        os.makedirs(opts.cache_dir, exist_ok=True)
+        fetcher = generate.Fetcher(self.url, opts)
+        fetcher.openqa_url = self.url
+        fetcher.openqa = OpenQA_Client(server=f'127.0.0.1:{self.server.server_port}', scheme='http')
+        for name, nick, groupid in projects:
+            fetcher.add(name, nick=nick, openqa_groupid=groupid)
+        fetcher.fetch_all()
+        return fetcher
+
+    def test_fetch_all(self):
+        fetcher = self.fetch()
+        for project in fetcher.projects:
+            self.assertEqual(set(project.all_archs.split('&')), {'arch_x86_64=1', 'arch_i586=1'})
+            self.assertEqual(project.ttm_status, {'testing': '20241017', 'published': '20241016'})
+            self.assertEqual(project.ttm_version, '20241018')
+            self.assertEqual(project.build_summary('standard'),
+                             {'building': 9959, 'failed': 10, 'broken': 2, 'unresolvable': 0})
+            self.assertEqual(project.openqa_summary(), {
+                'passed': ['opensuse-Tumbleweed-DVD-x86_64-Build20241017-textmode'],
+                'failed': ['opensuse-Tumbleweed-DVD-x86_64-Build20241017-gnome'],
+                'running': ['opensuse-Tumbleweed-DVD-x86_64-Build20241017-xfce'],
+            })
+            self.assertIn((project.name, 'build_summary'), fetcher.timings)
+        # meta, two attributes, jobs and one _result per repository
+        self.assertEqual(len(self.server.paths), 2 * (4 + len(generate.REPOSITORIES)))
+        self.assertEqual(sorted(set(self.server.repositories)), sorted(generate.REPOSITORIES))
+
+    def test_leap_repositories(self):
+        fetcher = self.fetch(projects=(('openSUSE:Leap:15.6', 'Leap:15.6', 50),))
+        # only the repositories of the Leap layout are fetched, all of them ahead
+        self.assertEqual(sorted(self.server.repositories), sorted(generate.LEAP_REPOSITORIES))
+        for repo in generate.LEAP_REPOSITORIES:
+            fetcher.projects[0].build_summary(repo)
+        self.assertEqual(len(self.server.repositories), len(generate.LEAP_REPOSITORIES))
+
+    def test_cache(self):
+        self.fetch()
+        requests = len(self.server.paths)
+        fetcher = self.fetch()
+        self.assertEqual(len(self.server.paths), requests)
+        self.assertEqual(fetcher.projects[0].ttm_version, '20241018')
+
+    def test_cache_unknown(self):
+        self.server.missing.add('images')
+        fetcher = self.fetch()
+        self.assertEqual(fetcher.projects[0].build_summary('images'), {'building': -1})
+
+        # missing results are fetched again on the next run
+        self.server.missing.clear()
+        self.server.repositories = []
+        fetcher = self.fetch()
+        self.assertEqual(self.server.repositories, ['images', 'images'])
+        self.assertEqual(fetcher.projects[0].build_summary('images')['building'], 9959)
+
+
+if __name__ == '__main__':
+    unittest.main()
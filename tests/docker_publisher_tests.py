@@ -0,0 +1,98 @@
+import functools
+import hashlib
+import os
+import tarfile
+import tempfile
+import tracemalloc
+import unittest
+from http.server import SimpleHTTPRequestHandler
+
+from docker_publisher import DockerFetchException, DockerImageFetcherURL
+
+from . import LocalServer
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    requests = []
+
+    def log_message(self, format, *args):
+        QuietHandler.requests.append(self.path)
+
+
+class TestDockerImageFetcherURL(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.serve_dir = os.path.join(self.tmpdir.name, 'serve')
+        self.cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        os.mkdir(self.serve_dir)
+        os.mkdir(self.cache_dir)
+
+        # A large, incompressible layer in an image tarball.
+        layer = os.path.join(self.tmpdir.name, 'layer.tar')
+        with open(layer, 'wb') as f:
+            for _ in range(32):
+                f.write(os.urandom(1024 * 1024))
+        self.tar = os.path.join(self.serve_dir, 'image.tar')
+        with tarfile.open(self.tar, 'w') as tar:
+            tar.add(layer, arcname='layer.tar')
+        with open(self.tar, 'rb') as f:
+            self.sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        QuietHandler.requests = []
+        handler = functools.partial(QuietHandler, directory=self.serve_dir)
+        self.server = LocalServer.LocalServer(handler).start()
+        self.url = self.server.url + '/image.tar'
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def write_sha256(self, sha256):
+        with open(self.tar + '.sha256', 'w') as f:
+            f.write(f'{sha256}  image.tar\n')
+
+    def test_streamed_download(self):
+        self.write_sha256(self.sha256)
+        fetcher = DockerImageFetcherURL('1.0', self.url, cache_dir=self.cache_dir)
+
+        tracemalloc.start()
+        size = fetcher.getDockerImage(lambda path: os.path.getsize(os.path.join(path, 'layer.tar')))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.assertEqual(32 * 1024 * 1024, size)
+        # Memory stays bounded by the chunk size rather than the image size.
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+        # The same release is served from the cache.
+        QuietHandler.requests = []
+        fetcher.getDockerImage(lambda path: None)
+        self.assertNotIn('/image.tar', QuietHandler.requests)
+
+    def test_checksum_mismatch(self):
+        self.write_sha256('0' * 64)
+        fetcher = DockerImageFetcherURL('1.0', self.url, cache_dir=self.cache_dir)
+
+        with self.assertRaises(DockerFetchException):
+            fetcher.getDockerImage(lambda path: None)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_cache_by_digest(self):
+        self.write_sha256(self.sha256)
+        DockerImageFetcherURL('1.0', self.url, cache_dir=self.cache_dir).getDockerImage(lambda path: None)
+        self.assertEqual([f'sha256-{self.sha256}'], os.listdir(self.cache_dir))
+
+        # Another version with the same content uses the cached file.
+        QuietHandler.requests = []
+        DockerImageFetcherURL('1.1', self.url, cache_dir=self.cache_dir).getDockerImage(lambda path: None)
+        self.assertNotIn('/image.tar', QuietHandler.requests)
+
+    def test_corrupted_cache(self):
+        self.write_sha256(self.sha256)
+        with open(os.path.join(self.cache_dir, f'sha256-{self.sha256}'), 'wb') as f:
+            f.write(b'truncated')
+
+        fetcher = DockerImageFetcherURL('1.0', self.url, cache_dir=self.cache_dir)
+        size = fetcher.getDockerImage(lambda path: os.path.getsize(os.path.join(path, 'layer.tar')))
+        self.assertIn('/image.tar', QuietHandler.requests)
+        self.assertEqual(32 * 1024 * 1024, size)
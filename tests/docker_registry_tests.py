@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from docker_publisher import DockerImagePublisherRegistry, DockerPublishException
+from docker_registry import DockerRegistryClient
+
+from . import LocalServer
+
+
+class FakeRegistry(object):
+    """Minimal in-process registry implementing the chunked blob upload flow"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.manifests = {}
+        self.uploads = {}
+        self.upload_count = 0
+        # Digests of the blobs stored by completed uploads, in order.
+        self.uploaded = []
+        self.patches = 0
+        self.heads = 0
+        self.mounts = 0
+        # Number of PATCH requests to accept but answer with an error.
+        self.fail_patches = 0
+        # Digests of blobs whose upload is rejected when completed.
+        self.fail_blobs = set()
+        # Seconds to wait before answering, like a remote registry.
+        self.delay = 0
+        # Require a bearer token, which is only valid once any was issued.
+        self.token = None
+        self.token_requests = 0
+        registry = self
+
+        class Handler(LocalServer.Handler):
+            def reply(self, code, headers={}):
+                super().reply(status=code, headers=headers)
+
+            def parse_request(self):
+                if not super().parse_request():
+                    return False
+                time.sleep(registry.delay)
+                if self.path.startswith('/token'):
+                    with registry.server.lock:
+                        registry.token_requests += 1
+                        registry.token = f'token{registry.token_requests}'
+                    time.sleep(0.1)
+                    super().reply(f'{{"token": "{registry.token}"}}')
+                    return False
+                if registry.token is not None and \
+                        self.headers.get('Authorization') != f'Bearer {registry.token}':
+                    self.reply(401, {'Www-Authenticate':
+                                     f'Bearer realm="{registry.url}/token",service="registry"'})
+                    return False
+                return True
+
+            def repository(self):
+                return self.path[len('/v2/'):].split('/blobs/')[0].split('/manifests/')[0]
+
+            def manifest(self):
+                if '/manifests/' not in self.path:
+                    return None
+                return (self.repository(), self.path.split('/manifests/')[1])
+
+            def upload_id(self):
+                return self.path.split('/uploads/')[1].split('?')[0]
+
+            def upload_headers(self, upload_id):
+                size = len(registry.uploads[upload_id][1])
+                return {'Location': f'/v2/{self.repository()}/blobs/uploads/{upload_id}?state=x',
+                        'Range': f'0-{max(size - 1, 0)}'}
+
+            def do_HEAD(self):
+                registry.heads += 1
+                digest = self.path.split('/blobs/')[1]
+                self.reply(200 if (self.repository(), digest) in registry.blobs else 404)
+
+            def do_POST(self):
+                query = parse_qs(urlparse(self.path).query)
+                if 'mount' in query:
+                    source = (query['from'][0], query['mount'][0])
+                    if source in registry.blobs:
+                        registry.mounts += 1
+                        registry.blobs[(self.repository(), source[1])] = registry.blobs[source]
+                        self.reply(201)
+                        return
+                with registry.server.lock:
+                    upload_id = str(registry.upload_count)
+                    registry.upload_count += 1
+                    registry.uploads[upload_id] = (self.repository(), b'')
+                self.reply(202, self.upload_headers(upload_id))
+
+            def do_DELETE(self):
+                del registry.uploads[self.upload_id()]
+                self.reply(204)
+
+            def do_GET(self):
+                manifest = self.manifest()
+                if manifest:
+                    if manifest not in registry.manifests:
+                        self.reply(404)
+                        return
+                    super(Handler, self).reply(registry.manifests[manifest])
+                    return
+                upload_id = self.upload_id()
+                self.reply(204, self.upload_headers(upload_id))
+
+            def do_PATCH(self):
+                upload_id = self.upload_id()
+                start, end = [int(x) for x in self.headers['Content-Range'].split('-')]
+                data = self.rfile.read(int(self.headers['Content-Length']))
+                repository, uploaded = registry.uploads[upload_id]
+                if start != len(uploaded) or end - start + 1 != len(data):
+                    self.reply(416)
+                    return
+                registry.uploads[upload_id] = (repository, uploaded + data)
+                registry.patches += 1
+                if registry.fail_patches:
+                    registry.fail_patches -= 1
+                    self.reply(500)
+                    return
+                self.reply(202, self.upload_headers(upload_id))
+
+            def do_PUT(self):
+                manifest = self.manifest()
+                if manifest:
+                    registry.manifests[manifest] = self.rfile.read(int(self.headers['Content-Length']))
+                    self.reply(201)
+                    return
+                upload_id = self.upload_id()
+                digest = self.path.split('digest=')[1].replace('%3A', ':')
+                repository, data = registry.uploads.pop(upload_id)
+                if 'sha256:' + hashlib.sha256(data).hexdigest() != digest or digest in registry.fail_blobs:
+                    self.reply(400)
+                    return
+                with registry.server.lock:
+                    registry.blobs[(repository, digest)] = data
+                    registry.uploaded.append(digest)
+                self.reply(201)
+
+        self.server = LocalServer.LocalServer(Handler).start()
+        self.url = self.server.url
+
+    def stop(self):
+        self.server.stop()
+
+
+class TestDockerRegistryClient(unittest.TestCase):
+    def setUp(self):
+        DockerRegistryClient.known_blobs = {}
+        self.registry = FakeRegistry()
+        self.client = DockerRegistryClient(self.registry.url, 'user', 'password', 'test', chunk_size=1000)
+        self.blob = tempfile.NamedTemporaryFile(delete=False)
+        self.content = os.urandom(4500)
+        self.blob.write(self.content)
+        self.blob.close()
+        self.digest = 'sha256:' + hashlib.sha256(self.content).hexdigest()
+
+    def tearDown(self):
+        self.registry.stop()
+        os.unlink(self.blob.name)
+
+    def test_chunked_upload(self):
+        self.assertTrue(self.client.uploadBlob(self.blob.name, self.digest))
+        self.assertEqual(self.content, self.registry.blobs[('test', self.digest)])
+        self.assertEqual(5, self.registry.patches)
+
+        # Blobs pushed in this run are neither uploaded nor looked up again.
+        self.assertTrue(self.client.uploadBlob(self.blob.name, self.digest))
+        self.assertEqual(5, self.registry.patches)
+        self.assertEqual(1, self.registry.heads)
+
+    def test_existing_blob(self):
+        self.registry.blobs[('test', self.digest)] = self.content
+        self.assertTrue(self.client.uploadBlob(self.blob.name, self.digest))
+        self.assertEqual(0, self.registry.patches)
+
+    def test_mount_blob(self):
+        self.assertTrue(self.client.uploadBlob(self.blob.name, self.digest))
+
+        other = DockerRegistryClient(self.registry.url, 'user', 'password', 'other', chunk_size=1000)
+        self.assertTrue(other.uploadBlob(self.blob.name, self.digest))
+        self.assertEqual(self.content, self.registry.blobs[('other', self.digest)])
+        self.assertEqual(1, self.registry.mounts)
+        self.assertEqual(5, self.registry.patches)
+
+    def test_resume_upload(self):
+        # The registry stores the chunks but the responses get lost.
+        self.registry.fail_patches = 2
+        self.assertTrue(self.client.uploadBlob(self.blob.name, self.digest))
+        self.assertEqual(self.content, self.registry.blobs[('test', self.digest)])
+        # Resumed from the offset reported by the registry, nothing sent twice.
+        self.assertEqual(5, self.registry.patches)
+
+    def test_concurrent_token_update(self):
+        self.registry.token = 'expired'
+        blobs = {}
+        for i in range(4):
+            content = os.urandom(1500)
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                f.write(content)
+            self.addCleanup(os.unlink, f.name)
+            blobs[f.name] = 'sha256:' + hashlib.sha256(content).hexdigest()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertTrue(all(executor.map(self.client.uploadBlob, blobs.keys(), blobs.values())))
+        # One thread got a new token, the others retried with it.
+        self.assertEqual(1, self.registry.token_requests)
+        self.assertEqual('token1', self.client.token)
+
+    def test_digest_mismatch(self):
+        with self.assertRaises(Exception):
+            self.client.uploadBlob(self.blob.name, 'sha256:' + '0' * 64)
+
+
+def image_dir(directory, layers):
+    """Write an unpacked docker image with the given layer contents, the
+    files are named like the digest of their content."""
+    def blob(content):
+        filename = hashlib.sha256(content).hexdigest() + '.tar'
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(content)
+        return filename
+
+    manifest = [{'Config': blob(b'{"architecture": "amd64"}'), 'Layers': [blob(layer) for layer in layers]}]
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    return ['sha256:' + os.path.splitext(fn)[0] for fn in [manifest[0]['Config']] + manifest[0]['Layers']]
+
+
+class TestDockerImagePublisherRegistry(unittest.TestCase):
+    def setUp(self):
+        DockerRegistryClient.known_blobs = {}
+        self.registry = FakeRegistry()
+        self.addCleanup(self.registry.stop)
+        self.client = DockerRegistryClient(self.registry.url, 'user', 'password', 'test', chunk_size=1000)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        # The base layer is shared by two layers of the image.
+        base = os.urandom(2500)
+        self.digests = image_dir(self.tmpdir.name, [base, os.urandom(3000), base, os.urandom(10)])
+
+    def publisher(self):
+        publisher = DockerImagePublisherRegistry(self.client, 'latest')
+        publisher.prepareReleasing()
+        return publisher
+
+    def test_add_image(self):
+        publisher = self.publisher()
+        self.assertTrue(publisher.addImage('20261019', 'x86_64', self.tmpdir.name))
+
+        # Every blob is uploaded once, the shared layer included.
+        self.assertEqual(Counter(self.registry.uploaded), Counter(set(self.digests)))
+        manifest, = publisher.new_manifestlist['manifests']
+        self.assertEqual(manifest['vnd-opensuse-version'], '20261019')
+        self.assertEqual(manifest['platform'], {'architecture': 'amd64', 'os': 'linux'})
+        content = self.registry.manifests[('test', manifest['digest'])]
+        self.assertEqual([layer['digest'] for layer in json.loads(content)['layers']], self.digests[:0:-1])
+
+        # Published again, nothing is uploaded.
+        self.assertTrue(self.publisher().addImage('20261019', 'aarch64', self.tmpdir.name))
+        self.assertEqual(len(self.registry.uploaded), 4)
+
+    def test_failed_layer(self):
+        self.registry.fail_blobs.add(self.digests[2])
+        publisher = self.publisher()
+        with self.assertRaises(DockerPublishException):
+            publisher.addImage('20261019', 'x86_64', self.tmpdir.name)
+        self.assertNotIn(('test', self.digests[2]), self.registry.blobs)
+        self.assertEqual(publisher.new_manifestlist['manifests'], [])
+        self.assertEqual(self.registry.manifests, {})
+
+
+@unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK=1 to run benchmarks')
+class BenchmarkAddImage(unittest.TestCase):
+    """Latency of publishing an image with several layers to a registry
+    answering with a delay, with and without concurrent blob uploads."""
+
+    LAYERS = 8
+    LAYER_SIZE = 4 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+    DELAY = 0.02
+
+    def setUp(self):
+        self.registry = FakeRegistry()
+        self.registry.delay = self.DELAY
+        self.addCleanup(self.registry.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        image_dir(self.tmpdir.name, [os.urandom(self.LAYER_SIZE) for _ in range(self.LAYERS)])
+
+    def add_image(self, repository, upload_workers):
+        DockerRegistryClient.known_blobs = {}
+        client = DockerRegistryClient(self.registry.url, 'user', 'password', repository, chunk_size=self.CHUNK_SIZE)
+        publisher = DockerImagePublisherRegistry(client, 'latest', upload_workers=upload_workers)
+        publisher.prepareReleasing()
+        start = time.perf_counter()
+        self.assertTrue(publisher.addImage('1', 'x86_64', self.tmpdir.name))
+        return time.perf_counter() - start
+
+    def test_add_image(self):
+        sequential = self.add_image('sequential', 1)
+        concurrent = self.add_image('concurrent', DockerImagePublisherRegistry.UPLOAD_WORKERS)
+        print(f'\naddImage of {self.LAYERS} layers of {self.LAYER_SIZE} bytes: '
+              f'1 worker {sequential:.3f}s, {DockerImagePublisherRegistry.UPLOAD_WORKERS} workers {concurrent:.3f}s')
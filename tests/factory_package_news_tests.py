@@ -0,0 +1,239 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'factory-package-news'))
+
+import package_news  # noqa: E402
+
+
+def snapshot(bumped, count=10):
+    pkgs = {}
+    changelogs = {}
+    for i in range(count):
+        name = f'pkg{i}'
+        version = '1.1' if i in bumped else '1.0'
+        srpm = f'{name}-{version}-1.1.src.rpm'
+        for binary in (name, f'{name}-devel'):
+            pkgs[binary] = {'name': binary, 'version': version, 'release': '1.1', 'sourcerpm': srpm}
+        times = [100 + (50 if i in bumped else 0), 90]
+        changelogs[srpm] = {
+            'packages': [name, f'{name}-devel'],
+            'changelogtime': times,
+            'changelogtext': [f'- change {t} of {name}' for t in times],
+        }
+    return pkgs, changelogs
+
+
+def long_snapshot(bumped, count, entries):
+    """Like snapshot() with a more realistic changelog length."""
+    pkgs, changelogs = snapshot(bumped, count)
+    for srpm, data in changelogs.items():
+        data['changelogtime'] += range(80, 80 - entries, -1)
+        data['changelogtext'] += [f'- update to {t}:\n  * fix {srpm} issue\n' * 3 for t in range(entries)]
+    return pkgs, changelogs
+
+
+class FullFile:
+    """File failing like a full disk after the first write."""
+
+    def __init__(self, f):
+        self.f = f
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes > 1:
+            raise OSError(28, 'No space left on device')
+        return self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+
+class TestPackageNews(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def diff(self, v1, v2):
+        return ''.join(package_news.diff_files(self.dir, v1, v2))
+
+    def blobs(self):
+        blobdir = os.path.join(self.dir, package_news.BLOB_DIR)
+        return sum(len(files) for _, _, files in os.walk(blobdir))
+
+    def test_save_load(self):
+        pkgs, changelogs = snapshot(set())
+        package_news.save_snapshot(self.dir, '1', pkgs, changelogs)
+        self.assertEqual(self.blobs(), 10)
+        loaded_pkgs, loaded_changelogs = package_news.load_snapshot(os.path.join(self.dir, '1'))
+        self.assertEqual(loaded_pkgs, pkgs)
+        srpm = 'pkg3-1.0-1.1.src.rpm'
+        self.assertNotIn('changelogtext', loaded_changelogs[srpm])
+        self.assertEqual(loaded_changelogs[srpm]['changelogtext'], changelogs[srpm]['changelogtext'])
+
+        # unchanged packages share the changelog blobs
+        package_news.save_snapshot(self.dir, '2', *snapshot({3}))
+        self.assertEqual(self.blobs(), 11)
+
+        diff = self.diff('1', '2')
+        self.assertIn('  pkg3 (1.0 -> 1.1)\n', diff)
+        self.assertIn('\n- change 150 of pkg3\n', diff)
+        self.assertNotIn('pkg4', diff)
+
+    def test_migrate(self):
+        for name, bumped in (('1', set()), ('2', {3})):
+            with open(os.path.join(self.dir, name), 'wb') as f:
+                pickle.dump([3, snapshot(bumped)], f)
+        expected = self.diff('1', '2')
+
+        for name in ('1', '2'):
+            with open(os.path.join(self.dir, name), 'rb') as f:
+                self.assertEqual(pickle.load(f)[0], package_news.data_version)
+        self.assertEqual(self.diff('1', '2'), expected)
+
+    def test_cached_diff(self):
+        package_news.save_snapshot(self.dir, '1', *snapshot(set()))
+        package_news.save_snapshot(self.dir, '2', *snapshot({3}))
+        os.symlink('1', os.path.join(self.dir, 'current'))
+        stale = os.path.join(self.dir, f'{package_news.DIFF_CACHE_PREFIX}1-2')
+        writing = os.path.join(self.dir, f'{package_news.DIFF_CACHE_PREFIX}1-2.x1y2z3.tmp')
+        for path in (stale, writing):
+            with open(path, 'w') as f:
+                f.write('stale')
+        expected = self.diff('current', '2')
+
+        # concurrent requests write their own temporary files
+        first = package_news.cached_diff(self.dir, 'current', '2')
+        second = package_news.cached_diff(self.dir, 'current', '2')
+        chunks = [next(first), next(second)]
+        self.assertEqual(''.join(chunks[:1] + list(first)), expected)
+        self.assertEqual(''.join(chunks[1:] + list(second)), expected)
+
+        # finished entries of other snapshots are removed, files being written are not
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(writing))
+        cached = [fn for fn in os.listdir(self.dir) if package_news.DIFF_CACHE_RE.match(fn)]
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(''.join(package_news.cached_diff(self.dir, 'current', '2')), expected)
+
+    def cache_files(self):
+        return [fn for fn in os.listdir(self.dir) if fn.startswith(package_news.DIFF_CACHE_PREFIX)]
+
+    def test_cached_diff_not_writable(self):
+        package_news.save_snapshot(self.dir, '1', *snapshot(set()))
+        package_news.save_snapshot(self.dir, '2', *snapshot({3, 4}))
+        expected = self.diff('1', '2')
+
+        # the diff is still served in full when the cache can not be created
+        error = PermissionError(13, 'Permission denied')
+        with mock.patch.object(package_news.tempfile, 'mkstemp', side_effect=error):
+            self.assertEqual(''.join(package_news.cached_diff(self.dir, '1', '2')), expected)
+        self.assertEqual(self.cache_files(), [])
+
+        # or fails while being written
+        fdopen = os.fdopen
+        with mock.patch.object(package_news.os, 'fdopen', side_effect=lambda *args: FullFile(fdopen(*args))):
+            self.assertEqual(''.join(package_news.cached_diff(self.dir, '1', '2')), expected)
+        self.assertEqual(self.cache_files(), [])
+
+        self.assertEqual(''.join(package_news.cached_diff(self.dir, '1', '2')), expected)
+        self.assertEqual(len(self.cache_files()), 1)
+
+
+@unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK=1 to run benchmarks')
+class BenchmarkPackageNews(unittest.TestCase):
+    """Compare diffing a synthetic pair of 15k package snapshots stored as
+    data version 3 pickles and in the current format."""
+
+    PACKAGES = 15000
+    ENTRIES = 40
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.snapshots = [long_snapshot(bumped, self.PACKAGES, self.ENTRIES) for bumped in (set(), {3, 500, 7000})]
+
+    def timed(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    def test_diff(self):
+        directory_v3 = os.path.join(self.dir, 'v3')
+        os.mkdir(directory_v3)
+        for name, data in zip(('1', '2'), self.snapshots):
+            with open(os.path.join(directory_v3, name), 'wb') as f:
+                pickle.dump([3, data], f)
+            package_news.save_snapshot(self.dir, name, *data)
+
+        def diff(directory):
+            with mock.patch.object(package_news, 'save_snapshot'):  # no migration
+                return ''.join(package_news.diff_files(directory, '1', '2'))
+
+        expected, duration_v3 = self.timed(diff, directory_v3)
+        result, duration = self.timed(diff, self.dir)
+        self.assertEqual(result, expected)
+        print(f'\ndiff of {self.PACKAGES} packages: version 3 {duration_v3:.3f}s, '
+              f'version {package_news.data_version} {duration:.3f}s')
+
+        pkgs, changelogs = package_news.load_snapshot(os.path.join(self.dir, '2'))
+        srpm = pkgs['pkg500']['sourcerpm']
+        text, duration = self.timed(changelogs[srpm].__getitem__, 'changelogtext')
+        self.assertEqual(text, self.snapshots[1][1][srpm]['changelogtext'])
+        print(f'changelog of one package: {duration * 1000:.3f}ms')
+
+        def size(directory):
+            return sum(os.path.getsize(os.path.join(path, fn)) for path, _, files in os.walk(directory)
+                       for fn in files)
+        print(f'both snapshots: version 3 {size(directory_v3)} bytes, '
+              f'version {package_news.data_version} {size(self.dir) - size(directory_v3)} bytes')
+
+
+@unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK=1 to run benchmarks')
+class BenchmarkPackageNewsLoad(unittest.TestCase):
+    """Requests per second of the diff served by factory-package-news-web
+    for concurrent clients, with and without the diff cache."""
+
+    PACKAGES = 15000
+    ENTRIES = 40
+    CLIENTS = 8
+    REQUESTS = 32
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        for name, bumped in (('1', set()), ('2', set(range(0, self.PACKAGES, 20)))):
+            package_news.save_snapshot(self.dir, name, *long_snapshot(bumped, self.PACKAGES, self.ENTRIES))
+        os.symlink('1', os.path.join(self.dir, 'current'))
+
+    def load(self, diff):
+        def request(_):
+            return ''.join(diff(self.dir, 'current', '2'))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.CLIENTS) as executor:
+            responses = set(executor.map(request, range(self.REQUESTS)))
+        return responses, self.REQUESTS / (time.perf_counter() - start)
+
+    def test_requests(self):
+        expected, uncached = self.load(package_news.diff_files)
+        responses, cached = self.load(package_news.cached_diff)
+        self.assertEqual(responses, expected)
+        self.assertEqual(len(responses), 1)
+        print(f'\n{self.REQUESTS} requests by {self.CLIENTS} clients: uncached {uncached:.1f}/s, '
+              f'cached {cached:.1f}/s')
+
+
+if __name__ == '__main__':
+    unittest.main()
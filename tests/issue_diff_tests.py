@@ -0,0 +1,158 @@
+import argparse
+import functools
+import json
+import os
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import osc.conf
+import pytest
+import yaml
+
+from . import LocalServer
+
+pytest.importorskip('bugzilla')
+issue_diff = __import__("issue-diff")  # Needed because of the dash in the filename
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'issue_diff')
+PROJECT = 'SUSE:SLE-15:GA'
+FACTORY = 'openSUSE:Factory'
+FIXTURE_PREFIX = {PROJECT: 'sle', FACTORY: 'factory'}
+
+
+class IssueServer(LocalServer.LocalServer):
+    """Replay the recorded issue trackers, source info and package issues."""
+
+    def __init__(self):
+        super().__init__(IssueHandler)
+        self.requests = []
+        self.srcmd5s = {}
+        # (project, package) removed after the package list was read
+        self.fail = set()
+
+
+class IssueHandler(LocalServer.Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.strip('/').split('/')
+        with self.server.lock:
+            self.server.requests.append((path, query.get('view', [None])[0]))
+
+        if path == ['issue_trackers']:
+            fixture = 'issue_trackers.xml'
+        elif path[0] == 'source' and len(path) == 2 and 'expand' in query:
+            fixture = f'{FIXTURE_PREFIX[path[1]]}.list.xml'
+        elif path[0] == 'source' and len(path) == 2 and query.get('view') == ['info']:
+            fixture = f'{FIXTURE_PREFIX[path[1]]}.info.xml'
+        elif path[0] == 'source' and len(path) == 3 and query.get('view') == ['issues']:
+            if (path[1], path[2]) in self.server.fail:
+                self.send_error(404)
+                return
+            fixture = f'{FIXTURE_PREFIX[path[1]]}.{path[2]}.issues.xml'
+        else:
+            self.send_error(404)
+            return
+
+        with open(os.path.join(FIXTURES, fixture)) as f:
+            data = f.read()
+        if fixture.endswith('.info.xml'):
+            for srcmd5, replacement in self.server.srcmd5s.items():
+                data = data.replace(srcmd5, replacement)
+        self.reply(data)
+
+
+class TestIssueDiff(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(IssueServer())
+
+        oscrc = os.path.join(self.dir, 'oscrc')
+        get_config = functools.partial(osc.conf.get_config, override_conffile=oscrc, override_no_keyring=True)
+        self.prompt_interactive = mock.Mock(return_value={})
+        for patcher in (
+            mock.patch('osc.conf.get_config', new=get_config),
+            mock.patch('osclib.cache.Cache.init'),
+            mock.patch('osclib.cache_manager.CacheManager.directory', return_value=self.dir),
+            mock.patch.object(issue_diff, 'sync', return_value=self.dir),
+            mock.patch.object(issue_diff, 'bugzilla_init'),
+            mock.patch.object(issue_diff, 'prompt_interactive', new=self.prompt_interactive),
+            mock.patch.object(issue_diff, 'prompt_continue', return_value='y'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def args(self, limit=0):
+        return argparse.Namespace(
+            apiurl=self.url, debug=False, cache_dir=self.dir, project=PROJECT, factory=FACTORY,
+            print_stats=False, bugzilla_apiurl='https://bugzilla.example.com', bugzilla_product='SLES',
+            bugzilla_component='Other', bugzilla_version='unspecified', bugzilla_cc=None, newest=30, limit=limit)
+
+    def issue_requests(self):
+        return sorted((path[1], path[2]) for path, view in self.server.requests if view == 'issues')
+
+    def test_issue_index_update(self):
+        index = {'fish': {'srcmd5': 'f' * 32, 'issues': []}}
+        issue_diff.issue_index_prune(index, ['bash', 'zsh'])
+        fetched = issue_diff.issue_index_update(self.url, PROJECT, ['bash', 'zsh'], index)
+        self.assertEqual(fetched, 2)
+        self.assertEqual(sorted(index), ['bash', 'zsh'])
+        self.assertEqual(index['bash']['srcmd5'], '1a9f0b6d9c7e4f0e8b1d2c3a4f5e6d7c')
+        self.assertEqual(sorted(issue['name'] for issue in index['bash']['issues']),
+                         ['1001', '1002', 'CVE-2019-18276'])
+        self.assertEqual(index['zsh']['issues'][0]['owner'], 'maintainer@suse.com')
+
+        # only the package with new sources is fetched again
+        self.server.requests = []
+        self.server.srcmd5s['3c7d2d8ebe5a4f2a0d3f4e5c6b7a8f9e'] = '0' * 32
+        fetched = issue_diff.issue_index_update(self.url, PROJECT, ['bash', 'zsh'], index)
+        self.assertEqual(fetched, 1)
+        self.assertEqual(self.issue_requests(), [(PROJECT, 'zsh')])
+        self.assertEqual(index['zsh']['srcmd5'], '0' * 32)
+
+    def test_main(self):
+        issue_diff.main(self.args())
+
+        # vim and fish are only in one of the projects, zsh has the same issues in both
+        self.assertEqual(self.issue_requests(), sorted([(PROJECT, 'bash'), (PROJECT, 'zsh'),
+                                                        (FACTORY, 'bash'), (FACTORY, 'zsh')]))
+        self.prompt_interactive.assert_called_once()
+        changes, project, package = self.prompt_interactive.call_args[0]
+        self.assertEqual((project, package), (PROJECT, 'bash'))
+        self.assertEqual(sorted(changes), ['bsc#1001', 'bsc#1002'])
+
+        with open(os.path.join(self.dir, f'{PROJECT}.yml')) as f:
+            db = yaml.safe_load(f)
+        self.assertEqual(db, {'bash': {'bsc#1001': 'whitelist', 'bsc#1002': 'whitelist'}})
+
+        # the second run uses the issue index and finds nothing new
+        self.server.requests = []
+        self.prompt_interactive.reset_mock()
+        issue_diff.main(self.args())
+        self.assertEqual(self.issue_requests(), [])
+        self.prompt_interactive.assert_not_called()
+
+    def test_fetch_failed(self):
+        self.server.fail.add((PROJECT, 'zsh'))
+        fetched = issue_diff.issue_index_update(self.url, PROJECT, ['bash', 'zsh'], {})
+        self.assertEqual(fetched, 2)
+
+        issue_diff.main(self.args())
+        self.prompt_interactive.assert_called_once()
+        with open(os.path.join(self.dir, f'{PROJECT}.json')) as f:
+            self.assertEqual(sorted(json.load(f)['packages']), ['bash'])
+
+        # the skipped package is fetched again on the next run
+        self.server.fail.clear()
+        self.server.requests = []
+        issue_diff.main(self.args())
+        self.assertEqual(self.issue_requests(), [(PROJECT, 'zsh')])
+
+    def test_limit(self):
+        # bash is checked first and reaches the limit, zsh is never fetched
+        with mock.patch.object(issue_diff, 'shuffle', new=list.sort), \
+                mock.patch.object(issue_diff, 'FETCH_BATCH', 1):
+            issue_diff.main(self.args(limit=1))
+        self.assertEqual(self.issue_requests(), sorted([(PROJECT, 'bash'), (FACTORY, 'bash')]))
+        self.prompt_interactive.assert_called_once()
@@ -0,0 +1,127 @@
+import logging
+import os
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+import yaml
+
+from . import LocalServer
+
+legal_auto = __import__("legal-auto")  # Needed because of the dash in the filename
+LegalAuto = legal_auto.LegalAuto
+
+PROJECT = 'SUSE:SLE-15-SP6:GA'
+
+
+class LegalServer(LocalServer.LocalServer):
+    """Stand-in for both the OBS source info of PROJECT and legaldb."""
+
+    def __init__(self):
+        super().__init__(LegalHandler)
+        self.sources = {'bash': ('3', 'a' * 32), 'zsh': ('7', 'b' * 32), 'glibc': ('5', 'c' * 32)}
+        self.requests = []
+        self.product = None
+        self.patch_status = 200
+        self.next_id = 100
+
+    def sourceinfo(self):
+        info = ''.join(f'<sourceinfo package="{package}" rev="{rev}" srcmd5="{srcmd5}">'
+                       f'<filename>{package}.spec</filename></sourceinfo>'
+                       for package, (rev, srcmd5) in self.sources.items())
+        return f'<sourceinfolist>{info}</sourceinfolist>'
+
+
+class LegalHandler(LocalServer.Handler):
+    def record(self):
+        url = urlparse(self.path)
+        with self.server.lock:
+            self.server.requests.append((self.command, url.path))
+        return url
+
+    def do_GET(self):
+        url = self.record()
+        if url.path == f'/source/{PROJECT}':
+            self.reply(self.server.sourceinfo())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = self.record()
+        query = parse_qs(url.query)
+        assert url.path == '/packages'
+        assert query['rev'] == [self.server.sources[query['package'][0]][0]]
+        with self.server.lock:
+            self.server.next_id += 1
+            legaldb_id = self.server.next_id
+        self.reply(f'{{"saved": {{"id": {legaldb_id}, "state": "new"}}}}')
+
+    def do_PATCH(self):
+        url = self.record()
+        assert url.path == f'/products/{PROJECT}'
+        data = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if self.server.patch_status != 200:
+            self.send_error(self.server.patch_status)
+            return
+        self.server.product = sorted(int(value) for value in parse_qs(data)['id'])
+        self.reply('{}')
+
+
+class TestLegalAuto(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(LegalServer())
+
+        patcher = mock.patch('osclib.cache_manager.CacheManager.directory', return_value=self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.bot = LegalAuto(apiurl=self.url, logger=logging.getLogger(__name__))
+        self.bot.legaldb = self.url
+
+    def update(self):
+        self.server.requests = []
+        self.bot.update_project(PROJECT)
+        return sorted(method for method, path in self.server.requests)
+
+    def test_incremental(self):
+        self.assertEqual(self.update(), ['GET', 'PATCH', 'POST', 'POST', 'POST'])
+        self.assertEqual(self.server.product, [101, 102, 103])
+
+        # nothing changed, only the source info is fetched
+        self.assertEqual(self.update(), ['GET'])
+
+        # a new revision of zsh and glibc dropped from the product
+        self.server.sources['zsh'] = ('8', 'd' * 32)
+        del self.server.sources['glibc']
+        self.assertEqual(self.update(), ['GET', 'PATCH', 'POST'])
+        self.assertEqual(len(self.server.product), 2)
+        self.assertIn(104, self.server.product)
+        with open(os.path.join(self.dir, f'{PROJECT}.yaml')) as f:
+            state = yaml.safe_load(f)
+        self.assertEqual(sorted(state['packages']), ['bash', 'zsh'])
+        revisions = state['packages']['zsh']
+        self.assertEqual(list(revisions), ['b' * 32, 'd' * 32])
+        self.assertEqual(revisions['d' * 32], 104)
+
+        self.assertEqual(self.update(), ['GET'])
+
+    def test_old_cache(self):
+        with open(os.path.join(self.dir, f'{PROJECT}.yaml'), 'w') as f:
+            yaml.dump({'bash': {'3': 42}, 'zsh': {'6': 43}}, f)
+        self.assertEqual(self.update(), ['GET', 'PATCH', 'POST', 'POST'])
+        self.assertIn(42, self.server.product)
+        self.assertNotIn(43, self.server.product)
+
+    def test_patch_failed(self):
+        self.server.patch_status = 500
+        with self.assertRaises(requests.HTTPError):
+            self.update()
+        self.assertIsNone(self.server.product)
+
+        # the revisions are not POSTed again, but the product is PATCHed
+        self.server.patch_status = 200
+        self.assertEqual(self.update(), ['GET', 'PATCH'])
+        self.assertEqual(self.server.product, [101, 102, 103])
+        self.assertEqual(self.update(), ['GET'])
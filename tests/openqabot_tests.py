@@ -0,0 +1,154 @@
+import logging
+import os
+import unittest
+from email.utils import formatdate, parsedate_to_datetime
+from unittest import mock
+from urllib.error import HTTPError
+
+from lxml import etree as ET
+
+from osclib.memoize import memoize_session_reset
+
+from . import LocalServer
+
+# oqamaint.suse fetches the packages tested on minimal systems on import
+with mock.patch('requests.get'):
+    from oqamaint import openqabot
+    from oqamaint.openqabot import OpenQABot
+    from oqamaint.openqabot import RepoChecksums
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'openqabot')
+
+PACKAGES = {
+    'SUSE:Maintenance:Test:SLE-SERVER:15-SP5:x86_64': ['patchinfo.1001', 'patchinfo.1002', 'patchinfo.1003'],
+    'SUSE:Maintenance:Test:SLE-SERVER:15-SP5:aarch64': ['patchinfo.1001', 'patchinfo.1003'],
+    'SUSE:Maintenance:1001': ['bash.SUSE_SLE-15-SP5_Update', 'patchinfo'],
+    'SUSE:Maintenance:1002': ['kgraft-patch-SLE15-SP5_Update_3.SUSE_SLE-15-SP5_Update', 'patchinfo'],
+}
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <revision>{revision}</revision>
+  <data type="primary">
+    <checksum type="sha256">{revision:064x}</checksum>
+    <location href="repodata/{revision:064x}-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+
+class RepoServer(LocalServer.LocalServer):
+    """Serve repomd.xml of repositories named by path with a revision and
+    the time it was last modified."""
+
+    def __init__(self):
+        super().__init__(RepoHandler)
+        self.repos = {}
+        self.requests = []
+
+    def publish(self, repo, revision, modified):
+        self.repos[repo] = (revision, modified)
+
+
+class RepoHandler(LocalServer.Handler):
+    def do_GET(self):
+        repo = self.path[:-len('/repodata/repomd.xml')]
+        if repo not in self.server.repos:
+            self.send_error(404)
+            return
+        revision, modified = self.server.repos[repo]
+        since = self.headers.get('If-Modified-Since')
+        not_modified = since and parsedate_to_datetime(since).timestamp() >= modified
+        with self.server.lock:
+            self.server.requests.append((repo, 304 if not_modified else 200))
+        if not_modified:
+            self.reply(status=304)
+            return
+        self.reply(REPOMD.format(revision=revision), headers={'Last-Modified': formatdate(modified, usegmt=True)})
+
+
+class TestRepoChecksums(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(RepoServer())
+        self.store = os.path.join(self.dir, 'repomd.json')
+
+    def checksums(self, repos):
+        self.server.requests = []
+        checksums = RepoChecksums(self.store, logging.getLogger(__name__))
+        checksums.update([self.url + repo for repo in repos])
+        return checksums
+
+    def test_revalidate(self):
+        repos = ['/SLE-15-SP5/Update', '/SLE-15-SP5/Pool', '/SLE-15-SP4/Update']
+        for repo in repos:
+            self.server.publish(repo, 1, 1700000000)
+        checksums = self.checksums(repos + repos)
+        self.assertEqual(sorted(self.server.requests), sorted((repo, 200) for repo in repos))
+        self.assertEqual(len(checksums.changed), 3)
+        self.assertEqual(checksums.checksum(self.url + repos[0]), f'{1:064x}')
+        self.assertEqual(len(self.server.requests), 3)
+
+        # the next run only gets a 304 for the unchanged repos
+        self.server.publish(repos[1], 2, 1700003600)
+        checksums = self.checksums(repos)
+        self.assertEqual(sorted(self.server.requests),
+                         [(repos[2], 304), (repos[1], 200), (repos[0], 304)])
+        self.assertEqual(checksums.changed, [self.url + repos[1]])
+        self.assertEqual(checksums.checksum(self.url + repos[1]), f'{2:064x}')
+        self.assertEqual(checksums.checksum(self.url + repos[0]), f'{1:064x}')
+
+    def test_repo_hash(self):
+        self.server.publish('/SLE-15-SP5/Update', 1, 1700000000)
+        bot = OpenQABot(apiurl='https://api.suse.de', logger=logging.getLogger(__name__))
+        bot.repo_checksums = RepoChecksums(self.store, logging.getLogger(__name__))
+        digest = bot.calculate_repo_hash([self.url + '/SLE-15-SP5/Update'], {'1001': 'SUSE:Maintenance:1001'})
+        self.assertTrue(digest.endswith(':1001'))
+        with self.assertRaises(HTTPError):
+            bot.calculate_repo_hash([self.url + '/missing'], {})
+
+
+class TestCalculateIncidents(unittest.TestCase):
+
+    def setUp(self):
+        memoize_session_reset()
+        self.bot = OpenQABot(apiurl='https://api.suse.de', logger=logging.getLogger(__name__))
+
+        def search(apiurl, request):
+            return {'request': ET.parse(os.path.join(FIXTURES, 'release_requests.xml')).getroot()}
+
+        patcher = mock.patch('osc.core.search', side_effect=search)
+        self.search = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('osc.core.meta_get_packagelist', side_effect=lambda apiurl, prj: PACKAGES[prj])
+        self.packagelist = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_calculate_incidents(self):
+        targets = [{'incidents': {'OS': project}} for project in PACKAGES if project.startswith('SUSE:Maintenance:Test:')]
+        self.bot.openqa = mock.Mock(baseurl='https://openqa.suse.de')
+        self.bot.tgt_repo = {self.bot.openqa.baseurl: dict(enumerate(targets))}
+        self.bot.pending_target_repos = set()
+
+        # 1002 is a kgraft patch and 1003 still in staging
+        self.assertEqual(self.bot.calculate_incidents(targets[0]['incidents']), [('OS_TEST_ISSUES', '1001')])
+        self.assertEqual(self.bot.calculate_incidents(targets[1]['incidents']), [('OS_TEST_ISSUES', '1001')])
+
+        # the first target looked up the incidents of both with one search
+        self.assertEqual(self.search.call_count, 1)
+        xpath = self.search.call_args.kwargs['request']
+        for incident in ('1001', '1002', '1003'):
+            self.assertEqual(xpath.count(f"'SUSE:Maintenance:{incident}'"), 1)
+        # every project is listed once
+        self.assertEqual(sorted(call.args[1] for call in self.packagelist.call_args_list), sorted(PACKAGES))
+
+    def test_batches(self):
+        with mock.patch.object(openqabot, 'INCIDENT_SEARCH_BATCH', 2):
+            self.bot.lookup_release_requests(['1003', '1001', '1002', '1001'])
+        self.assertEqual(self.search.call_count, 2)
+        self.assertEqual(self.bot.release_requests['1001'].reqid, '330001')
+        self.assertIsNone(self.bot.release_requests['1003'])
+
+        self.assertEqual(self.bot.is_incident_in_testing('1002').reqid, '330002')
+        self.assertEqual(self.search.call_count, 2)
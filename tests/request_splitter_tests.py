@@ -0,0 +1,100 @@
+import os
+from types import SimpleNamespace
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlparse
+
+from lxml import etree as ET
+
+from osclib.memoize import memoize_session_reset
+from osclib.request_splitter import StrategyRebuild
+
+from . import LocalServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PROJECT = 'openSUSE:Factory'
+
+
+class BuildDepServer(LocalServer.LocalServer):
+    """Serve the recorded _builddepinfo of PROJECT."""
+
+    def __init__(self):
+        super().__init__(BuildDepHandler)
+        self.requests = []
+
+
+class BuildDepHandler(LocalServer.Handler):
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        self.server.requests.append(path)
+        fixture = os.path.join(FIXTURES, path.lstrip('/'))
+        if not path.endswith('/_builddepinfo') or not os.path.exists(fixture):
+            self.send_error(404)
+            return
+        with open(fixture, 'rb') as f:
+            self.reply(f.read())
+
+
+def request(id, package, ring=None):
+    target = f'<target project="{PROJECT}" package="{package}"' + (f' ring="{ring}"' if ring else '') + '/>'
+    return ET.fromstring(f'<request id="{id}"><action type="submit">{target}</action></request>')
+
+
+class TestStrategyRebuild(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(BuildDepServer())
+        memoize_session_reset()
+        self.addCleanup(memoize_session_reset)
+
+        self.requests = [
+            request(100, 'glibc', ring='0-Bootstrap'),
+            request(101, 'zlib', ring='0-Bootstrap'),
+            request(102, 'curl', ring='1-MinimalX'),
+            request(103, 'vim'),
+            request(104, 'python311'),
+            request(105, 'openssl', ring='1-MinimalX'),
+        ]
+
+    def splitter(self):
+        return SimpleNamespace(
+            api=SimpleNamespace(apiurl=self.url, project=PROJECT),
+            config={'main-repo': 'standard', 'staging-archs': 'i586 x86_64'},
+            grouped={'': {'bootstrap_required': True, 'requests': list(self.requests)}},
+            stagings_available=['A', 'B', 'C'],
+            stagings={'A': {'bootstrapped': True}, 'B': {'bootstrapped': False}, 'C': {'bootstrapped': False}},
+        )
+
+    def groups(self, splitter):
+        return {group: [r.find('action/target').get('package') for r in info['requests']]
+                for group, info in splitter.grouped.items()}
+
+    def test_arrange(self):
+        strategy = StrategyRebuild()
+        splitter = self.splitter()
+        strategy.arrange(splitter)
+
+        # a package is rebuilt along with everything depending on it, the
+        # python311:doc flavor counts as python311
+        self.assertEqual(strategy.rebuild_costs, {'100': 8, '101': 5, '102': 2, '103': 1, '104': 1, '105': 4})
+        self.assertEqual(self.groups(splitter), {
+            'bootstrap-00': ['glibc', 'zlib'],
+            'rebuild-00': ['openssl'],
+            'rebuild-01': ['curl', 'vim', 'python311'],
+        })
+        self.assertTrue(splitter.grouped['bootstrap-00']['bootstrap_required'])
+        self.assertFalse(splitter.grouped['rebuild-00']['bootstrap_required'])
+        # the requests themselves are not modified
+        self.assertIsNone(self.requests[0].find('action/target').get('rebuild_cost'))
+
+    def test_builddepinfo_memoized(self):
+        for _ in range(2):
+            StrategyRebuild(stagings=2).arrange(self.splitter())
+        self.assertEqual(self.server.requests, [f'/build/{PROJECT}/standard/x86_64/_builddepinfo'])
+
+        # another architecture is fetched separately, none was recorded
+        splitter = self.splitter()
+        splitter.config['splitter-rebuild-arch'] = 'i586'
+        with self.assertRaises(HTTPError):
+            StrategyRebuild().arrange(splitter)
+        self.assertEqual(len(self.server.requests), 2)
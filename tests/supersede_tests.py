@@ -0,0 +1,93 @@
+import io
+from contextlib import redirect_stdout
+
+from colorama import Fore
+
+from osclib.conf import Config
+from osclib.select_command import SelectCommand
+from osclib.supersede_command import SupersedeCommand
+from . import OBSLocal
+
+# CI-Node: Long1
+
+STAGING = 'openSUSE:Factory:Staging:A'
+
+
+class TestSupersede(OBSLocal.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.wf = OBSLocal.FactoryWorkflow()
+        self.wf.setup_rings()
+        self.staging = self.wf.create_staging('A', freeze=True)
+
+        self.rq1 = self.wf.create_submit_request('devel:wine', 'wine')
+        SelectCommand(self.wf.api, self.staging.name).perform(['wine'])
+
+    def tearDown(self):
+        super().tearDown()
+        del self.wf
+
+    def supersede(self, requests=None):
+        self.wf.api._packages_staged = None
+        self.osc_user('staging-bot')
+        Config.get(self.wf.apiurl, self.wf.project)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            SupersedeCommand(self.wf.api).perform(requests)
+        return output.getvalue()
+
+    def line(self, request, verbage):
+        return 'request {} for {} {} {} in {}\n'.format(
+            request.reqid, Fore.CYAN + 'wine' + Fore.RESET, verbage, self.rq1.reqid,
+            Fore.YELLOW + STAGING + Fore.RESET)
+
+    def staged(self):
+        self.wf.api._packages_staged = None
+        return self.wf.api.packages_staged['wine']['rq_id']
+
+    def test_supersede(self):
+        rq2 = self.wf.create_submit_request('devel:wine', 'wine', text='Something new')
+
+        output = self.supersede()
+        self.assertEqual(output, self.line(rq2, SupersedeCommand.CODE_MAP[None]))
+        self.assertEqual(self.staged(), rq2.reqid)
+        self.assertEqual(self.rq1.reviews()[-1], {'state': 'declined', 'by_group': 'factory-staging'})
+
+    def test_decline_same_source(self):
+        rq2 = self.wf.create_submit_request('devel:wine', 'wine', add_commit=False)
+
+        output = self.supersede()
+        self.assertEqual(output, self.line(rq2, SupersedeCommand.CODE_MAP[True] + ' in favor of'))
+        self.assertEqual(self.staged(), self.rq1.reqid)
+        self.assertEqual(rq2.reviews()[0], {'state': 'declined', 'by_group': 'factory-staging'})
+
+    def test_ignore_other_project(self):
+        rq2 = self.wf.create_submit_request('home:wine', 'wine', text='Something else')
+
+        output = self.supersede()
+        self.assertEqual(output, f'{rq2.reqid}: ignored\n' +
+                         self.line(rq2, SupersedeCommand.CODE_MAP[False] + ' in favor of'))
+        self.assertEqual(self.staged(), self.rq1.reqid)
+        self.assertIn(int(rq2.reqid), self.wf.api.get_ignored_requests())
+
+        # excluded requests are not considered again
+        self.assertEqual(self.supersede(), '')
+
+    def test_target_requests(self):
+        rq2 = self.wf.create_submit_request('devel:wine', 'wine', text='Something new')
+
+        # only the staged requests of the targeted requests are loaded
+        api = self.wf.api
+        requests = api.get_open_requests()
+        for target_requests, index in ((None, [self.rq1.reqid]), (['wine'], [self.rq1.reqid]),
+                                       ([rq2.reqid], [self.rq1.reqid]), (['fish'], [])):
+            api.supersede_index_load(requests, target_requests)
+            self.assertEqual(sorted(api._supersede_index), index)
+        api._supersede_index = None
+
+        self.assertEqual(self.supersede(['fish']), '')
+        self.assertEqual(self.staged(), self.rq1.reqid)
+        self.assertEqual(self.supersede(['wine']), self.line(rq2, SupersedeCommand.CODE_MAP[None]))
+        self.assertEqual(self.staged(), rq2.reqid)
@@ -0,0 +1,66 @@
+import json
+import os
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from osclib import trace
+
+from . import LocalServer
+
+
+class Handler(LocalServer.Handler):
+    def do_GET(self):
+        if self.path.startswith('/source/missing'):
+            self.send_error(404)
+            return
+        self.reply(b'<ok/>')
+
+
+class TestTrace(LocalServer.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serve(LocalServer.LocalServer(Handler), osc_config=False)
+
+    def test_url_template(self):
+        self.assertEqual(trace.url_template('https://api/source/openSUSE:Factory/bash?view=info&rev=3'),
+                         '/source/*/*?rev=*&view=info')
+        self.assertEqual(trace.url_template('https://api/build/openSUSE:Factory/standard/x86_64/_builddepinfo'),
+                         '/build/*/*/*/_builddepinfo')
+        self.assertEqual(trace.url_template("https://api/search/request?match=state/@name='new'"),
+                         '/search/request?match=*')
+
+    def test_tracer(self):
+        tracer = trace.Tracer(self.dir, 'osc-staging select')
+
+        def request(method, url):
+            return urlopen(url)
+
+        for package in ('bash', 'zsh', 'fish'):
+            tracer.request(request, 'GET', f'{self.url}/source/openSUSE:Factory/{package}?view=info')
+        with self.assertRaises(HTTPError):
+            tracer.request(request, 'GET', f'{self.url}/source/missing')
+        tracer.local.cache = 'miss'
+        tracer.request(request, 'GET', f'{self.url}/source/openSUSE:Factory/_meta')
+
+        rows = dict(tracer.summary())
+        info = rows[('GET', '/source/*/*?view=info')]
+        self.assertEqual(info['count'], 3)
+        self.assertEqual(info['bytes'], 15)
+        self.assertEqual(rows[('GET', '/source/*')]['errors'], 1)
+        self.assertIn('GET /source/*/*?view=info', tracer.summary_table())
+
+        tracer.export()
+        filenames = os.listdir(self.dir)
+        self.assertEqual(len(filenames), 1)
+        self.assertTrue(filenames[0].startswith('osc-staging-'))
+        with open(os.path.join(self.dir, filenames[0])) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[-1]['cat'], 'miss')
+        self.assertEqual(events[3]['args']['status'], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from osclib import transport
+
+from . import LocalServer
+
+
+class FlakyServer(LocalServer.LocalServer):
+    """Answer the first failures requests with status and headers."""
+
+    def __init__(self, failures, status=503, headers={}):
+        super().__init__(FlakyHandler)
+        self.failures = failures
+        self.status = status
+        self.headers = headers
+        self.requests = 0
+
+
+class FlakyHandler(LocalServer.Handler):
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.requests <= self.server.failures:
+            self.reply(status=self.server.status, headers=self.server.headers)
+            return
+        self.reply(b'ok')
+
+
+class TestTransport(LocalServer.TestCase):
+
+    def flaky(self, *args, **kwargs):
+        return self.serve(FlakyServer(*args, **kwargs), osc_config=False).url + '/'
+
+    def test_backoff(self):
+        url = self.flaky(4)
+        transport.stats.reset()
+        with mock.patch('osclib.transport.time.sleep') as sleep:
+            self.assertEqual(transport.retried_request(url, urlopen).read(), b'ok')
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 4)
+        for attempt, delay in enumerate(delays):
+            maximum = min(transport.RETRY_DELAY_MAX, transport.RETRY_DELAY_MIN * 2 ** attempt)
+            self.assertTrue(maximum / 2 <= delay <= maximum)
+        self.assertEqual(transport.stats.retries, 4)
+        self.assertEqual(self.server.requests, 5)
+
+    def test_retry_after(self):
+        url = self.flaky(2, status=429, headers={'Retry-After': '7'})
+        with mock.patch('osclib.transport.time.sleep') as sleep:
+            transport.retried_request(url, urlopen)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [7, 7])
+
+    def test_budget(self):
+        url = self.flaky(10, headers={'Retry-After': '30'})
+        with mock.patch('osclib.transport.time.sleep') as sleep:
+            with self.assertRaises(HTTPError):
+                transport.retried_request(url, urlopen, budget=100)
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_client_error(self):
+        url = self.flaky(1, status=404)
+        with self.assertRaises(HTTPError):
+            transport.retried_request(url, urlopen)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_latency(self):
+        stats = transport.TransportStats()
+        stats.record(0.01)
+        stats.record(2)
+        stats.record(120)
+        self.assertEqual(stats.requests, 3)
+        self.assertEqual(stats.latency[0], 1)
+        self.assertEqual(stats.latency[transport.LATENCY_BUCKETS.index(2.5)], 1)
+        self.assertEqual(stats.latency[-1], 1)
+        self.assertIn('retries: 0', stats.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
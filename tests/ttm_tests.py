@@ -0,0 +1,106 @@
+import io
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from lxml import etree as ET
+
+from ttm.manager import BuildResult, BuildSnapshot, ToTestManager
+
+PROJECT = 'openSUSE:Factory'
+
+RESULT = """<resultlist state="c1b2">
+  <result project="openSUSE:Factory" repository="standard" arch="x86_64" code="published" state="published">
+    <status package="bash" code="succeeded"/>
+    <status package="zsh" code="failed"/>
+  </result>
+  <result project="openSUSE:Factory" repository="images" arch="x86_64" code="building" state="building" dirty="true">
+    <status package="000product" code="succeeded"/>
+  </result>
+  <result project="openSUSE:Factory" repository="ports" arch="aarch64" code="broken" state="broken"/>
+</resultlist>
+"""
+
+RESULT_FAILED = """<resultlist state="c1b2">
+  <result project="openSUSE:Factory" repository="standard" arch="x86_64" code="published" state="published">
+    <status package="zsh" code="failed"/>
+  </result>
+</resultlist>
+"""
+
+BINARIES = """<binarylist>
+  <binary filename="openSUSE-Tumbleweed-DVD-x86_64-Snapshot20261018-Media.iso" size="1" mtime="1"/>
+  <binary filename="openSUSE-Tumbleweed-DVD-x86_64-Snapshot20261018-Media.iso.sha256" size="1" mtime="1"/>
+</binarylist>
+"""
+
+
+class TestBuildResult(unittest.TestCase):
+
+    def test_index(self):
+        result = BuildResult(ET.fromstring(RESULT))
+        self.assertEqual([repo['repository'] for repo in result.repos], ['standard', 'images', 'ports'])
+        self.assertEqual(result.repos[1]['dirty'], 'true')
+        self.assertEqual(result.code('standard', 'x86_64', 'zsh'), 'failed')
+        self.assertEqual(result.code('images', 'x86_64', '000product'), 'succeeded')
+        self.assertIsNone(result.code('standard', 'x86_64', 'fish'))
+        self.assertIsNone(result.code('standard', 'i586', 'bash'))
+
+
+class TestBuildSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = ToTestManager(SimpleNamespace(apiurl='http://localhost', debug=False,
+                                                     caching=False, dryrun=True))
+        self.manager.project = SimpleNamespace(product_repo='images', product_arch='local')
+        self.manager.api = mock.Mock()
+        self.manager.api.makeurl.side_effect = lambda path, query={}: ('/'.join(path), tuple(query.items()))
+        self.manager.api.retried_GET.side_effect = self.get
+        self.requests = []
+
+    def get(self, url):
+        self.requests.append(url)
+        path, query = url
+        if path.endswith('/_result'):
+            return io.BytesIO((RESULT_FAILED if query else RESULT).encode('utf-8'))
+        return io.BytesIO(BINARIES.encode('utf-8'))
+
+    def test_shared_within_snapshot(self):
+        with self.manager.build_snapshot() as snapshot:
+            self.assertIsInstance(snapshot, BuildSnapshot)
+            self.assertFalse(self.manager.all_repos_done(PROJECT))
+            result = self.manager.build_result(PROJECT)
+            self.assertEqual(result.code('standard', 'x86_64', 'bash'), 'succeeded')
+            binaries = self.manager.binaries_of_product(PROJECT, '000product')
+            self.assertEqual(self.manager.binaries_of_product(PROJECT, '000product'), binaries)
+            self.assertEqual(self.manager.iso_build_version(PROJECT, '000product'), '20261018')
+
+            # nested blocks use the same snapshot
+            with self.manager.build_snapshot() as nested:
+                self.assertIs(nested, snapshot)
+                self.manager.build_result(PROJECT)
+            self.assertIs(self.manager.snapshot, snapshot)
+
+        self.assertEqual(self.requests, [(f'build/{PROJECT}/_result', ()),
+                                         (f'build/{PROJECT}/images/local/000product', ())])
+        self.assertIsNone(self.manager.snapshot)
+
+    def test_polling_outside_snapshot(self):
+        # only the failed packages are requested, and every time
+        self.assertTrue(self.manager.all_repos_done(PROJECT))
+        self.assertTrue(self.manager.all_repos_done(PROJECT))
+        self.assertEqual(self.requests, [(f'build/{PROJECT}/_result', (('code', 'failed'),))] * 2)
+
+        self.manager.build_result(PROJECT)
+        self.manager.build_result(PROJECT)
+        self.assertEqual(len(self.requests), 4)
+
+    def test_reset_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.manager.build_snapshot():
+                self.manager.build_result(PROJECT)
+                raise RuntimeError()
+        self.assertIsNone(self.manager.snapshot)
+
+        self.manager.build_result(PROJECT)
+        self.assertEqual(len(self.requests), 2)
@@ -12,6 +12,7 @@ import ToolBase
 import logging
 import re
 import yaml
+from contextlib import contextmanager
 from enum import IntEnum
 from lxml import etree as ET
 from osclib.stagingapi import StagingAPI
@@ -37,6 +38,35 @@ class QAResult(IntEnum):
             return 'passed'
 
 
+class BuildResult(object):
+    """Indexed view of /build/<project>/_result
+
+    Maps (repository, arch) to the repository state and package to code so
+    repeated lookups do not need to walk the tree again.
+    """
+
+    def __init__(self, root):
+        self.repos = []
+        self.codes = {}
+        for result in root.findall('result'):
+            key = (result.get('repository'), result.get('arch'))
+            self.repos.append(dict(result.attrib))
+            packages = self.codes.setdefault(key, {})
+            for status in result.findall('status'):
+                packages[status.get('package')] = status.get('code')
+
+    def code(self, repository, arch, package):
+        return self.codes.get((repository, arch), {}).get(package)
+
+
+class BuildSnapshot(object):
+    """Build results and binary listings fetched during one decision"""
+
+    def __init__(self):
+        self.results = {}
+        self.binaries = {}
+
+
 class ToTestManager(ToolBase.ToolBase):
 
     def __init__(self, tool):
@@ -47,10 +77,38 @@ class ToTestManager(ToolBase.ToolBase):
         self.debug = tool.debug
         self.caching = tool.caching
         self.dryrun = tool.dryrun
+        self.snapshot = None
 
     def setup(self, project):
         self.project = ToTest(project, self.apiurl)
         self.api = StagingAPI(self.apiurl, project=project)
+        self.snapshot = None
+
+    @contextmanager
+    def build_snapshot(self):
+        """Share build results and binary listings within the block.
+
+        Outside of a snapshot every lookup goes to OBS to allow polling.
+        """
+        if self.snapshot is not None:
+            yield self.snapshot
+            return
+
+        self.snapshot = BuildSnapshot()
+        try:
+            yield self.snapshot
+        finally:
+            self.snapshot = None
+
+    def build_result(self, project):
+        if self.snapshot is not None and project in self.snapshot.results:
+            return self.snapshot.results[project]
+
+        url = self.api.makeurl(['build', project, '_result'])
+        result = BuildResult(ET.parse(self.api.retried_GET(url)).getroot())
+        if self.snapshot is not None:
+            self.snapshot.results[project] = result
+        return result
 
     def version_file(self, target):
         return f'version_{target}'
@@ -85,17 +143,24 @@ class ToTestManager(ToolBase.ToolBase):
         if arch is None:
             arch = self.project.product_arch
 
+        key = (project, repo, arch, product)
+        if self.snapshot is not None and key in self.snapshot.binaries:
+            return self.snapshot.binaries[key]
+
+        ret = []
         url = self.api.makeurl(['build', project, repo, arch, product])
         try:
             f = self.api.retried_GET(url)
         except HTTPError:
-            return []
+            f = None
 
-        ret = []
-        root = ET.parse(f).getroot()
-        for binary in root.findall('binary'):
-            ret.append(binary.get('filename'))
+        if f is not None:
+            root = ET.parse(f).getroot()
+            for binary in root.findall('binary'):
+                ret.append(binary.get('filename'))
 
+        if self.snapshot is not None:
+            self.snapshot.binaries[key] = ret
         return ret
 
     def ftp_build_version(self, project, tree):
@@ -166,12 +231,16 @@ class ToTestManager(ToolBase.ToolBase):
         # sufficient here, so don't try to add it :-)
         codes = ['published', 'unpublished'] if not codes else codes
 
-        url = self.api.makeurl(
-            ['build', project, '_result'], {'code': 'failed'})
-        f = self.api.retried_GET(url)
-        root = ET.parse(f).getroot()
+        if self.snapshot is not None:
+            repos = self.build_result(project).repos
+        else:
+            # Polled while publishing, the state of the failed packages is
+            # enough and much smaller than the full result.
+            url = self.api.makeurl(['build', project, '_result'], {'code': 'failed'})
+            repos = BuildResult(ET.parse(self.api.retried_GET(url)).getroot()).repos
+
         ready = True
-        for repo in root.findall('result'):
+        for repo in repos:
             # ignore ports. 'factory' is used by arm for repos that are not
             # meant to use the totest manager.
             if repo.get('repository') in ('ports', 'factory', 'images_staging'):
@@ -25,6 +25,10 @@ class ToTestReleaser(ToTestManager):
     def release(self, project, force=False):
         self.setup(project)
 
+        with self.build_snapshot():
+            return self._release_snapshot(force)
+
+    def _release_snapshot(self, force):
         testing_snapshot = self.get_status('testing')
         if not testing_snapshot and not force:
             self.logger.debug("No snapshot in testing, waiting for publisher to tell us")
@@ -97,18 +101,13 @@ class ToTestReleaser(ToTestManager):
     def package_ok(self, prjresult, project, package, repository, arch):
         """Checks one package in a project and returns True if it's succeeded"""
 
-        status = prjresult.xpath(f'result[@repository="{repository}"][@arch="{arch}"]/'
-                                 f'status[@package="{package}"]')
-
-        failed = [s for s in status if s.get('code') != 'succeeded']
-        if len(failed):
-            self.logger.info(
-                f"{project} {package} {repository} {arch} -> {failed[0].get('code')}")
+        code = prjresult.code(repository, arch, package)
+        if code is None:
+            self.logger.info(f'No "succeeded" for {project} {package} {repository} {arch}')
             return False
 
-        succeeded = [s for s in status if s.get('code') == 'succeeded']
-        if not len(succeeded):
-            self.logger.info(f'No "succeeded" for {project} {package} {repository} {arch}')
+        if code != 'succeeded':
+            self.logger.info(f"{project} {package} {repository} {arch} -> {code}")
             return False
 
         maxsize = self.maxsize_for_package(package, arch)
@@ -197,13 +196,16 @@ class ToTestReleaser(ToTestManager):
 
         """
 
+        with self.build_snapshot():
+            return self._is_snapshotable()
+
+    def _is_snapshotable(self):
         if not self.all_repos_done(self.project.name):
             return False
 
         all_ok = True
 
-        resultxml = self.api.retried_GET(self.api.makeurl(['build', self.project.name, '_result']))
-        prjresult = ET.parse(resultxml).getroot()
+        prjresult = self.build_result(self.project.name)
 
         for product in self.project.ftp_products + self.project.main_products:
             if not self.package_ok(prjresult, self.project.name, product, self.project.product_repo, self.project.product_arch):
@@ -224,8 +226,7 @@ class ToTestReleaser(ToTestManager):
             if not self.all_repos_done(liveprjname):
                 return False
 
-            liveresultxml = self.api.retried_GET(self.api.makeurl(['build', liveprjname, '_result']))
-            liveprjresult = ET.parse(liveresultxml).getroot()
+            liveprjresult = self.build_result(liveprjname)
             for product in self.project.livecd_products:
                 for arch in product.archs:
                     if not self.package_ok(liveprjresult, liveprjname, product.package,